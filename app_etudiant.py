@@ -1,7 +1,6 @@
 # app_etudiant.py — version .xlsm (macro-enabled)
 
 import os
-import json
 import hashlib
 import datetime
 import openpyxl
@@ -10,22 +9,28 @@ import re
 
 from auth import (
     get_conn,
+    transaction,
+    record_deposit,
     record_submission,
+    enqueue_job,
     list_submissions_by_user,
     change_password,
 )
 
+from worker import ANALYZE
+
+try:
+    import restore  # restauration DATA_DIR en arrière-plan (main.py)
+except Exception:
+    restore = None
+
 DATA_DIR      = os.environ.get("DATA_DIR", "/tmp")  # même valeur que côté prof
 GLOBAL_COPIES = os.path.join(DATA_DIR, "copies_generees")
 CLASS_ROOT    = os.path.join(DATA_DIR, "classes")
 DEPOSIT_DIR   = os.path.join(DATA_DIR, "copies_etudiants")
-NOTIF_PATH    = os.path.join(DATA_DIR, "notif_depot.json")
 
 os.makedirs(GLOBAL_COPIES, exist_ok=True)
 os.makedirs(DEPOSIT_DIR, exist_ok=True)
-if not os.path.exists(NOTIF_PATH):
-    with open(NOTIF_PATH, "w", encoding="utf-8") as f:
-        json.dump([], f)
 
 STUDENT_CSS = """
 <style>
@@ -62,16 +67,26 @@ def _copy_filename_for(user_id: str, first_name: str, last_name: str) -> str:
         return "".join(c for c in s if c.isalnum() or c in ("-", "_"))
     return f"{user_id}_{clean(last_name)}_{clean(first_name)}.xlsm"
 
+def _restore_class(slug: str):
+    """Démarrage à froid : rapatrier les fichiers de la classe avant de chercher la copie."""
+    prog = restore.progress() if restore else None
+    if prog and prog["state"] != "done":
+        with st.spinner("Restauration de votre copie…"):
+            restore.ensure(f"classes/{slug}/")
+            restore.ensure(f"copies/{slug}/")
+
 def _candidate_copy_paths(user: dict) -> list[str]:
     # Cherche la copie dans copies_generees/ et dans classes/<slug>/copies_generees/
     fn_prefix = user["id"]
     paths = []
+    cls = user.get("class_name") or ""
+    if cls:
+        _restore_class(_slugify(cls))
     # global
     for f in os.listdir(GLOBAL_COPIES):
         if f.startswith(fn_prefix) and f.endswith(".xlsm"):  # <<< .xlsm
             paths.append(os.path.join(GLOBAL_COPIES, f))
     # par classe
-    cls = user.get("class_name") or ""
     if cls:
         slug = _slugify(cls)
         cdir = os.path.join(CLASS_ROOT, slug, "copies_generees")
@@ -158,23 +173,21 @@ def run(user):
                 final_name = f"{ts}__{nom_standard}"
 
                 save_path = os.path.join(DEPOSIT_DIR, final_name)
-                with open(save_path, "wb") as out_file:
-                    out_file.write(fichier_upload.getbuffer())
-
-                # Notif pour l'espace prof
-                try:
-                    with open(NOTIF_PATH, "r", encoding="utf-8") as f:
-                        notifs = json.load(f)
-                except Exception:
-                    notifs = []
-                if final_name not in notifs:
-                    notifs.append(final_name)
-                    with open(NOTIF_PATH, "w", encoding="utf-8") as f:
-                        json.dump(notifs, f)
-
-                # Trace en BD
+                data = fichier_upload.getbuffer()
+                tmp_path = f"{save_path}.part"
+                with open(tmp_path, "wb") as out_file:
+                    out_file.write(data)
+                os.replace(tmp_path, save_path)
+
+                # Registre des dépôts (notif prof) + trace en BD, dans une même transaction
                 conn = get_conn()
-                record_submission(conn, user["id"], final_name, status="received")
+                with transaction(conn):
+                    record_deposit(conn, user["id"], final_name,
+                                   size=len(data), sha256=hashlib.sha256(data).hexdigest(),
+                                   class_name=user.get("class_name"))
+                    record_submission(conn, user["id"], final_name, status="received")
+                    # analyse automatique par le worker (rapport prêt quand le prof ouvre le dépôt)
+                    enqueue_job(conn, ANALYZE, final_name, user_id=user["id"])
 
                 st.success("✅ Dépôt effectué avec succès.")
                 with st.expander("Détails techniques (optionnel)"):
@@ -1,22 +1,43 @@
 # app_prof.py — Espace professeur (classes, copies, dépôts, rapports) — version .xlsm
-import os, json, re, shutil, glob
+import os, json, re, shutil, glob, time
 import streamlit as st
 import streamlit.components.v1 as components
-from datetime import datetime
 
 # --- Supabase (optionnel : on continue même si non dispo)
 try:
     # helpers présents dans ton projet (à compléter dans supa.py)
-    from supa import upload_file, delete_prefix
+    from supa import upload_file, upload_many, delete_prefix, delete_prefix_report, cache_stats
     _SUPA_OK = True
 except Exception:
+    cache_stats = None
     upload_file = None
+    upload_many = None
     delete_prefix = None
+    delete_prefix_report = None
     _SUPA_OK = False
 
 from compare_excels import comparer_etudiant
-from auth import get_conn, list_submissions, change_password, import_students_csv
-from hash_generator import generate_student_files_csv
+from history_index import INDEX_NAME as HISTORY_INDEX, entries as history_entries, forget as forget_history
+from auth import (
+    get_conn, transaction, list_submissions_with_class, count_submissions,
+    change_password, import_students_csv,
+    list_deposits, set_deposit_status, get_deposit_cursor, mark_deposits_seen,
+    outbox_pending, dispatch_outbox,
+    job_statuses, jobs_summary, claim_job, finish_job, fail_job,
+    create_batch, cancel_batch, resume_batch, list_batches, batch_progress, batch_items,
+)
+from worker import (
+    ANALYZE, GENERATE, UPLOAD, INTEGRITY, ANALYSIS_WORKERS,
+    is_active as worker_active, run as run_batch,
+)
+from hash_generator import load_students, stale_students, template_fingerprint
+from bundles import class_copies_zip, reports_zip, lazy_zip, lazy_file
+import report_view
+
+try:
+    import restore  # restauration DATA_DIR en arrière-plan (main.py)
+except Exception:
+    restore = None
 
 # ---------------- Dossiers & chemins ----------------
 DATA_DIR        = os.environ.get("DATA_DIR", "/tmp")  # /tmp sur Render free
@@ -25,7 +46,12 @@ TEMPLATE_PATH   = os.path.join(DATA_DIR, "Fichier_Excel_Professeur_Template.xlsm
 DEPOSITS_DIR    = os.path.join(DATA_DIR, "copies_etudiants")
 REPORTS_DIR     = os.path.join(DATA_DIR, "rapports_etudiants")
 HISTORY_DIR     = os.path.join(DATA_DIR, "historique_reponses")
-NOTIF_PATH      = os.path.join(DATA_DIR, "notif_depot.json")
+
+# Nb de processus pour la génération des copies (0 = nb de cœurs)
+GEN_WORKERS     = int(os.environ.get("GEN_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+TEMPLATE_VERSION = "v1.0.0"
+# Rafraîchissement du panneau des lots en cours (s)
+BATCH_REFRESH_SECS = float(os.environ.get("BATCH_REFRESH_SECS", "3"))
 
 # Template “bundlé” dans le repo (même dossier que ce fichier)
 BUNDLED_TEMPLATE = os.path.join(os.path.dirname(__file__), "Fichier_Excel_Professeur_Template.xlsm")
@@ -36,9 +62,6 @@ os.makedirs(CLASSES_ROOT, exist_ok=True)
 os.makedirs(DEPOSITS_DIR, exist_ok=True)
 os.makedirs(REPORTS_DIR, exist_ok=True)
 os.makedirs(HISTORY_DIR, exist_ok=True)
-if not os.path.exists(NOTIF_PATH):
-    with open(NOTIF_PATH, "w", encoding="utf-8") as f:
-        json.dump([], f)
 
 # Auto-provision du template au démarrage (si absent dans DATA_DIR)
 try:
@@ -99,14 +122,23 @@ def _class_csv(slug: str) -> str: return os.path.join(_class_dir(slug), "liste_e
 def _class_copies_dir(slug: str) -> str: return os.path.join(_class_dir(slug), "copies_generees")
 def _class_hash_log(slug: str) -> str: return os.path.join(_class_dir(slug), f"hash_records_{slug}.csv")
 
+def _restore_class(slug: str):
+    """Restauration en cours au démarrage : rapatrier d'abord les fichiers de cette classe."""
+    prog = restore.progress() if restore else None
+    if prog and prog["state"] != "done":
+        with st.spinner("Restauration des fichiers de la classe…"):
+            restore.ensure(f"classes/{slug}/")
+            restore.ensure(f"copies/{slug}/")
+
 def _ensure_class(slug: str, name: str = None):
     os.makedirs(_class_dir(slug), exist_ok=True)
     os.makedirs(_class_copies_dir(slug), exist_ok=True)
     if name:
         with open(_class_meta_path(slug), "w", encoding="utf-8") as f:
             json.dump({"name": name, "slug": slug}, f, ensure_ascii=False, indent=2)
+        _bump("classes")
 
-def _load_classes():
+def _scan_classes():
     """Charge d’abord depuis le système de fichiers. Secours : si vide, lit DISTINCT class_name depuis la BD."""
     out = []
     # 1) FS
@@ -143,84 +175,279 @@ def _load_classes():
             pass
     return out
 
-# ---------------- Notifications & filtrage par classe ----------------
-def _load_notifs():
-    if os.path.exists(NOTIF_PATH):
-        with open(NOTIF_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-def _save_notifs(lst):
-    with open(NOTIF_PATH, "w", encoding="utf-8") as f:
-        json.dump(lst, f)
-
-def _cleanup_notifs():
-    notifs = _load_notifs()
-    valid = [f for f in notifs if os.path.exists(os.path.join(DEPOSITS_DIR, f))]
-    if len(valid) != len(notifs):
-        _save_notifs(valid)
-    return valid
-
-def _user_class(user_id: str) -> str | None:
-    conn = get_conn()
-    row = conn.execute("SELECT class_name FROM users WHERE id=?", (user_id,)).fetchone()
-    return row[0] if row and row[0] else None
+# ---------------- Couche d'accès aux données (mémoïsée) ----------------
+# Streamlit ré-exécute run() à chaque interaction : les lectures (classes, historique,
+# soumissions) sont mises en cache par processus (st.cache_data) et la clé de cache
+# porte une version de données, incrémentée par les écritures de cette app
+# (création / suppression de classe, import, suppression d'historique), plus un
+# marqueur bon marché pour ce qui est écrit ailleurs (mtime d'un dossier ou de
+# l'index d'historique, dernier id de soumission, avancement de la restauration).
+_DATA_VERSION = {"classes": 0, "members": 0, "history": 0, "submissions": 0}
+
+def _bump(*domains: str):
+    for d in domains:
+        _DATA_VERSION[d] += 1
 
-def _id_from_deposit(filename: str) -> str | None:
+def _mtime(path: str) -> int:
     try:
-        after = filename.split("__", 1)[1]
-        return after.split("_", 1)[0]
-    except Exception:
-        return None
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+def _restore_key():
+    prog = restore.progress() if restore else None
+    return None if not prog or prog["state"] == "done" else prog["done"]
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _classes_cached(version: int, root_mtime: int, restore_key):
+    return _scan_classes()
 
-def _filter_deposits_by_class(target_class: str):
-    files = _cleanup_notifs()
+def _load_classes():
+    return _classes_cached(_DATA_VERSION["classes"], _mtime(CLASSES_ROOT), _restore_key())
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _history_cached(version: int, index_mtime: int, dir_mtime: int):
+    return history_entries(HISTORY_DIR)
+
+def _submissions_marker() -> int:
+    # un seul SELECT indexé (clé primaire) : change à chaque nouveau dépôt
+    return get_conn().execute("SELECT COALESCE(MAX(id), 0) FROM submissions").fetchone()[0]
+
+# Rapports : clé = chemin + mtime + taille (un rapport réécrit par une nouvelle analyse
+# est relu une fois) ; rien du contenu n'est gardé dans st.session_state
+@st.cache_data(show_spinner=False, max_entries=8)
+def _report_cached(path: str, mtime_ns: int, size: int) -> dict:
+    return report_view.load_report(path)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _report_html_cached(path: str, mtime_ns: int, size: int, indices: tuple) -> str:
+    return report_view.render(_report_cached(path, mtime_ns, size), indices)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _report_text_cached(path: str, mtime_ns: int, size: int) -> tuple[str, bool]:
+    return report_view.read_text(path)
+
+def _file_key(path: str | None):
+    """(mtime_ns, taille) du fichier, None s'il n'existe pas."""
+    if not path:
+        return None
+    try:
+        stt = os.stat(path)
+    except OSError:
+        return None
+    return stt.st_mtime_ns, stt.st_size
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _count_submissions_cached(class_name, version: int, marker: int) -> int:
+    return count_submissions(get_conn(), class_name)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _submissions_page_cached(class_name, limit: int, offset: int, version: int, marker: int) -> list[dict]:
+    return [dict(r) for r in list_submissions_with_class(get_conn(), class_name, limit=limit, offset=offset)]
+
+def _upload_is_new(key: str, up) -> bool:
+    """Un st.file_uploader garde son fichier d'un rerun à l'autre : ne l'écrire qu'une fois."""
+    fid = getattr(up, "file_id", None) or (up.name, up.size)
+    if st.session_state.get(key) == fid:
+        return False
+    st.session_state[key] = fid
+    return True
+
+# ---------------- Registre des dépôts & filtrage par classe ----------------
+def _bump_class_map():
+    """Appartenance élèves -> classes modifiée (import, suppression de classe)."""
+    _bump("members", "submissions")
+    _invalidate_deposits()
+
+def _pending_deposits(viewer: str) -> list[dict]:
+    """
+    Dépôts non encore "vus" par le prof (id > son curseur), par ordre d'arrivée.
+    Lecture incrémentale : la session garde les lignes déjà lues, seuls les
+    nouveaux dépôts (id > dernier id lu) sont demandés à la BD à chaque rerun.
+    Chaque ligne porte student_class (jointure users) : le filtrage par classe
+    se fait en mémoire, sans requête par fichier.
+    """
+    conn = get_conn()
+    floor = get_deposit_cursor(conn, viewer)
+    cache = st.session_state.get("dep_cache")
+    if (not cache or cache["viewer"] != viewer or cache["floor"] != floor
+            or cache.get("classes_v") != _DATA_VERSION["members"]):
+        cache = {"viewer": viewer, "floor": floor, "last_id": floor, "rows": [],
+                 "classes_v": _DATA_VERSION["members"]}
+    new = list_deposits(conn, after_id=cache["last_id"])
+    if new:
+        cache["rows"] = cache["rows"] + [dict(r) for r in new]
+        cache["last_id"] = new[-1]["id"]
+    st.session_state["dep_cache"] = cache
+    return cache["rows"]
+
+def _invalidate_deposits():
+    st.session_state.pop("dep_cache", None)
+
+def _deposit_missing(fn: str):
+    """Fichier déposé absent du disque : on le sort du registre (au lieu de stat() à chaque rerun)."""
+    set_deposit_status(get_conn(), fn, "missing")
+    _invalidate_deposits()
+
+def _filter_deposits_by_class(rows: list[dict], target_class: str):
     if not target_class:
-        return files
-    kept = []
-    for fn in files:
-        uid = _id_from_deposit(fn)
-        if not uid:
-            continue
-        if _user_class(uid) == target_class:
-            kept.append(fn)
-    return kept
+        return [r["path"] for r in rows]
+    return [r["path"] for r in rows if r.get("student_class") == target_class]
+
+_JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+def _report_paths(deposit: str) -> tuple[str, str]:
+    base = os.path.splitext(os.path.basename(deposit))[0]
+    return (os.path.join(REPORTS_DIR, f"{base}_rapport.txt"), os.path.join(REPORTS_DIR, f"{base}_rapport.html"))
+
+def _select_report(deposit: str):
+    """Rapport déjà produit (worker ou analyse précédente) : affiché dès qu'il existe (chemins seulement)."""
+    txt_path, html_path = _report_paths(deposit)
+    st.session_state.update(report_txt_path=txt_path if os.path.exists(txt_path) else None,
+                            report_html_path=html_path if os.path.exists(html_path) else None)
+
+def _clear_report():
+    st.session_state.update(report_txt_path=None, report_html_path=None)
+
+def _analyze_now(conn, deposit: str, user_id: str | None = None) -> str | None:
+    """Analyse immédiate (bouton) ; None si le worker est déjà dessus (ou sur un autre dépôt de l'étudiant)."""
+    job = claim_job(conn, ANALYZE, deposit, user_id)  # réservé : le worker ne la prendra pas
+    if job is None:
+        return None
+    try:
+        res = comparer_etudiant(os.path.join(DEPOSITS_DIR, deposit))
+    except Exception as e:
+        fail_job(conn, job["id"], e)
+        raise
+    set_deposit_status(conn, deposit, "analyzed", analyzed=True)
+    finish_job(conn, job["id"], res)
+    return res
+
+# ---------------- Lots (worker.py) ----------------
+_BATCH_KINDS = {ANALYZE: "🧪 Analyse", GENERATE: "⚡ Génération", UPLOAD: "☁️ Envoi", INTEGRITY: "🛡️ Intégrité"}
+_BATCH_STATUS = {"running": "⚙️ en cours", "done": "✅ terminé", "cancelled": "⏹️ annulé", "failed": "❌ échec"}
+
+def _fmt_secs(secs) -> str:
+    if secs is None:
+        return "—"
+    secs = int(secs)
+    if secs >= 3600:
+        return f"{secs // 3600} h {secs % 3600 // 60:02d}"
+    return f"{secs // 60} min {secs % 60:02d}" if secs >= 60 else f"{secs} s"
+
+def _batch_text(p: dict) -> str:
+    b = p["batch"]
+    return (f"{_BATCH_KINDS.get(b['kind'], b['kind'])} — {b['label'] or ''} : {p['finished']}/{p['total']} "
+            f"• {p['rate'] * 60:.1f}/min • reste ≈ {_fmt_secs(p['eta'])}")
+
+def _drain_here(batch_id: int, concurrency: int):
+    """
+    Aucun worker actif : le lot (puis les lots qu'il a créés, ex. envoi après génération)
+    s'exécute dans l'app. Interrompu (rerun, redémarrage), il reprendra où il en était.
+    """
+    conn = get_conn()
+    bar = st.progress(0.0, text="Démarrage du lot…")
+    pending = [batch_id]
+    while pending:
+        bid = pending.pop(0)
+        run_batch(concurrency, batch_id=bid,
+                  on_progress=lambda p: bar.progress(p["finished"] / max(p["total"], 1), text=_batch_text(p)))
+        pending += [b["id"] for b in list_batches(conn, limit=5)
+                    if b["id"] > bid and b["finished_at"] is None and b["id"] not in pending]
+    bar.empty()
+
+def _start_batch(kind: str, items: list, label: str, params: dict | None = None, *,
+                 concurrency: int = ANALYSIS_WORKERS, created_by: str | None = None) -> int:
+    """Crée un lot ; le worker le prend en charge, sinon il s'exécute ici."""
+    bid = create_batch(get_conn(), kind, items, label=label, params=params, created_by=created_by)
+    if not worker_active():
+        _drain_here(bid, concurrency)
+    return bid
+
+def _batch_details(conn, b: dict):
+    failed = batch_items(conn, b["id"], ("failed",))
+    if failed:
+        with st.expander(f"❌ {len(failed)} élément(s) en échec"):
+            for it in failed[:100]:
+                st.write(f"• {it['key']} : {(it['last_error'] or '')[:300]}")
+    if b["kind"] == INTEGRITY:
+        altered = []
+        for it in batch_items(conn, b["id"], ("done",)):
+            res = json.loads(it["result"] or "{}")
+            if res.get("n_changed") or res.get("issues"):
+                altered.append((it["key"], res))
+        if altered:
+            with st.expander(f"🛡️ {len(altered)} dépôt(s) altéré(s)", expanded=True):
+                for key, res in altered:
+                    st.write(f"• {key} : {res.get('n_changed', 0)} cellule(s) modifiée(s)"
+                             + (f" — {', '.join(res['issues'])}" if res.get("issues") else ""))
+
+def _batch_panel(kinds: list, key: str, concurrency: int = ANALYSIS_WORKERS):
+    """Derniers lots de ces types : avancement, débit, ETA, annuler / reprendre. Rafraîchi tant qu'un lot tourne."""
+    conn = get_conn()
+    batches = list_batches(conn, kinds, limit=3)
+    if not batches:
+        return
+    live = any(b["finished_at"] is None for b in batches)
+
+    def _render():
+        live_key = f"{key}_live_batches"
+        was_live = st.session_state.get(live_key, set())
+        now_live = set()
+        for b in list_batches(conn, kinds, limit=3):
+            p = batch_progress(conn, b["id"])
+            if b["finished_at"] is None:
+                now_live.add(b["id"])
+            st.progress(p["finished"] / max(p["total"], 1), text=_batch_text(p))
+            st.caption(f"{_BATCH_STATUS.get(b['status'], b['status'])} • {p['done']} ok, {p['failed']} échec(s), "
+                       f"{p['queued']} en file, {p['running']} en cours, {p['cancelled']} annulé(s)"
+                       + (f" • {b['error']}" if b.get("error") else ""))
+            c1, c2 = st.columns(2)
+            if b["status"] == "running" and (p["queued"] or p["running"]):
+                if c1.button("⏹️ Annuler", key=f"{key}_cancel_{b['id']}", use_container_width=True):
+                    n = cancel_batch(conn, b["id"])
+                    st.info(f"⏹️ {n} élément(s) retiré(s) de la file ; ceux en cours se terminent.")
+            elif p["cancelled"] or p["failed"]:
+                if c2.button("▶️ Reprendre", key=f"{key}_resume_{b['id']}", use_container_width=True):
+                    n = resume_batch(conn, b["id"])
+                    st.info(f"▶️ {n} élément(s) remis en file.")
+                    if n and not worker_active():
+                        _drain_here(b["id"], concurrency)
+            _batch_details(conn, b)
+        st.session_state[live_key] = now_live
+        if was_live - now_live:
+            st.rerun(scope="app")  # un lot vient de finir : rapports, icônes, copies à jour
+
+    st.fragment(_render, run_every=BATCH_REFRESH_SECS if live and worker_active() else None)()
 
 # ---------------- Historique helpers ----------------
 def _history_list():
-    entries = []
-    for fname in sorted(os.listdir(HISTORY_DIR)):
-        if not fname.lower().endswith(".json"):
-            continue
-        sid = os.path.splitext(fname)[0]
-        path = os.path.join(HISTORY_DIR, fname)
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f) or []
-        except Exception:
-            data = []
-        count = len(data)
-        last_ts = data[-1].get("timestamp") if count else "-"
-        entries.append({"id": sid, "path": path, "count": count, "last_ts": last_ts})
-    return entries
+    # index tenu par compare_excels._save_history : aucun snapshot n'est relu ici
+    return _history_cached(_DATA_VERSION["history"], _mtime(os.path.join(HISTORY_DIR, HISTORY_INDEX)),
+                           _mtime(HISTORY_DIR))
 
 def _delete_history(student_id: str) -> bool:
     path = os.path.join(HISTORY_DIR, f"{student_id}.json")
     if os.path.exists(path):
         try:
-            os.remove(path); return True
+            os.remove(path)
         except Exception:
             return False
+        forget_history(HISTORY_DIR, student_id)
+        _bump("history")
+        return True
     return False
 
 def _delete_all_history() -> int:
     n = 0
     for fname in os.listdir(HISTORY_DIR):
-        if fname.lower().endswith(".json"):
+        if fname.lower().endswith(".json") and not fname.startswith("."):
             try:
                 os.remove(os.path.join(HISTORY_DIR, fname)); n += 1
             except Exception:
                 pass
+    forget_history(HISTORY_DIR)
+    _bump("history")
     return n
 
 # ---------------- Suppression de classe ----------------
@@ -228,6 +455,7 @@ def _delete_class_local(slug: str) -> tuple[bool, str]:
     """Efface le dossier local /tmp/classes/<slug> entièrement."""
     try:
         shutil.rmtree(_class_dir(slug), ignore_errors=True)
+        _bump("classes")
         return True, f"Dossier local supprimé: {_class_dir(slug)}"
     except Exception as e:
         return False, f"Erreur suppression locale: {e}"
@@ -235,13 +463,18 @@ def _delete_class_local(slug: str) -> tuple[bool, str]:
 def _delete_class_supabase(slug: str) -> list[str]:
     """Supprime les objets dans Storage: copies/<slug>/, classes/<slug>/, backups/<slug>/ (si existe)."""
     logs = []
-    if not (_SUPA_OK and callable(delete_prefix)):
+    if not (_SUPA_OK and callable(delete_prefix_report)):
         logs.append("Supabase indisponible: saut de la suppression Storage.")
         return logs
     for prefix in [f"copies/{slug}/", f"classes/{slug}/", f"backups/{slug}/"]:
         try:
-            ok = delete_prefix(prefix)  # True si au moins un objet supprimé
-            logs.append(f"Storage • rm -r {prefix} : {'OK' if ok else 'rien à supprimer'}")
+            rep = delete_prefix_report(prefix)  # listing paginé + suppression par lots
+            if not rep["found"]:
+                logs.append(f"Storage • rm -r {prefix} : rien à supprimer")
+            else:
+                logs.append(f"Storage • rm -r {prefix} : {rep['removed']}/{rep['found']} objet(s) supprimé(s)")
+            for c in rep["errors"]:
+                logs.append(f"Storage • {prefix} : lot de {len(c['paths'])} en échec ({c['error']})")
         except Exception as e:
             logs.append(f"Storage • rm -r {prefix} : erreur {e}")
     return logs
@@ -250,17 +483,19 @@ def _delete_class_db(class_name: str) -> list[str]:
     """Optionnel: purge BD (users & submissions) pour class_name."""
     logs = []
     try:
-        conn = get_conn()
-        # submissions liées
-        conn.execute("""
-            DELETE FROM submissions
-            WHERE user_id IN (SELECT id FROM users WHERE class_name = ?)
-        """, (class_name,))
-        n1 = conn.total_changes
-        # comptes
-        conn.execute("DELETE FROM users WHERE class_name = ?", (class_name,))
-        n2 = conn.total_changes - n1
-        conn.commit()
+        # connexion partagée : compter par requête (rowcount), pas via total_changes
+        with transaction(get_conn()) as conn:
+            # registre des dépôts + submissions liées
+            conn.execute("""
+                DELETE FROM deposits
+                WHERE user_id IN (SELECT id FROM users WHERE class_name = ?)
+            """, (class_name,))
+            n1 = conn.execute("""
+                DELETE FROM submissions
+                WHERE user_id IN (SELECT id FROM users WHERE class_name = ?)
+            """, (class_name,)).rowcount
+            # comptes
+            n2 = conn.execute("DELETE FROM users WHERE class_name = ?", (class_name,)).rowcount
         logs.append(f"BD • submissions supprimées: {n1}")
         logs.append(f"BD • users supprimés: {n2}")
     except Exception as e:
@@ -270,10 +505,8 @@ def _delete_class_db(class_name: str) -> list[str]:
 # ---------------- Vue PROF ----------------
 def run(user):
     # State d’affichage rapport
-    st.session_state.setdefault("report_text", None)
     st.session_state.setdefault("report_txt_path", None)
     st.session_state.setdefault("report_html_path", None)
-    st.session_state.setdefault("report_file", None)
 
     st.markdown(PROF_CSS, unsafe_allow_html=True)
     st.markdown(
@@ -321,13 +554,14 @@ def run(user):
                 st.markdown('<div class="card note"><b>Configurer / synchroniser une classe</b></div>', unsafe_allow_html=True)
                 choices = {c["slug"]: c["name"] for c in classes}
                 chosen = st.selectbox("Classe :", list(choices.keys()), format_func=lambda s: choices[s])
+                _restore_class(chosen)
 
                 # Upload CSV étudiants
                 up = st.file_uploader(
                     "Uploader liste_etudiants.csv (colonnes: id, nom, prenom, email)",
                     type=["csv"]
                 )
-                if up is not None:
+                if up is not None and _upload_is_new(f"csv_up_{chosen}", up):
                     _ensure_class(chosen)
                     csv_path = _class_csv(chosen)
                     with open(csv_path, "wb") as f:
@@ -339,7 +573,7 @@ def run(user):
                             + (f"<code>{TEMPLATE_PATH}</code>" if os.path.exists(TEMPLATE_PATH) else "<b>introuvable</b>")
                             + "</div>", unsafe_allow_html=True)
                 tpl_up = st.file_uploader("Uploader le Fichier_Excel_Professeur_Template.xlsm", type=["xlsm"], key="tpl_up")
-                if tpl_up is not None:
+                if tpl_up is not None and _upload_is_new("tpl_up_saved", tpl_up):
                     try:
                         with open(TEMPLATE_PATH, "wb") as f:
                             f.write(tpl_up.getbuffer())
@@ -408,13 +642,30 @@ def run(user):
                                 send_email=send_creds,
                                 login_url=login_url or None
                             )
+                            _bump_class_map()
                             st.success(f"✅ Synchro : {stats['created']} créé(s), {stats['updated']} MAJ.")
                             if send_creds:
                                 st.info(f"✉️ Emails envoyés : {stats.get('emailed', 0)}")
+                                if stats.get("email_pending"):
+                                    st.warning(f"⏳ {stats['email_pending']} email(s) en échec, gardé(s) en file d'envoi.")
+
+                    n_pending = outbox_pending(get_conn())
+                    if n_pending:
+                        st.caption(f"📬 {n_pending} email(s) en attente de renvoi.")
+                        if st.button("📧 Relancer les emails en attente", use_container_width=True, key="btn_outbox"):
+                            bar = st.progress(0.0, text="Envoi des emails…")
+                            res = dispatch_outbox(get_conn(), force=True, progress_callback=lambda d, t: bar.progress(
+                                d / t, text=f"Envoi des emails… {d}/{t}"))
+                            bar.empty()
+                            st.info(f"✉️ Envoyés : {res['sent']} • encore en file : {res['pending']} "
+                                    f"• abandonnés : {res['failed']}")
                 # ================================
 
                 # ======= GÉNÉRER =======
                 with colB:
+                    regen_all = st.checkbox("Tout régénérer", value=False, key="regen_all",
+                                            help="Par défaut, seules les copies manquantes ou périmées "
+                                                 "(nouvel élève, nom modifié, template changé) sont générées.")
                     if st.button("⚡ Générer les copies"):
                         csv_path = _class_csv(chosen)
                         if not os.path.exists(csv_path):
@@ -425,39 +676,24 @@ def run(user):
                             out_dir = _class_copies_dir(chosen)
                             log_path = _class_hash_log(chosen)
                             try:
-                                # 1) Génération locale
-                                generate_student_files_csv(
-                                    input_csv=csv_path,
-                                    template_path=TEMPLATE_PATH,   # .xlsm
-                                    output_folder=out_dir,
-                                    log_file=log_path
-                                )
-                                st.success(f"✅ Copies générées dans : {out_dir}")
+                                # Lot "generate" : une copie par élément, reprise après redémarrage ;
+                                # à la fin, fusion du log des hashs puis lot d'envoi Supabase
+                                # (seuls les fichiers dont le contenu a changé partent)
+                                etudiants = load_students(csv_path)
+                                fp = template_fingerprint(TEMPLATE_PATH, TEMPLATE_VERSION)
+                                todo = stale_students(etudiants, TEMPLATE_PATH, out_dir, log_path,
+                                                      TEMPLATE_VERSION, force=regen_all, fp=fp)
+                                params = {"slug": chosen, "csv": csv_path, "template": TEMPLATE_PATH,
+                                          "template_version": TEMPLATE_VERSION, "output_folder": out_dir,
+                                          "log_file": log_path, "fp": fp,
+                                          "upload": bool(_SUPA_OK and callable(upload_many))}
+                                _start_batch(GENERATE, [(f"{chosen}/{e['id']}", None, e) for e in todo],
+                                             chosen, params, concurrency=GEN_WORKERS, created_by=user["id"])
+                                st.success(f"⚡ {len(todo)} copie(s) à générer, {len(etudiants) - len(todo)} "
+                                           f"déjà à jour (sur {len(etudiants)}) dans : {out_dir}")
                                 st.info(f"Log des hashs : {log_path}")
-
-                                # 2) Upload Supabase (si dispo)
-                                if _SUPA_OK and callable(upload_file):
-                                    uploaded = 0
-                                    for fname in os.listdir(out_dir):
-                                        if fname.lower().endswith(".xlsm"):
-                                            local = os.path.join(out_dir, fname)
-                                            remote = f"copies/{chosen}/{fname}"
-                                            ct = "application/vnd.ms-excel.sheet.macroEnabled.12"
-                                            upload_file(local, remote, content_type=ct)
-                                            uploaded += 1
-                                    # CSV élèves + log hash
-                                    try:
-                                        upload_file(csv_path, f"classes/{chosen}/liste_etudiants.csv", content_type="text/csv")
-                                    except Exception:
-                                        pass
-                                    try:
-                                        upload_file(log_path, f"classes/{chosen}/{os.path.basename(log_path)}", content_type="text/csv")
-                                    except Exception:
-                                        pass
-                                    st.info(f"☁️ {uploaded} copie(s) envoyée(s) dans Supabase (copies/{chosen}/).")
-                                else:
+                                if not params["upload"]:
                                     st.caption("ℹ️ Upload Supabase désactivé (module indisponible).")
-
                             except Exception as e:
                                 st.error(f"❌ Erreur génération copies : {e}")
                 # ========================
@@ -468,7 +704,20 @@ def run(user):
                     st.caption(f"Copies : {_class_copies_dir(chosen)}")
                     st.caption(f"Hash log : {_class_hash_log(chosen)}")
                     st.caption(f"Template : {TEMPLATE_PATH}")
+                    cs = cache_stats() if cache_stats else None
+                    if cs:
+                        st.caption(f"Cache Storage : {cs['bytes'] / 1e6:.1f}/{cs['max_bytes'] / 1e6:.0f} Mo, "
+                                   f"{cs['hits']} hit(s), {cs['misses']} miss, {cs['evictions']} éviction(s)")
+                    # ZIP construit au clic (puis réutilisé tant que les copies ne changent pas)
+                    st.download_button(
+                        "📦 Toutes les copies (ZIP)",
+                        data=lazy_zip(class_copies_zip, _class_copies_dir(chosen), chosen),
+                        file_name=f"copies_{chosen}.zip",
+                        mime="application/zip",
+                        key="dl_copies_zip",
+                    )
 
+                _batch_panel([GENERATE, UPLOAD], "gen", concurrency=GEN_WORKERS)
                 st.divider()
 
                 # ======= SUPPRIMER LA CLASSE =======
@@ -497,8 +746,8 @@ def run(user):
                             class_name = dict((v,k) for k,v in {c['slug']:c['name'] for c in _load_classes()}.items()).get(chosen, chosen)
                             logs += _delete_class_db(class_name)
 
-                        # Nettoyer éventuels fichiers notifs obsolètes
-                        _save_notifs([f for f in _load_notifs() if not f.startswith(chosen)])
+                        # Appartenance élèves -> classes modifiée : relire le registre des dépôts
+                        _bump_class_map()
 
                         st.success("Suppression terminée.")
                         with st.expander("Détails"):
@@ -513,30 +762,55 @@ def run(user):
         class_filter = st.selectbox("Filtrer par classe :", ["(toutes)"] + [c["name"] for c in classes])
         selected_class = None if class_filter == "(toutes)" else class_filter
 
-        files = _filter_deposits_by_class(selected_class)
+        dep_rows = _pending_deposits(user["id"])
+        files = _filter_deposits_by_class(dep_rows, selected_class)
         st.markdown(f'<div class="card"><strong>🔔 Dépôts reçus :</strong> {len(files)}</div>', unsafe_allow_html=True)
+        summary = jobs_summary(get_conn(), ANALYZE)
+        if summary.get("queued") or summary.get("running") or summary.get("failed"):
+            st.caption(f"🤖 Analyse automatique : {summary.get('queued', 0)} en file, "
+                       f"{summary.get('running', 0)} en cours, {summary.get('done', 0)} terminée(s), "
+                       f"{summary.get('failed', 0)} en échec.")
 
         if not files:
             st.markdown('<div class="card">Aucun dépôt pour cette sélection.</div>', unsafe_allow_html=True)
-            st.session_state.update(report_text=None, report_txt_path=None, report_html_path=None, report_file=None)
+            _clear_report()
         else:
             left, right = st.columns([1.05, 1.95])
 
             with left:
                 st.markdown('<div class="card">', unsafe_allow_html=True)
-                fsel = st.selectbox("Choisir un dépôt :", files, index=0, key="deposit_select")
+                # sélecteur paginé : quelques centaines d'options au plus par rerun
+                page_size = st.selectbox("Dépôts par page", [50, 100, 250, 500], index=1, key="dep_page_size")
+                n_pages = max(1, -(-len(files) // page_size))
+                page = 1
+                if n_pages > 1:
+                    if st.session_state.get("dep_page", 1) > n_pages:
+                        st.session_state["dep_page"] = n_pages  # liste raccourcie depuis le dernier rerun
+                    page = st.number_input(f"Page (1–{n_pages})", min_value=1, max_value=n_pages, value=1, step=1,
+                                           key="dep_page")
+                page_files = files[(page - 1) * page_size: page * page_size]
+                statuses = job_statuses(get_conn(), ANALYZE, page_files)
+                fsel = st.selectbox(
+                    "Choisir un dépôt :", page_files, index=0, key="deposit_select",
+                    format_func=lambda fn: f"{_JOB_ICONS.get((statuses.get(fn) or {}).get('status'), '•')} {fn}",
+                )
+                if fsel:
+                    _select_report(fsel)
+                    job = statuses.get(fsel)
+                    if job and job["status"] == "failed" and job["last_error"]:
+                        st.caption(f"❌ Analyse automatique en échec : {job['last_error'][:300]}")
                 if fsel:
                     p = os.path.join(DEPOSITS_DIR, fsel)
                     if os.path.exists(p):
-                        with open(p, "rb") as fdep:
-                            st.download_button(
-                                "📥 Télécharger la copie sélectionnée",
-                                fdep, file_name=fsel,
-                                mime="application/vnd.ms-excel.sheet.macroEnabled.12",
-                                use_container_width=True
-                            )
+                        st.download_button(
+                            "📥 Télécharger la copie sélectionnée",
+                            data=lazy_file(p), file_name=fsel,
+                            mime="application/vnd.ms-excel.sheet.macroEnabled.12",
+                            use_container_width=True, key="dl_deposit",
+                        )
                     else:
                         st.error("❌ Fichier déposé introuvable.")
+                        _deposit_missing(fsel)
 
                 col1, col2 = st.columns(2)
                 with col1:
@@ -545,8 +819,12 @@ def run(user):
                             st.warning("Sélectionne un dépôt d'abord.")
                         else:
                             target = os.path.join(DEPOSITS_DIR, fsel)
-                            if os.path.exists(target):
-                                res = comparer_etudiant(target)
+                            owner = next((r["user_id"] for r in dep_rows if r["path"] == fsel), None)
+                            res = _analyze_now(get_conn(), fsel, owner) if os.path.exists(target) else ""
+                            if res is None:
+                                st.info("⚙️ Analyse automatique en cours (ce dépôt ou un autre du même étudiant) : "
+                                        "réessaie dans un instant.")
+                            elif res:
                                 st.success(res)
                                 txt_path, html_path = None, None
                                 try:
@@ -558,94 +836,114 @@ def run(user):
                                 except Exception:
                                     pass
 
-                                st.session_state.report_text = None
-                                st.session_state.report_txt_path = None
-                                if txt_path and os.path.exists(txt_path):
-                                    try:
-                                        with open(txt_path, "r", encoding="utf-8") as fr:
-                                            st.session_state.report_text = fr.read()
-                                        st.session_state.report_txt_path = txt_path
-                                        st.session_state.report_file = os.path.basename(txt_path)
-                                    except Exception:
-                                        pass
-
+                                # chemins seulement : le contenu est lu (et mis en cache) par le panneau rapport
+                                st.session_state.report_txt_path = txt_path if txt_path and os.path.exists(txt_path) else None
                                 st.session_state.report_html_path = html_path if html_path and os.path.exists(html_path) else None
                             else:
                                 st.error("Fichier sélectionné introuvable.")
                 with col2:
+                    bulk_kind = None
                     if st.button("🧪 Analyser tous les dépôts filtrés", use_container_width=True):
-                        with st.spinner("Analyse en cours..."):
-                            for f in files:
-                                p = os.path.join(DEPOSITS_DIR, f)
-                                if os.path.exists(p):
-                                    r = comparer_etudiant(p)
-                                    with st.expander(f"Rapport — {f}", expanded=False):
-                                        st.text(r)
-                                else:
-                                    st.warning(f"Fichier manquant : {f}")
+                        bulk_kind = ANALYZE
+                    if st.button("🛡️ Vérifier l'intégrité des dépôts filtrés", use_container_width=True):
+                        bulk_kind = INTEGRITY
+                if bulk_kind:
+                    owners = {r["path"]: r["user_id"] for r in dep_rows}
+                    present = []
+                    for f in files:
+                        if os.path.exists(os.path.join(DEPOSITS_DIR, f)):
+                            present.append(f)
+                        else:
+                            st.warning(f"Fichier manquant : {f}")
+                            _deposit_missing(f)
+                    # un élément par dépôt : le lot reprend après un redémarrage, annulable ci-dessous
+                    # (analyses : jamais deux du même étudiant en parallèle, cf. claim_jobs)
+                    _start_batch(bulk_kind, [(f, owners.get(f) if bulk_kind == ANALYZE else None, None)
+                                             for f in present],
+                                 selected_class or "toutes les classes", created_by=user["id"])
+                _batch_panel([ANALYZE, INTEGRITY], "dep")
+
+                st.download_button(
+                    "📦 Rapports des dépôts filtrés (ZIP)",
+                    data=lazy_zip(reports_zip, REPORTS_DIR, list(files), _slugify(selected_class or "toutes")),
+                    file_name=f"rapports_{_slugify(selected_class or 'toutes')}.zip",
+                    mime="application/zip",
+                    use_container_width=True,
+                    key="dl_reports_zip",
+                )
 
                 st.divider()
                 if st.button("📭 Réinitialiser les notifications", use_container_width=True):
-                    _save_notifs([])
+                    mark_deposits_seen(get_conn(), user["id"])
                     st.success("✅ Notifications réinitialisées.")
-                    st.session_state.update(report_text=None, report_txt_path=None, report_html_path=None, report_file=None)
+                    _clear_report()
                 st.markdown('</div>', unsafe_allow_html=True)
 
             with right:
                 st.markdown('<div class="card">', unsafe_allow_html=True)
                 st.subheader("📑 Rapport d'analyse")
 
-                if st.session_state.report_html_path and os.path.exists(st.session_state.report_html_path):
+                html_path, txt_path = st.session_state.report_html_path, st.session_state.report_txt_path
+                html_key, txt_key = _file_key(html_path), _file_key(txt_path)
+                if html_key:
+                    # petites sections rendues d'emblée, grosses tables à la demande (même mise en page)
+                    doc = _report_cached(html_path, *html_key)
+                    eager = tuple(k for k in range(len(doc["sections"])) if k not in doc["lazy"])
                     html_height = st.slider("Hauteur d'affichage du rapport (px)", 600, 2200, 1100, 50)
-                    with open(st.session_state.report_html_path, "r", encoding="utf-8") as fh:
-                        components.html(fh.read(), height=html_height, scrolling=True)
-                    with open(st.session_state.report_html_path, "rb") as fb:
-                        st.download_button("📥 Télécharger le rapport HTML",
-                                           fb,
-                                           file_name=os.path.basename(st.session_state.report_html_path),
-                                           use_container_width=True)
-
-                elif st.session_state.report_text:
-                    st.text_area("Contenu du rapport (TXT) :", value=st.session_state.report_text, height=420)
-                    if st.session_state.report_txt_path and os.path.exists(st.session_state.report_txt_path):
-                        with open(st.session_state.report_txt_path, "rb") as fb:
-                            st.download_button("📥 Télécharger le rapport TXT",
-                                               fb,
-                                               file_name=st.session_state.report_file or "rapport.txt",
-                                               use_container_width=True)
+                    components.html(_report_html_cached(html_path, *html_key, eager), height=html_height, scrolling=True)
+                    for k in doc["lazy"]:
+                        sec = doc["sections"][k]
+                        if st.toggle(f"Afficher : {sec['title'] or 'section'} ({sec['size'] / 1024:.0f} Ko)",
+                                     key=f"report_sec_{os.path.basename(html_path)}_{k}"):
+                            components.html(_report_html_cached(html_path, *html_key, (k,)),
+                                            height=html_height, scrolling=True)
+                    st.download_button("📥 Télécharger le rapport HTML",
+                                       data=lazy_file(html_path),
+                                       file_name=os.path.basename(html_path),
+                                       mime="text/html",
+                                       use_container_width=True, key="dl_report_html")
+
+                elif txt_key:
+                    text, truncated = _report_text_cached(txt_path, *txt_key)
+                    st.text_area("Contenu du rapport (TXT) :", value=text, height=420)
+                    if truncated:
+                        st.caption("✂️ Aperçu tronqué : le rapport complet est dans le téléchargement.")
+                    st.download_button("📥 Télécharger le rapport TXT",
+                                       data=lazy_file(txt_path),
+                                       file_name=os.path.basename(txt_path),
+                                       mime="text/plain",
+                                       use_container_width=True, key="dl_report_txt")
                 else:
                     st.info("Sélectionne un dépôt puis clique sur **🔍 Analyser ce dépôt** pour générer et afficher le rapport.")
                 st.markdown('</div>', unsafe_allow_html=True)
 
     # -------- 📈 Historique --------
     with tabs[2]:
-        conn = get_conn()
-        subs = list_submissions(conn)
         classes = _load_classes()
         names = [c["name"] for c in classes]
         chosen = st.selectbox("Filtrer historique par classe :", ["(toutes)"] + names)
         selected_class = None if chosen == "(toutes)" else chosen
 
-        def _row_class(uid: str) -> str:
-            row = conn.execute("SELECT class_name FROM users WHERE id=?", (uid,)).fetchone()
-            return row[0] if row and row[0] else ""
-
-        filtered = []
-        for r in subs:
-            cls = _row_class(r["user_id"])
-            if (not selected_class) or (cls == selected_class):
-                filtered.append({
-                    "date": r["submitted_at"],
-                    "user_id": r["user_id"],
-                    "classe": cls,
-                    "fichier": r["filename"],
-                    "statut": r["status"]
-                })
-
-        st.write(f"🗂️ {len(filtered)} dépôt(s) pour la sélection")
-        if filtered:
+        version, marker = _DATA_VERSION["submissions"], _submissions_marker()
+        total = _count_submissions_cached(selected_class, version, marker)
+        st.write(f"🗂️ {total} dépôt(s) pour la sélection")
+        if total:
+            cP, cS = st.columns([1, 1])
+            with cS:
+                page_size = st.selectbox("Lignes par page", [50, 100, 250, 500], index=1, key="hist_page_size")
+            n_pages = max(1, -(-total // page_size))
+            with cP:
+                page = st.number_input(f"Page (1–{n_pages})", min_value=1, max_value=n_pages, value=1, step=1,
+                                       key="hist_page")
+            subs = _submissions_page_cached(selected_class, page_size, (page - 1) * page_size, version, marker)
             import pandas as pd
-            st.dataframe(pd.DataFrame(filtered), use_container_width=True)
+            st.dataframe(pd.DataFrame([{
+                "date": r["submitted_at"],
+                "user_id": r["user_id"],
+                "classe": r["class_name"],
+                "fichier": r["filename"],
+                "statut": r["status"]
+            } for r in subs]), use_container_width=True)
         else:
             st.markdown('<div class="card">Aucun dépôt.</div>', unsafe_allow_html=True)
 
@@ -657,8 +955,9 @@ def run(user):
             st.info("Aucun historique enregistré pour le moment.")
         else:
             import pandas as pd
-            df_hist = pd.DataFrame(entries)[["id", "count", "last_ts"]].rename(
-                columns={"id":"ID étudiant", "count":"# snapshots", "last_ts":"Dernier enregistrement"}
+            df_hist = pd.DataFrame(entries)[["id", "count", "last_ts", "authenticity", "size"]].rename(
+                columns={"id":"ID étudiant", "count":"# snapshots", "last_ts":"Dernier enregistrement",
+                         "authenticity":"Dernière authenticité", "size":"Taille (octets)"}
             )
             st.dataframe(df_hist, use_container_width=True)
 
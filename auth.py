@@ -3,16 +3,22 @@
 # Env attendues principales :
 #   DATA_DIR
 #   SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_BUCKET, SUPABASE_DB_BACKUP_PATH
+#   DB_BACKUP_INTERVAL_SECS=30, DB_BACKUP_MAX_WRITES=50  (voir db_backup.py)
 #   ADMIN_ID, ADMIN_PASSWORD
+#   HASH_WORKERS=0  (processus bcrypt pour l'import CSV ; 0 = nb de CPU)
 #   # Anti-bruteforce (facultatif)
 #   MAX_LOGIN_FAIL=5, FAIL_WINDOW_SECS=900, LOCK_SECS=600
+#   THROTTLE_FLUSH_SECS=15  (état gardé en mémoire, écrit en BD périodiquement)
 #   # Email (voir mailer.py) :
 #   RESEND_API_KEY, RESEND_FROM
 #   SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_TLS, SMTP_FROM
 #   APP_BASE_URL  (URL de l'app à inclure dans les emails)
+#   OUTBOX_MAX_ATTEMPTS=5, OUTBOX_RETRY_SECS=60  (file d'envoi des emails, backoff exponentiel)
+#   JOB_MAX_ATTEMPTS=3, JOB_RETRY_SECS=30, JOB_LEASE_SECS=900  (file de travaux, voir worker.py)
 # -------------------------------------------------------------------------------
 
-import os, csv, uuid, sqlite3, re
+import os, csv, uuid, sqlite3, re, gzip, json, queue, hashlib, threading, atexit, time
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 
@@ -25,41 +31,179 @@ PWD_CTX = CryptContext(schemes=["bcrypt"], deprecated="auto")
 _SUPA_OK = False
 _DB_REMOTE_PATH = os.getenv("SUPABASE_DB_BACKUP_PATH", "backups/smartedittrack.db")
 try:
-    from supa import upload_file as _supa_upload, download_to_file as _supa_download
+    from supa import upload_bytes as _supa_upload_bytes, download_to_file as _supa_download
     _SUPA_OK = True
 except Exception:
     _SUPA_OK = False
 
+from db_backup import install as _install_backup
+from pools import process_pool
+
 # --- email helper
 try:
-    from mailer import send_credentials_email
+    from mailer import send_credentials_email, send_credentials_batch
 except Exception:
     def send_credentials_email(*a, **k):  # fallback inoffensif
         return False
+    def send_credentials_batch(items, **k):
+        return [{"email": it["email"], "user_id": it["user_id"], "ok": False, "error": "mailer indisponible"}
+                for it in items]
 
 def _restore_db_if_missing():
     if _SUPA_OK and (not os.path.exists(DB_PATH)):
-        ok = _supa_download(_DB_REMOTE_PATH, DB_PATH)
+        # backup compressé (db_backup), sinon ancien backup brut
+        tmp_gz = DB_PATH + ".restore.gz"
+        ok = False
+        if _supa_download(_DB_REMOTE_PATH + ".gz", tmp_gz):
+            try:
+                with gzip.open(tmp_gz, "rb") as fin, open(DB_PATH + ".restore", "wb") as fout:
+                    fout.write(fin.read())
+                os.replace(DB_PATH + ".restore", DB_PATH)
+                ok = True
+            except Exception as e:
+                print("[WARN] Backup DB compressé illisible:", e)
+            finally:
+                if os.path.exists(tmp_gz): os.remove(tmp_gz)
+        if not ok:
+            ok = _supa_download(_DB_REMOTE_PATH, DB_PATH)
         print("[bootstrap] DB restaurée depuis Supabase." if ok else "[bootstrap] Pas de backup DB trouvé.")
 
+def _upload_db_snapshot(data: bytes):
+    _supa_upload_bytes(data, _DB_REMOTE_PATH + ".gz", content_type="application/gzip")
+
+# Sauvegarde différée : les écritures marquent la base, un thread envoie l'instantané
+_BACKUP = _install_backup(DB_PATH, _upload_db_snapshot) if _SUPA_OK else None
+
 def _backup_db():
-    if _SUPA_OK and os.path.exists(DB_PATH):
-        try:
-            _supa_upload(DB_PATH, _DB_REMOTE_PATH, content_type="application/octet-stream")
-        except Exception as e:
-            print("[WARN] Échec backup DB:", e)
+    if _BACKUP is not None:
+        _BACKUP.mark_dirty()
 
-def get_conn():
-    _restore_db_if_missing()
+# ---------- Connexions : pool borné de connexions longue durée, WAL ----------
+# Chaque thread emprunte une connexion au 1er get_conn() et la rend au pool quand il se
+# termine : les threads de rerun Streamlit (un par exécution du script) réutilisent
+# les mêmes connexions au lieu d'en ouvrir une à chaque rerun.
+# DB_SYNCHRONOUS : NORMAL (défaut, sûr en WAL) | FULL | OFF
+# DB_POOL_SIZE=4  (connexions inactives gardées ouvertes ; au-delà, fermées au retour)
+_DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").strip().upper() or "NORMAL"
+_DB_POOL_SIZE = max(1, int(os.getenv("DB_POOL_SIZE", "4")))
+
+class _SharedConnection(sqlite3.Connection):
+    """
+    Connexion prêtée par get_conn() au thread courant.
+    close() est ignoré (la connexion est partagée) ; _tx_depth suit transaction().
+    """
+    _tx_depth = 0
+
+    def close(self):
+        pass
+
+class _Lease:
+    """Emprunt d'une connexion par un thread : rendue au pool à la fin du thread (_tls vidé)."""
+    __slots__ = ("conn",)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        _release(self.conn)
+
+_tls = threading.local()
+_pool = queue.LifoQueue(maxsize=_DB_POOL_SIZE)
+_init_lock = threading.Lock()
+_db_ready = False
+
+def _connect():
     conn = sqlite3.connect(
         DB_PATH,
         detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
         check_same_thread=False,
         timeout=30,
+        factory=_SharedConnection,
     )
-    ensure_schema(conn)
+    # WAL : les lectures ne bloquent plus les écritures (et inversement)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={_DB_SYNCHRONOUS}")
+    conn._pid = os.getpid()
+    return conn
+
+def _release(conn):
+    """Remet une connexion dans le pool (transaction laissée ouverte annulée) ; pool plein : fermeture."""
+    if getattr(conn, "_pid", None) != os.getpid():  # héritée d'un fork : ni réutilisée ni fermée ici
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn._tx_depth = 0
+        _pool.put_nowait(conn)
+    except Exception:  # pool plein, connexion inutilisable, arrêt de l'interpréteur
+        try:
+            sqlite3.Connection.close(conn)
+        except Exception:
+            pass
+
+def get_conn():
+    """Connexion du thread courant (empruntée au pool au 1er appel). Restauration + schéma : une fois par processus."""
+    global _db_ready
+    lease = getattr(_tls, "lease", None)
+    if lease is not None:
+        return lease.conn
+    conn = None
+    if not _db_ready:
+        with _init_lock:
+            if not _db_ready:
+                _restore_db_if_missing()
+                conn = _connect()
+                ensure_schema(conn, force=True)
+                _db_ready = True
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+    _tls.lease = _Lease(conn)
     return conn
 
+def _reset_after_fork():
+    # une connexion SQLite ne doit pas servir dans deux processus : le fils repart de zéro
+    global _tls, _pool, _init_lock
+    _tls = threading.local()
+    _pool = queue.LifoQueue(maxsize=_DB_POOL_SIZE)
+    _init_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+@contextmanager
+def transaction(conn):
+    """
+    Regroupe plusieurs écritures : un seul COMMIT (et une seule sauvegarde) à la fin,
+    ROLLBACK en cas d'exception. Les appels imbriqués rejoignent la transaction englobante.
+    """
+    depth = getattr(conn, "_tx_depth", 0)
+    conn._tx_depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        conn._tx_depth = depth
+        if depth == 0:
+            conn.rollback()
+        raise
+    conn._tx_depth = depth
+    if depth == 0:
+        conn.commit(); _backup_db()
+
+def _commit(conn):
+    """Commit + sauvegarde, sauf à l'intérieur de transaction() (commit unique à la fin)."""
+    if not getattr(conn, "_tx_depth", 0):
+        conn.commit(); _backup_db()
+
+def _commit_if(conn, changed):
+    """Commit ; sauvegarde seulement si quelque chose a changé (boucles de scrutation du worker)."""
+    if changed:
+        _commit(conn)
+    elif not getattr(conn, "_tx_depth", 0):
+        conn.commit()
+
 def _has_column(conn, table: str, col: str) -> bool:
     try:
         rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
@@ -68,7 +212,14 @@ def _has_column(conn, table: str, col: str) -> bool:
     except Exception:
         return False
 
-def ensure_schema(conn):
+# ---------- Schéma : migrations numérotées (PRAGMA user_version) ----------
+# Chaque migration est appliquée une seule fois, dans sa propre transaction,
+# puis user_version passe à son numéro. Pour faire évoluer le schéma : ajouter
+# une fonction _mNNN_... en fin de _MIGRATIONS (ne jamais modifier les anciennes).
+
+def _m001_base(conn):
+    # Schéma historique. Idempotent : les bases créées avant les migrations
+    # (user_version = 0) ont déjà tout ou partie de ces tables.
     conn.execute("""
         CREATE TABLE IF NOT EXISTS users(
             id TEXT PRIMARY KEY,
@@ -118,7 +269,182 @@ def ensure_schema(conn):
             PRIMARY KEY (user_id, ip)
         )
     """)
-    conn.commit()
+
+def _m002_indexes(conn):
+    # historique (global trié par date, ou par étudiant) et filtrage par classe
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user_date ON submissions(user_id, submitted_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_date ON submissions(submitted_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_class ON users(class_name)")
+
+def _m003_deposits(conn):
+    # registre des dépôts (remplace notif_depot.json) ; path = nom du fichier dans copies_etudiants/
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS deposits(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id     TEXT NOT NULL,
+            class_name  TEXT,
+            path        TEXT NOT NULL UNIQUE,
+            size        INTEGER,
+            sha256      TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            analyzed_at TIMESTAMP,
+            status      TEXT NOT NULL DEFAULT 'received'
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deposits_user ON deposits(user_id)")
+    # curseur "vu jusqu'à" par lecteur (prof) : notifications = dépôts d'id > last_id
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS deposit_cursors(
+            viewer  TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+def _m004_outbox(conn):
+    # file d'envoi des emails d'identifiants (mdp effacé une fois envoyé)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email   TEXT NOT NULL,
+            user_id    TEXT NOT NULL,
+            temp_pwd   TEXT,
+            login_url  TEXT,
+            status     TEXT NOT NULL DEFAULT 'pending',
+            attempts   INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at    TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at)")
+
+def _m005_jobs(conn):
+    # file de travaux persistante (analyse automatique des dépôts), vidée par worker.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind       TEXT NOT NULL,
+            key        TEXT NOT NULL,
+            user_id    TEXT,
+            status     TEXT NOT NULL DEFAULT 'queued',
+            attempts   INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            result     TEXT,
+            lease_until     TIMESTAMP,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at  TIMESTAMP,
+            finished_at TIMESTAMP,
+            UNIQUE(kind, key)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_attempt_at)")
+
+def _m006_batches(conn):
+    # travaux en lot (analyse, génération, envoi, intégrité) : un lot = des jobs, un par élément
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batches(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind       TEXT NOT NULL,
+            label      TEXT,
+            params     TEXT,
+            status     TEXT NOT NULL DEFAULT 'running',
+            created_by TEXT,
+            error      TEXT,
+            created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    if not _has_column(conn, "jobs", "batch_id"):
+        conn.execute("ALTER TABLE jobs ADD COLUMN batch_id INTEGER")
+    if not _has_column(conn, "jobs", "payload"):
+        conn.execute("ALTER TABLE jobs ADD COLUMN payload TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id, status)")
+
+def _m007_notif_json(conn):
+    # reprise de l'ancien notif_depot.json (noms de fichiers de copies_etudiants/) dans
+    # deposits, puis fichier renommé en .migrated ; INSERT directs : record_deposit
+    # validerait la transaction de la migration
+    path = os.path.join(DATA_DIR, "notif_depot.json")
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            names = json.load(f)
+    except Exception:
+        names = []
+    deposits_dir = os.path.join(DATA_DIR, "copies_etudiants")
+    classes = dict(conn.execute("SELECT id, class_name FROM users"))
+    for fn in names:
+        p = os.path.join(deposits_dir, fn)
+        uid = fn.split("__", 1)[1].split("_", 1)[0] if "__" in fn else ""
+        if not uid or not os.path.exists(p):
+            continue
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        mtime = datetime.fromtimestamp(os.path.getmtime(p), timezone.utc)
+        conn.execute(
+            "INSERT OR IGNORE INTO deposits (user_id, class_name, path, size, sha256, received_at) "
+            "VALUES (?,?,?,?,?,?)",
+            (uid, classes.get(uid), fn, os.path.getsize(p), h.hexdigest(), _sql_ts(mtime))
+        )
+    os.replace(path, path + ".migrated")
+
+_MIGRATIONS = [
+    _m001_base,
+    _m002_indexes,
+    _m003_deposits,
+    _m004_outbox,
+    _m005_jobs,
+    _m006_batches,
+    _m007_notif_json,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn) -> int:
+    """Applique les migrations manquantes. Retourne le nombre de migrations appliquées."""
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return 0
+    if conn.in_transaction:
+        conn.commit()
+    applied = 0
+    isolation = conn.isolation_level
+    conn.isolation_level = None  # BEGIN/COMMIT explicites (DDL transactionnel)
+    try:
+        for version, step in enumerate(_MIGRATIONS, start=1):
+            conn.execute("BEGIN IMMEDIATE")  # verrou écriture : un seul processus migre
+            try:
+                if schema_version(conn) >= version:  # déjà faite (autre processus)
+                    conn.execute("COMMIT")
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+                applied += 1
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.isolation_level = isolation
+    if applied:
+        _backup_db()
+    return applied
+
+_schema_done = False
+
+def ensure_schema(conn, force=False):
+    """Met le schéma à jour (migrate). Vérifié une seule fois par processus (sauf force=True)."""
+    global _schema_done
+    if _schema_done and not force:
+        return
+    migrate(conn)
+    _schema_done = True
 
 def _hash(p): 
     return PWD_CTX.hash(p)
@@ -139,11 +465,11 @@ def create_user(conn, user_id, first_name, last_name, role, password_plain, clas
         "VALUES (?,?,?,?,?,?,?)",
         (user_id, first_name, last_name, role, class_name, _hash(password_plain), email),
     )
-    conn.commit(); _backup_db()
+    _commit(conn)
 
 def set_password_for_user(conn, user_id, new_password):
     conn.execute("UPDATE users SET password_hash=? WHERE id=?", (_hash(new_password), user_id))
-    conn.commit(); _backup_db()
+    _commit(conn)
 
 def change_password(conn, user_id, current_pwd, new_pwd):
     row = conn.execute("SELECT password_hash FROM users WHERE id=?", (user_id,)).fetchone()
@@ -170,13 +496,11 @@ def create_or_update_admin_from_env(conn):
             "VALUES (?, '', '', 'admin', '', ?, NULL)",
             (admin_id, _hash(admin_pw))
         )
-        conn.commit(); _backup_db()
+        _commit(conn)
         print(f"[bootstrap] Admin '{admin_id}' créé.")
 
 def bootstrap_on_startup():
-    conn = get_conn()
-    try: create_or_update_admin_from_env(conn)
-    finally: conn.close()
+    create_or_update_admin_from_env(get_conn())
 
 # ---------- Auth / sessions ----------
 def auth_user(conn, user_id, password_plain):
@@ -185,7 +509,7 @@ def auth_user(conn, user_id, password_plain):
         row = conn.execute(sql, (user_id.strip(),)).fetchone()
     except sqlite3.OperationalError as e:
         if "no such table" in str(e).lower():
-            ensure_schema(conn); create_or_update_admin_from_env(conn)
+            ensure_schema(conn, force=True); create_or_update_admin_from_env(conn)
             row = conn.execute(sql, (user_id.strip(),)).fetchone()
         else:
             raise
@@ -196,28 +520,109 @@ def auth_user(conn, user_id, password_plain):
 
 def record_login(conn, user_id, ip=None, ua=None):
     conn.execute("INSERT INTO logins(user_id, ip, user_agent) VALUES (?,?,?)", (user_id, ip, ua))
-    conn.commit(); _backup_db()
+    _commit(conn)
 
 def record_submission(conn, user_id, filename, status="received"):
     conn.execute("INSERT INTO submissions(user_id, filename, status) VALUES (?,?,?)",
                  (user_id, filename, status))
-    conn.commit(); _backup_db()
+    _commit(conn)
+
+# ---------- Registre des dépôts ----------
+def record_deposit(conn, user_id, path, size=None, sha256=None, class_name=None,
+                   received_at=None, status="received"):
+    """
+    Enregistre un dépôt (INSERT atomique, path unique).
+    Retourne l'id du dépôt, ou None s'il était déjà enregistré.
+    """
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO deposits (user_id, class_name, path, size, sha256, received_at, status) "
+        "VALUES (?,?,?,?,?,COALESCE(?, CURRENT_TIMESTAMP),?)",
+        (user_id, class_name, path, size, sha256, received_at, status)
+    )
+    _commit(conn)
+    return cur.lastrowid if cur.rowcount == 1 else None
+
+def list_deposits(conn, after_id=0):
+    """
+    Dépôts d'id > after_id (hors supprimés/introuvables), par id croissant : lecture incrémentale.
+    student_class = classe actuelle de l'étudiant (jointure users), à défaut celle du dépôt.
+    """
+    return _dict_cursor(conn).execute("""
+        SELECT d.*, COALESCE(u.class_name, d.class_name) AS student_class
+        FROM deposits d
+        LEFT JOIN users u ON u.id = d.user_id
+        WHERE d.id > ? AND d.status NOT IN ('deleted', 'missing')
+        ORDER BY d.id
+    """, (after_id,)).fetchall()
+
+def set_deposit_status(conn, path, status, analyzed=False):
+    if analyzed:
+        conn.execute("UPDATE deposits SET status=?, analyzed_at=CURRENT_TIMESTAMP WHERE path=?", (status, path))
+    else:
+        conn.execute("UPDATE deposits SET status=? WHERE path=?", (status, path))
+    _commit(conn)
+
+def get_deposit_cursor(conn, viewer) -> int:
+    row = conn.execute("SELECT last_id FROM deposit_cursors WHERE viewer=?", (viewer,)).fetchone()
+    return row[0] if row else 0
+
+def mark_deposits_seen(conn, viewer) -> int:
+    """Avance le curseur du lecteur au dernier dépôt (ex-"réinitialiser les notifications")."""
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM deposits").fetchone()[0]
+    conn.execute(
+        "INSERT INTO deposit_cursors (viewer, last_id) VALUES (?, ?) "
+        "ON CONFLICT(viewer) DO UPDATE SET last_id=excluded.last_id", (viewer, last_id)
+    )
+    _commit(conn)
+    return last_id
+
+def _dict_cursor(conn):
+    # row_factory sur le curseur : la connexion (partagée) garde des tuples
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    return cur
 
 def list_submissions(conn):
-    conn.row_factory = sqlite3.Row
-    return conn.execute("SELECT * FROM submissions ORDER BY submitted_at DESC").fetchall()
+    return _dict_cursor(conn).execute("SELECT * FROM submissions ORDER BY submitted_at DESC").fetchall()
 
 def list_submissions_by_user(conn, user_id):
-    conn.row_factory = sqlite3.Row
-    return conn.execute("SELECT * FROM submissions WHERE user_id=? ORDER BY submitted_at DESC",
-                        (user_id,)).fetchall()
+    return _dict_cursor(conn).execute("SELECT * FROM submissions WHERE user_id=? ORDER BY submitted_at DESC",
+                                      (user_id,)).fetchall()
+
+def list_submissions_with_class(conn, class_name=None, limit=None, offset=0):
+    """
+    Dépôts (plus récents d'abord) avec la classe de l'étudiant, en une requête.
+    class_name=None : toutes les classes. limit/offset : pagination.
+    """
+    q = ("SELECT s.id, s.user_id, s.filename, s.status, s.submitted_at, "
+         "COALESCE(u.class_name, '') AS class_name "
+         "FROM submissions s LEFT JOIN users u ON u.id = s.user_id")
+    args = []
+    if class_name:
+        q += " WHERE u.class_name = ?"
+        args.append(class_name)
+    q += " ORDER BY s.submitted_at DESC, s.id DESC"
+    if limit is not None:
+        q += " LIMIT ? OFFSET ?"
+        args += [int(limit), int(offset)]
+    return _dict_cursor(conn).execute(q, args).fetchall()
+
+def count_submissions(conn, class_name=None) -> int:
+    if class_name:
+        return conn.execute(
+            "SELECT COUNT(*) FROM submissions s JOIN users u ON u.id = s.user_id WHERE u.class_name = ?",
+            (class_name,)).fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+def user_ids_in_class(conn, class_name) -> set[str]:
+    return {r[0] for r in conn.execute("SELECT id FROM users WHERE class_name = ?", (class_name,))}
 
 def create_session(conn, user_id, ttl_hours=12):
     tok = uuid.uuid4().hex
     expires = datetime.utcnow() + timedelta(hours=ttl_hours)
     conn.execute("INSERT INTO sessions(token, user_id, expires_at) VALUES (?,?,?)",
                  (tok, user_id, expires))
-    conn.commit(); _backup_db()
+    _commit(conn)
     return tok
 
 def get_user_by_token(conn, token: str):
@@ -234,72 +639,136 @@ def get_user_by_token(conn, token: str):
 def delete_session(conn, token: str):
     if token:
         conn.execute("DELETE FROM sessions WHERE token=?", (token,))
-        conn.commit(); _backup_db()
+        _commit(conn)
 
 # ---------- Anti-bruteforce ----------
 _MAX_LOGIN_FAIL   = int(os.getenv("MAX_LOGIN_FAIL", "5"))
 _FAIL_WINDOW_SECS = int(os.getenv("FAIL_WINDOW_SECS", "900"))
 _LOCK_SECS        = int(os.getenv("LOCK_SECS", "600"))
 
+_THROTTLE_FLUSH_SECS = float(os.getenv("THROTTLE_FLUSH_SECS", "15"))
+
 def _now_utc(): return datetime.now(timezone.utc)
 
+class _LoginThrottle:
+    """
+    État anti-bruteforce en mémoire (par processus, thread-safe) : {(user_id, ip): [fail_count, last_fail, locked_until]}.
+    Chargé depuis login_throttle au 1er usage ; les clés modifiées sont écrites en BD
+    toutes les THROTTLE_FLUSH_SECS (thread de fond, + à l'arrêt), en une transaction
+    qui purge aussi les lignes expirées. Une tentative ne coûte donc plus ni commit ni backup.
+    """
+
+    def __init__(self, flush_secs=_THROTTLE_FLUSH_SECS):
+        self.flush_secs = max(1.0, float(flush_secs))
+        self._lock = threading.Lock()
+        self._state = None      # chargé paresseusement
+        self._dirty = set()     # clés modifiées ou supprimées depuis le dernier flush
+        self._thread = None
+
+    def _entries(self, conn):
+        # appelé sous self._lock
+        if self._state is None:
+            self._state = {}
+            for uid, ip, fc, lf, lu in conn.execute(
+                    "SELECT user_id, ip, fail_count, last_fail, locked_until FROM login_throttle"):
+                self._state[(uid, ip)] = [int(fc or 0), _from_iso(lf) if lf else None, _from_iso(lu) if lu else None]
+        return self._state
+
+    def _touch(self, key):
+        # appelé sous self._lock
+        self._dirty.add(key)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="login-throttle-flush", daemon=True)
+            self._thread.start()
+
+    def is_locked(self, conn, key):
+        with self._lock:
+            e = self._entries(conn).get(key)
+        lu = e[2] if e else None
+        now = _now_utc()
+        if lu and now < lu:
+            return True, int((lu - now).total_seconds())
+        return False, 0
+
+    def register_failure(self, conn, key, max_fail, window_secs, lock_secs):
+        now = _now_utc()
+        with self._lock:
+            entries = self._entries(conn)
+            e = entries.get(key)
+            if e is None:
+                entries[key] = [1, now, None]
+                self._touch(key)
+                return False, 0, max_fail - 1
+
+            fail_count, lf, lu = e
+            if lu and now < lu:
+                return True, int((lu - now).total_seconds()), 0
+
+            count = 1 if (lf is None or (now - lf).total_seconds() > window_secs) else fail_count + 1
+            self._touch(key)
+            if count >= max_fail:
+                entries[key] = [count, now, now + timedelta(seconds=lock_secs)]
+                return True, lock_secs, 0
+            entries[key] = [count, now, None]
+            return False, 0, max_fail - count
+
+    def reset(self, conn, key):
+        with self._lock:
+            if self._entries(conn).pop(key, None) is not None:
+                self._touch(key)
+
+    def _expired(self, e, now):
+        fail_count, lf, lu = e
+        # sans verrou actif ni échec dans la fenêtre, la ligne n'influence plus aucune décision
+        return not (lu and now < lu) and (lf is None or (now - lf).total_seconds() > _FAIL_WINDOW_SECS)
+
+    def flush(self):
+        """Écrit les clés modifiées et purge les lignes expirées (mémoire + BD)."""
+        now = _now_utc()
+        with self._lock:
+            if self._state is None:
+                return
+            for key in [k for k, e in self._state.items() if self._expired(e, now)]:
+                del self._state[key]
+                self._dirty.add(key)
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            upserts = [(k[0], k[1], e[0], e[1].isoformat() if e[1] else None, e[2].isoformat() if e[2] else None)
+                       for k in dirty if (e := self._state.get(k)) is not None]
+            deletes = [k for k in dirty if k not in self._state]
+        conn = get_conn()
+        try:
+            with transaction(conn):
+                conn.executemany("DELETE FROM login_throttle WHERE user_id=? AND ip=?", deletes)
+                conn.executemany(
+                    "INSERT INTO login_throttle(user_id, ip, fail_count, last_fail, locked_until) VALUES (?,?,?,?,?) "
+                    "ON CONFLICT(user_id, ip) DO UPDATE SET fail_count=excluded.fail_count, "
+                    "last_fail=excluded.last_fail, locked_until=excluded.locked_until", upserts)
+        except Exception as e:
+            with self._lock:
+                self._dirty |= dirty  # nouvel essai au prochain cycle
+            print("[WARN] Flush login_throttle:", e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_secs)
+            self.flush()
+
+_THROTTLE = _LoginThrottle()
+atexit.register(_THROTTLE.flush)
+
 def login_is_locked(conn, user_id, ip):
-    row = conn.execute(
-        "SELECT locked_until FROM login_throttle WHERE user_id=? AND ip=?",
-        (user_id, ip)
-    ).fetchone()
-    if not row or not row[0]: return (False, 0)
-    lu = _from_iso(row[0])
-    if lu and datetime.now(timezone.utc) < lu:
-        return True, int((lu - datetime.now(timezone.utc)).total_seconds())
-    return False, 0
+    return _THROTTLE.is_locked(conn, (user_id, ip))
 
 def register_failed_login(conn, user_id, ip,
                           max_fail=_MAX_LOGIN_FAIL,
                           window_secs=_FAIL_WINDOW_SECS,
                           lock_secs=_LOCK_SECS):
-    now = datetime.now(timezone.utc)
-    row = conn.execute(
-        "SELECT fail_count, last_fail, locked_until FROM login_throttle WHERE user_id=? AND ip=?",
-        (user_id, ip)
-    ).fetchone()
-
-    if row:
-        fail_count, last_fail, locked_until = row
-        lu = _from_iso(locked_until) if locked_until else None
-        if lu and now < lu:
-            return True, int((lu - now).total_seconds()), 0
-
-        lf = _from_iso(last_fail) if last_fail else None
-        count = 1 if (lf is None or (now - lf).total_seconds() > window_secs) \
-                else int(fail_count or 0) + 1
-
-        if count >= max_fail:
-            lu = now + timedelta(seconds=lock_secs)
-            conn.execute(
-                "UPDATE login_throttle SET fail_count=?, last_fail=?, locked_until=? WHERE user_id=? AND ip=?",
-                (count, now.isoformat(), lu.isoformat(), user_id, ip)
-            )
-            conn.commit(); _backup_db()
-            return True, lock_secs, 0
-        else:
-            conn.execute(
-                "UPDATE login_throttle SET fail_count=?, last_fail=?, locked_until=NULL WHERE user_id=? AND ip=?",
-                (count, now.isoformat(), user_id, ip)
-            )
-            conn.commit(); _backup_db()
-            return False, 0, max_fail - count
-    else:
-        conn.execute(
-            "INSERT INTO login_throttle(user_id, ip, fail_count, last_fail, locked_until) VALUES (?,?,?,?,NULL)",
-            (user_id, ip, 1, now.isoformat())
-        )
-        conn.commit(); _backup_db()
-        return False, 0, max_fail - 1
+    return _THROTTLE.register_failure(conn, (user_id, ip), max_fail, window_secs, lock_secs)
 
 def reset_throttle(conn, user_id, ip):
-    conn.execute("DELETE FROM login_throttle WHERE user_id=? AND ip=?", (user_id, ip))
-    conn.commit(); _backup_db()
+    _THROTTLE.reset(conn, (user_id, ip))
 
 # ---------- Étudiants : upsert + import CSV + emails ----------
 def upsert_student(conn, user_id, first_name, last_name, class_name,
@@ -327,7 +796,7 @@ def upsert_student(conn, user_id, first_name, last_name, class_name,
             "VALUES (?,?,?,?,?,?,?)",
             (user_id, first_name, last_name, "student", class_name, _hash(initial_pwd), email)
         )
-    conn.commit(); _backup_db()
+    _commit(conn)
     return initial_pwd, (not exists)  # retourne mdp initial + bool(created)
 
 def _get_csv_val(row, key: str):
@@ -346,6 +815,20 @@ def _get_csv_val(row, key: str):
             if cand in keys: return (row.get(keys[cand]) or "").strip()
     return (row.get(key) or "").strip()
 
+# bcrypt est volontairement lent (~0,2 s/hash) : en import, on répartit sur plusieurs processus
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "0") or 0)
+_HASH_POOL_MIN = 8  # en dessous, le démarrage du pool coûte plus qu'il ne rapporte
+
+def _hash_many(passwords: list[str]) -> list[str]:
+    if len(passwords) < _HASH_POOL_MIN:
+        return [_hash(p) for p in passwords]
+    workers = HASH_WORKERS or os.cpu_count() or 1
+    workers = max(1, min(workers, len(passwords)))
+    if workers == 1:
+        return [_hash(p) for p in passwords]
+    with process_pool(workers) as ex:  # spawn : le serveur Streamlit est multi-thread
+        return list(ex.map(_hash, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
 def import_students_csv(conn, csv_path, class_name,
                         default_pwd="id",
                         reset_password=False,
@@ -355,32 +838,407 @@ def import_students_csv(conn, csv_path, class_name,
     CSV attendu: colonnes 'id, nom, prenom' et (optionnel) 'email'
     - reset_password=True : remet le mdp (et envoie email à tous si send_email=True)
     - send_email=True     : envoie un email aux nouveaux comptes, et aussi aux MAJ si reset_password=True
-    Retourne dict: {"created": int, "updated": int, "emailed": int}
+    Import en bloc : 1 lecture des ids existants, hash bcrypt en parallèle,
+    écritures executemany dans une seule transaction, 1 sauvegarde, emails après commit
+    (envoi groupé via l'outbox ; les échecs restent en file pour un nouvel essai).
+    Retourne dict: {"created": int, "updated": int, "emailed": int, "email_pending": int}
     """
-    created, updated, emailed = 0, 0, 0
+    created, updated, emailed, email_pending = 0, 0, 0, 0
+    rows = {}       # uid -> [prenom, nom, email] (dernière ligne gagnante, email conservé si vide)
+    order = []      # ids dans l'ordre du CSV (répétitions comprises)
+    to_mail = []    # (email, uid, 1re occurrence ?), dans l'ordre du CSV
     with open(csv_path, newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
+        for row in csv.DictReader(f):
             uid  = _get_csv_val(row, "id")
             nom  = _get_csv_val(row, "nom")
             pren = _get_csv_val(row, "prenom")
             email = _get_csv_val(row, "email")
-            if not uid: 
+            if not uid:
                 continue
+            order.append(uid)
+            is_new = uid not in rows
+            if is_new:
+                rows[uid] = [pren, nom, email or None]
+            else:
+                rows[uid] = [pren, nom, email or rows[uid][2]]
+            if send_email and email:
+                to_mail.append((email, uid, is_new))
 
-            initial_pwd, is_new = upsert_student(
-                conn, uid, pren, nom, class_name,
-                default_pwd=default_pwd,
-                reset_password=reset_password,
-                email=email or None
-            )
-            if is_new: created += 1
-            else:      updated += 1
+    if not rows:
+        return {"created": 0, "updated": 0, "emailed": 0, "email_pending": 0}
 
-            if send_email and email:
-                # envoyer aux nouveaux; et si reset_password, à tous
-                if is_new or reset_password:
-                    if send_credentials_email(email, uid, initial_pwd, login_url):
-                        emailed += 1
-    _backup_db()
-    return {"created": created, "updated": updated, "emailed": emailed}
+    existing = set()
+    ids = list(rows)
+    for i in range(0, len(ids), 500):  # limite de variables SQLite
+        chunk = ids[i:i + 500]
+        q = "SELECT id FROM users WHERE id IN (%s)" % ",".join("?" * len(chunk))
+        existing.update(r[0] for r in conn.execute(q, chunk))
+
+    def _initial(uid):
+        return uid if (default_pwd == "id") else default_pwd
+
+    new_ids = [u for u in ids if u not in existing]
+    hash_ids = ids if reset_password else new_ids
+    hashes = dict(zip(hash_ids, _hash_many([_initial(u) for u in hash_ids])))
+
+    with transaction(conn):
+        conn.executemany(
+            "INSERT INTO users (id, first_name, last_name, role, class_name, password_hash, email) "
+            "VALUES (?,?,?,?,?,?,?)",
+            [(u, rows[u][0], rows[u][1], "student", class_name, hashes[u], rows[u][2]) for u in new_ids]
+        )
+        upd = [u for u in ids if u in existing]
+        conn.executemany(
+            "UPDATE users SET first_name=?, last_name=?, class_name=?, email=COALESCE(?, email) WHERE id=?",
+            [(rows[u][0], rows[u][1], class_name, rows[u][2], u) for u in upd]
+        )
+        if reset_password:
+            conn.executemany("UPDATE users SET password_hash=? WHERE id=?", [(hashes[u], u) for u in upd])
+
+    # mêmes compteurs qu'un upsert ligne à ligne : un id répété compte comme MAJ
+    seen = set()
+    for uid in order:
+        if uid in seen or uid in existing: updated += 1
+        else:                              created += 1
+        seen.add(uid)
+
+    mails = []
+    for email, uid, first_seen in to_mail:
+        # envoyer aux nouveaux; et si reset_password, à tous
+        is_new = first_seen and uid not in existing
+        if is_new or reset_password:
+            mails.append((email, uid, _initial(uid), login_url))
+    if mails:
+        res = dispatch_outbox(conn, ids=enqueue_credentials(conn, mails))
+        emailed, email_pending = res["sent"], res["pending"]
+    return {"created": created, "updated": updated, "emailed": emailed, "email_pending": email_pending}
+
+# ---------- Outbox : envoi groupé des identifiants, avec reprise ----------
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_SECS   = int(os.getenv("OUTBOX_RETRY_SECS", "60"))
+_outbox_lock = threading.Lock()  # un seul envoi de la file à la fois (pas de doublons)
+
+def _sql_ts(dt: datetime) -> str:
+    # même format que CURRENT_TIMESTAMP (UTC) pour comparer en SQL
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+def enqueue_credentials(conn, items) -> list[int]:
+    """items : [(email, user_id, mdp initial, login_url), ...] -> ids outbox."""
+    ids = []
+    with transaction(conn):
+        for email, uid, pwd, url in items:
+            cur = conn.execute("INSERT INTO outbox (to_email, user_id, temp_pwd, login_url) VALUES (?,?,?,?)",
+                               (email, uid, pwd, url))
+            ids.append(cur.lastrowid)
+    return ids
+
+def outbox_pending(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM outbox WHERE status='pending'").fetchone()[0]
+
+def dispatch_outbox(conn, ids=None, force=False, progress_callback=None) -> dict:
+    """
+    Envoie les messages en attente dont l'échéance est passée (tous si force=True), ou seulement `ids`.
+    Échec : nouvel essai après OUTBOX_RETRY_SECS * 2^(essais-1), abandon ('failed')
+    après OUTBOX_MAX_ATTEMPTS. Retourne {"sent", "failed", "pending"} pour ce lot.
+    """
+    with _outbox_lock:
+        q = "SELECT id, to_email, user_id, temp_pwd, login_url, attempts FROM outbox WHERE status='pending'"
+        args = []
+        if not force and ids is None:
+            q += " AND next_attempt_at <= ?"
+            args.append(_sql_ts(_now_utc()))
+        if ids is not None:
+            if not ids:
+                return {"sent": 0, "failed": 0, "pending": 0}
+            q += " AND id IN (%s)" % ",".join("?" * len(ids))
+            args += list(ids)
+        rows = conn.execute(q + " ORDER BY id", args).fetchall()
+        if not rows:
+            return {"sent": 0, "failed": 0, "pending": 0}
+
+        results = send_credentials_batch(
+            [{"email": r[1], "user_id": r[2], "password": r[3], "login_url": r[4]} for r in rows],
+            progress_callback=progress_callback,
+        )
+        now = _now_utc()
+        sent, retry, failed = [], [], []
+        for r, res in zip(rows, results):
+            attempts = r[5] + 1
+            if res["ok"]:
+                sent.append((_sql_ts(now), r[0]))
+            elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                failed.append((attempts, res["error"], r[0]))
+            else:
+                nxt = now + timedelta(seconds=OUTBOX_RETRY_SECS * 2 ** (attempts - 1))
+                retry.append((attempts, res["error"], _sql_ts(nxt), r[0]))
+        with transaction(conn):
+            conn.executemany("UPDATE outbox SET status='sent', temp_pwd=NULL, attempts=attempts+1, "
+                             "last_error=NULL, sent_at=? WHERE id=?", sent)
+            conn.executemany("UPDATE outbox SET attempts=?, last_error=?, next_attempt_at=? WHERE id=?", retry)
+            conn.executemany("UPDATE outbox SET status='failed', temp_pwd=NULL, attempts=?, last_error=? "
+                             "WHERE id=?", failed)
+        return {"sent": len(sent), "failed": len(failed), "pending": len(retry)}
+
+# ---------- File de travaux (jobs) ----------
+# queued -> running (bail de JOB_LEASE_SECS, renouvelé par le worker) -> done | failed.
+# Un bail expiré (worker tué) remet le travail en jeu. Échec : nouvel essai après
+# JOB_RETRY_SECS * 2^(essais-1), abandon après JOB_MAX_ATTEMPTS.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_SECS   = int(os.getenv("JOB_RETRY_SECS", "30"))
+JOB_LEASE_SECS   = int(os.getenv("JOB_LEASE_SECS", "900"))
+
+def enqueue_job(conn, kind, key, user_id=None):
+    """Ajoute (ou remet en file) le travail (kind, key) ; sans effet s'il est en cours."""
+    conn.execute("""
+        INSERT INTO jobs (kind, key, user_id) VALUES (?, ?, ?)
+        ON CONFLICT(kind, key) DO UPDATE SET
+            status='queued', attempts=0, last_error=NULL, result=NULL, lease_until=NULL,
+            next_attempt_at=CURRENT_TIMESTAMP, finished_at=NULL, user_id=excluded.user_id,
+            batch_id=NULL, payload=NULL
+        WHERE jobs.status <> 'running'
+    """, (kind, key, user_id))
+    _commit(conn)
+
+def claim_jobs(conn, kinds, limit, lease_secs=JOB_LEASE_SECS, batch_id=None) -> list[dict]:
+    """
+    Réserve jusqu'à `limit` travaux dus (file, ou bail expiré), en une instruction.
+    Jamais deux travaux du même user_id en parallèle (historique JSON par étudiant ;
+    "batch:<id>" pour les lots à traiter un élément à la fois) : au plus un par
+    user_id et par réservation, aucun si ce user_id a déjà un travail en cours.
+    Les travaux d'un lot annulé ne sont plus réservés ; batch_id : ce lot seulement.
+    """
+    if limit <= 0 or not kinds:
+        return []
+    now = _now_utc()
+    lease = _sql_ts(now + timedelta(seconds=lease_secs))
+    now_s = _sql_ts(now)
+    marks = ",".join("?" * len(kinds))
+    only = "AND j.batch_id = ?" if batch_id is not None else ""
+    rows = _dict_cursor(conn).execute(f"""
+        UPDATE jobs SET status='running', attempts=attempts+1, started_at=?, lease_until=?
+        WHERE id IN (
+            SELECT MIN(j.id) FROM jobs j
+            WHERE j.kind IN ({marks}) {only}
+              AND ((j.status='queued' AND j.next_attempt_at <= ?)
+                   OR (j.status='running' AND j.lease_until < ?))
+              AND (j.batch_id IS NULL OR j.batch_id IN (SELECT b.id FROM batches b WHERE b.status='running'))
+              AND (j.user_id IS NULL OR j.user_id NOT IN (
+                    SELECT r.user_id FROM jobs r
+                    WHERE r.status='running' AND r.lease_until >= ? AND r.user_id IS NOT NULL))
+            GROUP BY COALESCE(j.user_id, 'job:' || j.id)
+            ORDER BY 1
+            LIMIT ?
+        )
+        RETURNING *
+    """, (now_s, lease, *kinds, *([batch_id] if batch_id is not None else []),
+          now_s, now_s, now_s, int(limit))).fetchall()
+    _commit_if(conn, rows)
+    return sorted((dict(r) for r in rows), key=lambda r: r["id"])
+
+def claim_job(conn, kind, key, user_id=None, lease_secs=JOB_LEASE_SECS) -> dict | None:
+    """
+    Réserve tout de suite le travail (kind, key), créé au besoin (analyse lancée depuis
+    l'app) : une seule instruction, donc jamais en même temps que le worker. None s'il est
+    déjà en cours (bail valide) ou si ce user_id a un autre travail en cours.
+    """
+    now = _now_utc()
+    now_s, lease = _sql_ts(now), _sql_ts(now + timedelta(seconds=lease_secs))
+    row = _dict_cursor(conn).execute("""
+        INSERT INTO jobs (kind, key, user_id, status, attempts, started_at, lease_until)
+        SELECT ?, ?, ?, 'running', 1, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM jobs r WHERE r.status='running' AND r.lease_until >= ?
+                          AND r.user_id = ? AND NOT (r.kind = ? AND r.key = ?))
+        ON CONFLICT(kind, key) DO UPDATE SET
+            status='running', started_at=excluded.started_at, lease_until=excluded.lease_until,
+            attempts=CASE WHEN jobs.status IN ('queued', 'running') THEN jobs.attempts + 1 ELSE 1 END,
+            last_error=NULL, result=NULL, finished_at=NULL, user_id=COALESCE(excluded.user_id, jobs.user_id)
+        WHERE jobs.status <> 'running' OR jobs.lease_until < ?
+        RETURNING *
+    """, (kind, key, user_id, now_s, lease, now_s, user_id, kind, key, now_s)).fetchone()
+    _commit_if(conn, row)
+    return dict(row) if row else None
+
+def release_jobs(conn, ids=None):
+    """
+    Remet en file des travaux réservés mais non terminés (arrêt du worker), sans
+    compter l'essai. ids=None : tous les travaux en cours (démarrage du worker, qui
+    est seul à réserver grâce à son verrou) — inutile d'attendre la fin des baux.
+    """
+    q = ("UPDATE jobs SET status='queued', attempts=MAX(attempts-1, 0), lease_until=NULL, "
+         "next_attempt_at=CURRENT_TIMESTAMP WHERE status='running'")
+    if ids is None:
+        n = conn.execute(q).rowcount
+    else:
+        n = sum(conn.execute(q + " AND id=?", (i,)).rowcount for i in ids)
+    _commit(conn)
+    return n
+
+def renew_jobs(conn, ids, lease_secs=JOB_LEASE_SECS):
+    if not ids:
+        return
+    lease = _sql_ts(_now_utc() + timedelta(seconds=lease_secs))
+    conn.executemany("UPDATE jobs SET lease_until=? WHERE id=? AND status='running'", [(lease, i) for i in ids])
+    _commit(conn)
+
+def finish_job(conn, job_id, result=None):
+    conn.execute("UPDATE jobs SET status='done', result=?, last_error=NULL, lease_until=NULL, "
+                 "finished_at=CURRENT_TIMESTAMP WHERE id=?", (result, job_id))
+    _commit(conn)
+
+def fail_job(conn, job_id, error, retry=True) -> str:
+    """Échec d'un essai : remis en file avec backoff, ou 'failed'. Retourne le nouveau statut."""
+    row = conn.execute("SELECT attempts FROM jobs WHERE id=?", (job_id,)).fetchone()
+    attempts = row[0] if row else JOB_MAX_ATTEMPTS
+    if retry and attempts < JOB_MAX_ATTEMPTS:
+        nxt = _sql_ts(_now_utc() + timedelta(seconds=JOB_RETRY_SECS * 2 ** (attempts - 1)))
+        conn.execute("UPDATE jobs SET status='queued', last_error=?, lease_until=NULL, next_attempt_at=? "
+                     "WHERE id=?", (str(error), nxt, job_id))
+        status = "queued"
+    else:
+        conn.execute("UPDATE jobs SET status='failed', last_error=?, lease_until=NULL, "
+                     "finished_at=CURRENT_TIMESTAMP WHERE id=?", (str(error), job_id))
+        status = "failed"
+    _commit(conn)
+    return status
+
+def job_statuses(conn, kind, keys=None) -> dict:
+    """{key: {"id", "status", "attempts", "last_error", "finished_at"}} pour un type de travail."""
+    q = "SELECT id, key, status, attempts, last_error, finished_at FROM jobs WHERE kind=?"
+    args = [kind]
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return {}
+        out = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = _dict_cursor(conn).execute(q + " AND key IN (%s)" % ",".join("?" * len(chunk)),
+                                              args + chunk).fetchall()
+            out.update({r["key"]: dict(r) for r in rows})
+        return out
+    return {r["key"]: dict(r) for r in _dict_cursor(conn).execute(q, args).fetchall()}
+
+def jobs_summary(conn, kind) -> dict:
+    """Nombre de travaux par statut : {"queued": n, "running": n, ...}."""
+    return dict(conn.execute("SELECT status, COUNT(*) FROM jobs WHERE kind=? GROUP BY status", (kind,)))
+
+# ---------- Lots (batches) : travaux longs, repris après redémarrage ----------
+# Un lot = une ligne batches + un job par élément (batch_id, payload JSON). L'état de
+# chaque élément est dans la BD (sauvegardée sur Supabase) : après un crash ou un
+# redémarrage, seuls les éléments non terminés sont refaits. Annuler = les éléments
+# en file passent 'cancelled' (ceux en cours se terminent) ; reprendre = les remettre
+# en file. Un lot est clos (finished_at) quand plus rien n'est en file ni en cours ;
+# worker.py le finalise alors ('failed' si cette finalisation échoue).
+def create_batch(conn, kind, items, label=None, params=None, created_by=None, serial=False) -> int:
+    """
+    items : [(key, user_id, payload), ...] (payload sérialisé en JSON). Un job (kind, key)
+    existant est rattaché au lot et remis en file (sauf s'il tourne déjà).
+    serial=True : éléments propres au lot (clé "<id>:<key>"), traités un à la fois
+    (user_id = "batch:<id>").
+    """
+    with transaction(conn):
+        cur = conn.execute("INSERT INTO batches (kind, label, params, created_by) VALUES (?,?,?,?)",
+                           (kind, label, json.dumps(params or {}), created_by))
+        batch_id = cur.lastrowid
+        conn.executemany("""
+            INSERT INTO jobs (kind, key, user_id, batch_id, payload) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(kind, key) DO UPDATE SET
+                status='queued', attempts=0, last_error=NULL, result=NULL, lease_until=NULL,
+                next_attempt_at=CURRENT_TIMESTAMP, finished_at=NULL, user_id=excluded.user_id,
+                batch_id=excluded.batch_id, payload=excluded.payload
+            WHERE jobs.status <> 'running'
+        """, [(kind, f"{batch_id}:{key}" if serial else key, f"batch:{batch_id}" if serial else uid, batch_id,
+               None if payload is None else json.dumps(payload, ensure_ascii=False))
+              for key, uid, payload in items])
+    return batch_id
+
+def get_batch(conn, batch_id) -> dict | None:
+    row = _dict_cursor(conn).execute("SELECT * FROM batches WHERE id=?", (batch_id,)).fetchone()
+    if not row:
+        return None
+    b = dict(row)
+    b["params"] = json.loads(b["params"] or "{}")
+    return b
+
+def list_batches(conn, kinds=None, limit=5) -> list[dict]:
+    """Derniers lots (plus récent d'abord), éventuellement filtrés par type."""
+    q, args = "SELECT id FROM batches", []
+    if kinds:
+        q += " WHERE kind IN (%s)" % ",".join("?" * len(kinds))
+        args += list(kinds)
+    ids = [r[0] for r in conn.execute(q + " ORDER BY id DESC LIMIT ?", args + [int(limit)])]
+    return [get_batch(conn, i) for i in ids]
+
+def cancel_batch(conn, batch_id) -> int:
+    """Annule un lot : ses éléments en file ne seront pas traités. Retourne leur nombre."""
+    with transaction(conn):
+        conn.execute("UPDATE batches SET status='cancelled' WHERE id=? AND status='running'", (batch_id,))
+        n = conn.execute("UPDATE jobs SET status='cancelled', lease_until=NULL WHERE batch_id=? AND status='queued'",
+                         (batch_id,)).rowcount
+    return n
+
+def resume_batch(conn, batch_id, retry_failed=True) -> int:
+    """Remet en file les éléments annulés (et en échec si retry_failed). Retourne leur nombre."""
+    statuses = ("cancelled", "failed") if retry_failed else ("cancelled",)
+    with transaction(conn):
+        n = conn.execute(
+            "UPDATE jobs SET status='queued', attempts=0, last_error=NULL, next_attempt_at=CURRENT_TIMESTAMP, "
+            "finished_at=NULL WHERE batch_id=? AND status IN (%s)" % ",".join("?" * len(statuses)),
+            (batch_id, *statuses)).rowcount
+        if conn.execute("SELECT 1 FROM jobs WHERE batch_id=? AND status='queued' LIMIT 1", (batch_id,)).fetchone():
+            conn.execute("UPDATE batches SET status='running', finished_at=NULL WHERE id=?", (batch_id,))
+    return n
+
+def close_batches(conn) -> list[dict]:
+    """Clôt les lots dont plus aucun élément n'est en file ni en cours ; retourne ces lots (à finaliser)."""
+    rows = conn.execute("""
+        UPDATE batches SET finished_at=CURRENT_TIMESTAMP,
+                           status=CASE WHEN status='running' THEN 'done' ELSE status END
+        WHERE finished_at IS NULL AND NOT EXISTS (
+            SELECT 1 FROM jobs j WHERE j.batch_id=batches.id
+              AND (j.status='running' OR (j.status='queued' AND batches.status='running')))
+        RETURNING id
+    """).fetchall()
+    _commit_if(conn, rows)
+    return [get_batch(conn, r[0]) for r in sorted(rows)]
+
+def fail_batch(conn, batch_id, error):
+    """Finalisation d'un lot clos en échec (ex. fusion du log des hashs)."""
+    conn.execute("UPDATE batches SET status='failed', error=? WHERE id=?", (str(error), batch_id))
+    _commit(conn)
+
+def batch_progress(conn, batch_id) -> dict | None:
+    """
+    Avancement d'un lot : {"batch", "total", "queued", "running", "done", "failed", "cancelled",
+    "finished", "rate" (éléments/s), "eta" (s, None si inconnue)}. Débit mesuré du premier
+    élément démarré au dernier terminé (ou à maintenant tant que le lot tourne).
+    """
+    batch = get_batch(conn, batch_id)
+    if batch is None:
+        return None
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs WHERE batch_id=? GROUP BY status", (batch_id,)))
+    end = "?" if batch["finished_at"] is None else "MAX(finished_at)"
+    span = conn.execute(
+        f"SELECT (julianday({end}) - julianday(MIN(started_at))) * 86400 FROM jobs WHERE batch_id=?",
+        ([_sql_ts(_now_utc())] if batch["finished_at"] is None else []) + [batch_id]).fetchone()[0]
+    out = {k: counts.get(k, 0) for k in ("queued", "running", "done", "failed", "cancelled")}
+    out["batch"] = batch
+    out["total"] = sum(counts.values())
+    out["finished"] = out["done"] + out["failed"]
+    out["rate"] = out["finished"] / max(span or 0, 1.0) if out["finished"] else 0.0
+    remaining = out["queued"] + out["running"]
+    out["eta"] = remaining / out["rate"] if out["rate"] and batch["status"] == "running" else None
+    return out
+
+def batch_items(conn, batch_id, statuses=None) -> list[dict]:
+    """Éléments d'un lot (key, status, attempts, last_error, result, payload décodés)."""
+    q, args = "SELECT key, status, attempts, last_error, result, payload FROM jobs WHERE batch_id=?", [batch_id]
+    if statuses:
+        q += " AND status IN (%s)" % ",".join("?" * len(statuses))
+        args += list(statuses)
+    out = []
+    for r in _dict_cursor(conn).execute(q + " ORDER BY id", args):
+        item = dict(r)
+        item["payload"] = json.loads(item["payload"]) if item["payload"] else None
+        out.append(item)
+    return out
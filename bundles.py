@@ -0,0 +1,96 @@
+# bundles.py — archives ZIP (copies générées d'une classe, rapports) pour téléchargement groupé
+# ---------------------------------------------------------------------------------------------
+# Le ZIP est écrit fichier par fichier sur disque (zipfile lit chaque source
+# par blocs) : la mémoire reste bornée quelle que soit la taille de la classe.
+# Les .xlsm/.xlsx sont déjà des ZIP -> stockés sans recompression (ZIP_STORED).
+# Une archive est réutilisée tant que ses fichiers sources (nom, taille, mtime)
+# n'ont pas changé ; l'empreinte fait partie du nom du fichier.
+
+import io, os, glob, zipfile, hashlib
+
+DATA_DIR    = os.environ.get("DATA_DIR", "/tmp")
+BUNDLES_DIR = os.path.join(DATA_DIR, "bundles")
+os.makedirs(BUNDLES_DIR, exist_ok=True)
+
+# Formats déjà compressés : les recompresser coûte du CPU pour ~0 % de gain
+STORED_EXTS = (".xlsm", ".xlsx", ".zip", ".png", ".jpg", ".jpeg")
+
+def _fingerprint(paths: list[str]) -> str:
+    h = hashlib.sha256()
+    for p in sorted(paths):
+        try:
+            stt = os.stat(p)
+        except OSError:
+            continue
+        h.update(f"{os.path.basename(p)}|{stt.st_size}|{stt.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def build_zip(paths: list[str], label: str, stored_exts=STORED_EXTS) -> str | None:
+    """
+    Construit (ou réutilise) BUNDLES_DIR/<label>_<empreinte>.zip contenant `paths`
+    (à plat, par nom de fichier). Retourne le chemin du ZIP, ou None si rien à archiver.
+    """
+    paths = [p for p in paths if os.path.isfile(p)]
+    if not paths:
+        return None
+    out = os.path.join(BUNDLES_DIR, f"{label}_{_fingerprint(paths)}.zip")
+    if os.path.exists(out):
+        return out  # cache : sources inchangées
+
+    tmp = f"{out}.tmp{os.getpid()}"
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for p in sorted(paths):
+            stored = p.lower().endswith(tuple(stored_exts))
+            zf.write(p, arcname=os.path.basename(p),
+                     compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    os.replace(tmp, out)
+
+    # anciennes versions du même lot
+    for old in glob.glob(os.path.join(BUNDLES_DIR, f"{glob.escape(label)}_*.zip")):
+        if old != out:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return out
+
+def class_copies_zip(copies_dir: str, slug: str) -> str | None:
+    """ZIP de toutes les copies .xlsm générées pour une classe."""
+    paths = glob.glob(os.path.join(glob.escape(copies_dir), "*.xlsm"))
+    return build_zip(paths, f"copies_{slug}")
+
+def reports_zip(reports_dir: str, deposit_files: list[str], label: str) -> str | None:
+    """ZIP des rapports (TXT + HTML) des dépôts donnés (noms de fichiers déposés)."""
+    paths = []
+    for fn in deposit_files:
+        base = os.path.splitext(os.path.basename(fn))[0]
+        for ext in ("txt", "html"):
+            paths.append(os.path.join(reports_dir, f"{base}_rapport.{ext}"))
+    return build_zip(paths, f"rapports_{label}")
+
+class _ReadOnce(io.BufferedReader):
+    """Fichier ouvert remis à st.download_button : refermé dès qu'il a été lu jusqu'au bout."""
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if size is None or size < 0 or not data:
+            self.close()
+        return data
+
+def _open(path: str) -> io.BufferedReader:
+    return _ReadOnce(io.FileIO(path, "rb"))
+
+def lazy_zip(builder, *args):
+    """
+    Callable pour st.download_button(data=...) : l'archive n'est construite
+    (ou reprise du cache) qu'au clic, jamais à chaque rerun ; Streamlit reçoit
+    le fichier ouvert et le lit lui-même (pas de copie intermédiaire ici).
+    """
+    def _data():
+        path = builder(*args)
+        return _open(path) if path else b""
+    return _data
+
+def lazy_file(path: str):
+    """Callable pour st.download_button(data=...) : le fichier n'est ouvert qu'au clic."""
+    return lambda: _open(path)
@@ -22,15 +22,16 @@ except Exception:
 
 # --- Intégrité (_sig)
 from integrity import verify_workbook  # verify_workbook(path, main_sheet_name) -> (header, changed_cells, issues)
+from history_index import write_history  # <id>.json + index (.history_index.json)
 
 # --- Cloud (helpers facultatifs)
 _SUPA_OK = False
 try:
-    from supa import upload_file, signed_url
+    from supa import upload_batch, signed_urls
     _SUPA_OK = True
 except Exception:
-    upload_file = None
-    signed_url = None
+    upload_batch = None
+    signed_urls = None
     _SUPA_OK = False
 
 # ======================= CONFIG =======================
@@ -194,9 +195,9 @@ def _load_history(student_id: str):
     return []
 
 def _save_history(student_id: str, history_list: list):
-    p = _history_path(student_id)
-    with open(p, "w", encoding="utf-8") as f:
-        json.dump(history_list, f, ensure_ascii=False, indent=2)
+    # écriture atomique + index (nb de snapshots, dernier horodatage, authenticité)
+    sid = (student_id or "").strip() or "unknown"
+    write_history(history_folder, sid, history_list)
 
 def _snapshot_ws(ws, include_cols=(3, 25)) -> dict:
     out = {}
@@ -781,10 +782,14 @@ def comparer_etudiant(fichier_etudiant: str) -> str:
             remote_dir = f"rapports/{student_key}/"
             remote_txt = remote_dir + os.path.basename(path_txt)
             remote_htm = remote_dir + os.path.basename(path_html)
-            upload_file(path_txt, remote_txt, content_type="text/plain")
-            upload_file(path_html, remote_htm, content_type="text/html")
-            url_txt = signed_url(remote_txt, expires_in=7*24*3600)
-            url_htm = signed_url(remote_htm, expires_in=7*24*3600)
+            # les deux rapports partent en parallèle (client asyncio, connexions réutilisées)
+            failed = [r for r in upload_batch([(path_txt, remote_txt, "text/plain"),
+                                               (path_html, remote_htm, "text/html")])
+                      if r["status"] != "uploaded"]
+            if failed:
+                raise RuntimeError(failed[0]["error"])
+            urls = signed_urls([remote_txt, remote_htm], expires_in=7*24*3600)  # un seul appel
+            url_txt, url_htm = urls[remote_txt], urls[remote_htm]
             cloud_msg = f" | cloud: TXT={url_txt} | HTML={url_htm}"
         except Exception as e:
             cloud_msg = f" | cloud: échec upload ({e})"
@@ -0,0 +1,142 @@
+# db_backup.py — sauvegarde différée (debounce) de la base SQLite vers Supabase
+# -----------------------------------------------------------------------------
+# Les écritures ne font que marquer la base "sale" (mark_dirty). Un thread de
+# fond prend un instantané cohérent via l'API backup de sqlite3 au plus toutes
+# les DB_BACKUP_INTERVAL_SECS secondes, ou plus tôt après DB_BACKUP_MAX_WRITES
+# écritures, le compresse (gzip) et ne l'envoie que si son contenu a changé.
+# Un dernier envoi est fait à l'arrêt du processus (atexit).
+# -----------------------------------------------------------------------------
+
+import os, gzip, sqlite3, hashlib, threading, time, atexit
+
+DB_BACKUP_INTERVAL_SECS = float(os.getenv("DB_BACKUP_INTERVAL_SECS", "30"))
+DB_BACKUP_MAX_WRITES    = int(os.getenv("DB_BACKUP_MAX_WRITES", "50"))
+
+
+def snapshot_bytes(db_path: str) -> bytes:
+    """Copie cohérente de la base (même pendant des écritures / en WAL), en mémoire."""
+    src = sqlite3.connect(db_path, timeout=30)
+    dst = sqlite3.connect(":memory:")
+    try:
+        src.backup(dst)
+        return dst.serialize()
+    finally:
+        dst.close()
+        src.close()
+
+
+class BackupScheduler:
+    """
+    Sauvegarde différée d'un fichier SQLite.
+    upload(data: bytes) reçoit l'instantané compressé (gzip) et doit lever en cas d'échec.
+    """
+
+    def __init__(self, db_path: str, upload, interval_secs: float = DB_BACKUP_INTERVAL_SECS,
+                 max_writes: int = DB_BACKUP_MAX_WRITES):
+        self.db_path = db_path
+        self.upload = upload
+        self.interval_secs = max(0.0, float(interval_secs))
+        self.max_writes = max(1, int(max_writes))
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._writes = 0
+        self._dirty_since = None
+        self._last_sha = self._read_last_sha()
+        self.stats = {"marked": 0, "uploaded": 0, "unchanged": 0, "errors": 0}
+
+    # --- empreinte du dernier envoi (survit aux redémarrages) ---
+    @property
+    def _sha_path(self) -> str:
+        return self.db_path + ".backup.sha256"
+
+    def _read_last_sha(self):
+        try:
+            with open(self._sha_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except Exception:
+            return None
+
+    def _write_last_sha(self, sha: str):
+        try:
+            with open(self._sha_path, "w", encoding="utf-8") as f:
+                f.write(sha)
+        except Exception:
+            pass
+
+    # --- API ---
+    def mark_dirty(self):
+        """À appeler après chaque écriture committée : ne bloque jamais."""
+        with self._lock:
+            self._writes += 1
+            self.stats["marked"] += 1
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+                self._thread.start()
+            if self._writes >= self.max_writes:
+                self._wake.set()
+
+    def flush(self) -> bool:
+        """Sauvegarde immédiate si la base est sale. Retourne True si un envoi a eu lieu."""
+        with self._lock:
+            if self._dirty_since is None:
+                return False
+            self._writes, self._dirty_since = 0, None
+        try:
+            raw = snapshot_bytes(self.db_path)
+            sha = hashlib.sha256(raw).hexdigest()
+            if sha == self._last_sha:
+                self.stats["unchanged"] += 1
+                return False
+            self.upload(gzip.compress(raw, compresslevel=6))
+            self._last_sha = sha
+            self._write_last_sha(sha)
+            self.stats["uploaded"] += 1
+            return True
+        except Exception as e:
+            # on garde la base sale : nouvel essai au prochain cycle
+            with self._lock:
+                if self._dirty_since is None:
+                    self._dirty_since = time.monotonic()
+            self.stats["errors"] += 1
+            print("[WARN] Échec backup DB:", e)
+            return False
+
+    def shutdown(self):
+        """Arrêt propre : dernier envoi synchrone."""
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+    # --- thread de fond ---
+    def _due(self) -> float | None:
+        """Secondes avant la prochaine sauvegarde (0 = maintenant), None si rien à faire."""
+        with self._lock:
+            if self._dirty_since is None:
+                return None
+            if self._writes >= self.max_writes:
+                return 0.0
+            return max(0.0, self.interval_secs - (time.monotonic() - self._dirty_since))
+
+    def _run(self):
+        while not self._stopped:
+            wait = self._due()
+            if wait is None:
+                self._wake.wait(timeout=max(self.interval_secs, 1.0))
+                self._wake.clear()
+                continue
+            if wait > 0:
+                self._wake.wait(timeout=wait)
+                self._wake.clear()
+                continue
+            self.flush()
+
+
+def install(db_path: str, upload, **kw) -> BackupScheduler:
+    """Crée le planificateur et enregistre le flush final à l'arrêt du processus."""
+    sched = BackupScheduler(db_path, upload, **kw)
+    atexit.register(sched.shutdown)
+    return sched
@@ -1,11 +1,25 @@
 # hash_generator.py — sorties .xlsm (macro-enabled)
 # -*- coding: utf-8 -*-
+#
+# Moteur de génération : le template est chargé, protégé et estampillé UNE
+# seule fois (avec des jetons à la place de l'ID, du hash Z2 et de l'en-tête
+# _sig), puis chaque copie est produite en remplaçant ces jetons directement
+# dans le XML du paquet .xlsm gardé en mémoire.
 import os
+import io
 import csv
+import time
+import uuid
+import zipfile
 import hashlib
+from concurrent.futures import as_completed
+from xml.sax.saxutils import escape as _xml_escape
+
 import openpyxl
 from openpyxl.styles import Protection
 from integrity import stamp_workbook  # stamp_workbook(wb, template_version, student_id, main_sheet_name)
+from integrity import _ensure_sig_sheet, _struct_text, _header_json, _h, SIG_SHEET
+from pools import process_pool
 
 DATA_DIR = os.environ.get("DATA_DIR", "./")
 
@@ -26,26 +40,173 @@ def _hash_contenu(ws, student_id: str) -> str:
                 contenu += str(cell).encode()
     return hashlib.sha256(contenu).hexdigest()
 
-def generate_student_files_csv(
-    input_csv="liste_etudiants.csv",
-    template_path="Fichier_Excel_Professeur_Template.xlsm",  # <<< .xlsm par défaut
-    output_folder="copies_generees",                         # même dossier que côté prof
-    log_file="hash_records.csv",
-    template_version="v1.0.0",
-):
-    # Résolution via DATA_DIR
-    input_csv     = input_csv     if os.path.isabs(input_csv)     else os.path.join(DATA_DIR, input_csv)
-    template_path = template_path if os.path.isabs(template_path) else os.path.join(DATA_DIR, template_path)
-    output_folder = output_folder if os.path.isabs(output_folder) else os.path.join(DATA_DIR, output_folder)
-    log_file      = log_file      if os.path.isabs(log_file)      else os.path.join(DATA_DIR, log_file)
-
+# ---------------- Template préparé ----------------
+def prepare_template(template_path: str, template_version: str = "v1.0.0") -> dict:
+    """
+    Charge le template une fois et applique tout ce qui est commun aux copies
+    (Z masquée, protection C..Y, feuille _sig signée). Les parties propres à
+    chaque étudiant (Z1, Z2, en-tête _sig) sont remplacées par des jetons.
+    Retourne un dict sérialisable (picklable) utilisé par render_student_copy().
+    """
     if not os.path.exists(template_path):
         raise FileNotFoundError(f"Template introuvable: {template_path}")
-    os.makedirs(output_folder, exist_ok=True)
 
-    # Charger la liste d'étudiants
+    tag = uuid.uuid4().hex
+    tok_id, tok_hash, tok_header = f"SETUID{tag}", f"SETHASH{tag}", f"SETHEADER{tag}"
+
+    wb = openpyxl.load_workbook(template_path, keep_vba=True, data_only=False)
+    ws = wb.active
+    main_sheet_name = ws.title
+
+    # Z1 (jeton) puis découpage du contenu haché autour de Z1 :
+    # hash = sha256(id + avant_Z1 + id + après_Z1), comme _hash_contenu()
+    ws["Z1"] = tok_id
+    before, after, seen_z1 = [], [], False
+    for row_cells in ws.iter_rows():
+        for cell in row_cells:
+            if cell.coordinate == "Z1":
+                seen_z1 = True
+                continue
+            if cell.value is not None:
+                (after if seen_z1 else before).append(str(cell.value).encode())
+    ws["Z2"] = tok_hash
+
+    # Masquer Z
+    ws.column_dimensions["Z"].hidden = True
+
+    # Déverrouiller C..Y et protéger
+    for row_cells in ws.iter_rows(min_row=2, max_row=ws.max_row or 2, min_col=3, max_col=25):
+        for cell in row_cells:
+            cell.protection = Protection(locked=False)
+    ws.protection.sheet = True
+    ws.protection.enable()
+    ws.protection.selectLockedCells = False
+    ws.protection.selectUnlockedCells = True
+
+    # Estampille : signatures C..Y communes ; l'empreinte de structure dépend
+    # de Z1 (ligne 1) -> on garde le texte brut pour la recalculer par étudiant
+    _ensure_sig_sheet(wb)
+    struct_text = _struct_text(wb)
+    stamp_workbook(wb, template_version=template_version, student_id=tok_id, main_sheet_name=main_sheet_name)
+    wb[SIG_SHEET]["B1"] = tok_header
+
+    buf = io.BytesIO()
+    wb.save(buf)
+
+    # Parties XML contenant les jetons (feuilles en inlineStr ou sharedStrings.xml)
+    members, patched = [], {}
+    with zipfile.ZipFile(io.BytesIO(buf.getvalue())) as zin:
+        for info in zin.infolist():
+            data = zin.read(info.filename)
+            if info.filename.endswith(".xml") and tag.encode() in data:
+                patched[info.filename] = data.decode("utf-8")
+            members.append((info.filename, data))
+    for t in (tok_id, tok_hash, tok_header):
+        if sum(xml.count(t) for xml in patched.values()) != 1:
+            raise RuntimeError(f"Template préparé inattendu : jeton {t[:-len(tag)]} introuvable ou dupliqué.")
+
+    return {
+        "template_version": template_version,
+        "members": members,
+        "patched": patched,
+        "tokens": (tok_id, tok_hash, tok_header),
+        "hash_before": b"".join(before),
+        "hash_after": b"".join(after),
+        "struct_text": struct_text,
+    }
+
+def render_student_copy(prepared: dict, student_id: str) -> tuple[bytes, str]:
+    """Produit le .xlsm d'un étudiant à partir du template préparé. Retourne (contenu, hash Z2)."""
+    uid = student_id or ""
+    tok_id, tok_hash, tok_header = prepared["tokens"]
+
+    h = hashlib.sha256(uid.encode() + prepared["hash_before"] + uid.encode() + prepared["hash_after"]).hexdigest()
+    header = _header_json(
+        template_version=prepared["template_version"],
+        struct_hash=_h(prepared["struct_text"].replace(tok_id, uid)),
+        student_id=uid,
+    )
+    patched = {
+        name: xml.replace(tok_id, _xml_escape(uid))
+                 .replace(tok_hash, h)
+                 .replace(tok_header, _xml_escape(header))
+                 .encode("utf-8")
+        for name, xml in prepared["patched"].items()
+    }
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        for name, data in prepared["members"]:
+            zout.writestr(name, patched.get(name, data))
+    return out.getvalue(), h
+
+# ---------------- Génération (séquentielle ou pool de processus) ----------------
+_WORKER_PREPARED = None  # template préparé, transmis une fois à chaque processus du pool
+
+def _init_worker(prepared: dict):
+    global _WORKER_PREPARED
+    _WORKER_PREPARED = prepared
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _generate_one(etu: dict, output_folder: str, prepared: dict | None = None) -> dict:
+    """Génère la copie d'un étudiant. Ne lève jamais : l'erreur est renvoyée dans le résultat."""
+    uid, nom, prenom = etu["id"], etu["nom"], etu["prenom"]
+    fname = f"{uid}_{_safe_filename(nom)}_{_safe_filename(prenom)}.xlsm"
+    try:
+        data, h = render_student_copy(prepared or _WORKER_PREPARED, uid)
+        # >>> Sauvegarde en .xlsm
+        _write_atomic(os.path.join(output_folder, fname), data)
+        return {"id": uid, "nom": nom, "prenom": prenom, "hash": h, "nom_fichier": fname, "ok": True}
+    except Exception as e:
+        return {"id": uid, "nom": nom, "prenom": prenom, "nom_fichier": fname, "ok": False, "error": str(e)}
+
+# ---------------- Incrémental : empreinte template + log existant ----------------
+_LOG_HEADER = ["id_etudiant", "nom", "prenom", "hash", "nom_fichier", "template_fp"]
+
+def template_fingerprint(template_path: str, template_version: str) -> str:
+    """Empreinte de tout ce qui rend une copie périmée : octets du template, version, secret HMAC."""
+    from integrity import SECRET
+    h = hashlib.sha256()
+    with open(template_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    h.update(f"|{template_version}|{_h(SECRET)}".encode())
+    return h.hexdigest()
+
+def _read_hash_log(log_file: str) -> dict:
+    """Log existant indexé par id (vide si absent/illisible). Les anciens logs n'ont pas template_fp."""
+    rows = {}
+    if not os.path.exists(log_file):
+        return rows
+    try:
+        with open(log_file, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                rid = (row.get("id_etudiant") or "").strip()
+                if rid:
+                    rows[rid] = {k: (row.get(k) or "").strip() for k in _LOG_HEADER}
+    except Exception as e:
+        print(f"[WARN] Lecture hash log '{log_file}' impossible : {e}")
+    return rows
+
+def _is_stale(etu: dict, prev: dict | None, fp: str, output_folder: str) -> bool:
+    if not prev or prev.get("template_fp") != fp:
+        return True
+    if prev.get("nom") != etu["nom"] or prev.get("prenom") != etu["prenom"]:
+        return True
+    return not os.path.exists(os.path.join(output_folder, prev.get("nom_fichier") or ""))
+
+def _resolve(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(DATA_DIR, path)
+
+def load_students(input_csv: str) -> list[dict]:
+    """Étudiants du CSV (colonnes id, nom, prenom), dans l'ordre du fichier."""
     etudiants = []
-    with open(input_csv, newline="", encoding="utf-8") as f:
+    with open(_resolve(input_csv), newline="", encoding="utf-8") as f:
         for row in csv.DictReader(f):
             sid = (row.get("id") or "").strip()
             if not sid:
@@ -55,49 +216,161 @@ def generate_student_files_csv(
                 "nom": (row.get("nom") or "").strip(),
                 "prenom": (row.get("prenom") or "").strip(),
             })
+    return etudiants
+
+def stale_students(etudiants: list[dict], template_path: str, output_folder: str, log_file: str,
+                   template_version: str = "v1.0.0", force: bool = False, fp: str | None = None) -> list[dict]:
+    """Étudiants dont la copie est manquante ou périmée (tous si force=True)."""
+    fp = fp or template_fingerprint(_resolve(template_path), template_version)
+    previous = _read_hash_log(_resolve(log_file))
+    output_folder = _resolve(output_folder)
+    return [etu for etu in etudiants
+            if force or _is_stale(etu, previous.get(etu["id"]), fp, output_folder)]
+
+def merge_hash_log(etudiants: list[dict], results: dict, output_folder: str, log_file: str, fp: str):
+    """
+    Fusionne le log des hashs (ordre du CSV élèves) : ligne régénérée si results[id]
+    est un succès, sinon ligne existante. Les copies renommées (nom/prénom modifiés)
+    sont retirées, comme les copies et lignes des étudiants absents du CSV.
+    Un résultat peut porter son propre "template_fp" (sinon `fp`).
+    Remplace le log atomiquement ; retourne (generated, skipped, failed, removed),
+    removed = noms de fichiers des copies supprimées (étudiants retirés du CSV).
+    """
+    output_folder, log_file = _resolve(output_folder), _resolve(log_file)
+    previous = _read_hash_log(log_file)
+    generated, skipped, failed, log_rows = [], [], [], []
+    for etu in etudiants:
+        prev = previous.get(etu["id"])
+        res = results.get(etu["id"])
+        if res is None:
+            if prev:
+                skipped.append(prev)
+                log_rows.append(prev)
+        elif res["ok"]:
+            generated.append(res)
+            log_rows.append({"id_etudiant": res["id"], "nom": res["nom"], "prenom": res["prenom"],
+                             "hash": res["hash"], "nom_fichier": res["nom_fichier"],
+                             "template_fp": res.get("template_fp") or fp})
+            # copie renommée (nom/prénom modifiés) : retirer l'ancien fichier
+            old_name = (prev or {}).get("nom_fichier")
+            if old_name and old_name != res["nom_fichier"]:
+                try:
+                    os.remove(os.path.join(output_folder, old_name))
+                except OSError:
+                    pass
+        else:
+            failed.append(res)
+            if prev:  # on garde la dernière copie connue (son hash reste officiel)
+                log_rows.append(prev)
+
+    # étudiants retirés du CSV : ligne du log abandonnée, copie supprimée
+    current = {etu["id"] for etu in etudiants}
+    kept = {r.get("nom_fichier") for r in log_rows}
+    removed = []
+    for sid, prev in previous.items():
+        name = prev.get("nom_fichier")
+        if sid in current or not name or name in kept:
+            continue
+        try:
+            os.remove(os.path.join(output_folder, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:  # ligne gardée : nouvel essai à la prochaine fusion
+            print(f"[WARN] Copie {name} non supprimée : {e}")
+            log_rows.append(prev)
+            continue
+        removed.append(name)
 
-    # Log CSV
-    with open(log_file, "w", newline="", encoding="utf-8") as flog:
+    tmp_log = f"{log_file}.tmp{os.getpid()}"
+    with open(tmp_log, "w", newline="", encoding="utf-8") as flog:
         w = csv.writer(flog)
-        w.writerow(["id_etudiant", "nom", "prenom", "hash", "nom_fichier"])
+        w.writerow(_LOG_HEADER)
+        for r in log_rows:
+            w.writerow([r.get(k, "") for k in _LOG_HEADER])
+    os.replace(tmp_log, log_file)
+    return generated, skipped, failed, removed
 
-        for etu in etudiants:
-            uid, nom, prenom = etu["id"], etu["nom"], etu["prenom"]
+def generate_student_files_csv(
+    input_csv="liste_etudiants.csv",
+    template_path="Fichier_Excel_Professeur_Template.xlsm",  # <<< .xlsm par défaut
+    output_folder="copies_generees",                         # même dossier que côté prof
+    log_file="hash_records.csv",
+    template_version="v1.0.0",
+    workers=1,
+    progress_callback=None,
+    force=False,
+):
+    """
+    Génère les copies .xlsm manquantes ou périmées des étudiants du CSV et
+    fusionne le log des hashs.
+    - une copie est à jour si le log a une ligne pour l'étudiant avec les mêmes
+      nom/prénom et la même empreinte de template, et que le fichier existe ;
+      force=True régénère tout
+    - workers > 1 : répartit les étudiants sur un pool de processus
+    - progress_callback(done, total, result) : appelé après chaque copie générée
+      (result = dict avec "ok" et, en cas d'échec, "error")
+    Un échec sur un étudiant n'interrompt pas les autres ; le log des hashs
+    (étudiants du CSV) est remplacé atomiquement à la fin.
+    Version en lot, reprise après redémarrage : worker.py (type "generate").
+    Retourne {"output_folder", "total", "generated", "skipped", "failed", "removed", "elapsed"}.
+    """
+    # Résolution via DATA_DIR
+    template_path = _resolve(template_path)
+    output_folder = _resolve(output_folder)
 
-            # Charger le modèle en conservant les macros
-            wb = openpyxl.load_workbook(template_path, keep_vba=True, data_only=False)
-            ws = wb.active
-            main_sheet_name = ws.title
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template introuvable: {template_path}")
+    os.makedirs(output_folder, exist_ok=True)
 
-            # Z1 / Z2
-            ws["Z1"] = uid
-            h = _hash_contenu(ws, uid)
-            ws["Z2"] = h
+    # Charger la liste d'étudiants
+    etudiants = load_students(input_csv)
 
-            # Masquer Z
-            ws.column_dimensions["Z"].hidden = True
+    t0 = time.monotonic()
+    fp = template_fingerprint(template_path, template_version)
+    todo = stale_students(etudiants, template_path, output_folder, log_file, template_version, force, fp)
 
-            # Déverrouiller C..Y et protéger
-            for row_cells in ws.iter_rows(min_row=2, max_row=ws.max_row or 2, min_col=3, max_col=25):
-                for cell in row_cells:
-                    cell.protection = Protection(locked=False)
-            ws.protection.sheet = True
-            ws.protection.enable()
-            ws.protection.selectLockedCells = False
-            ws.protection.selectUnlockedCells = True
+    total = len(todo)
+    results: dict[str, dict] = {}
 
-            # Estampille d’intégrité
-            stamp_workbook(wb, template_version=template_version, student_id=uid, main_sheet_name=main_sheet_name)
+    def _done(res: dict, n_done: int):
+        results[res["id"]] = res
+        if res["ok"]:
+            print(f"✅ Copie générée : {res['nom_fichier']}")
+        else:
+            print(f"❌ Échec copie {res['id']} : {res['error']}")
+        if progress_callback:
+            progress_callback(n_done, total, res)
 
-            # >>> Sauvegarde en .xlsm
-            fname = f"{uid}_{_safe_filename(nom)}_{_safe_filename(prenom)}.xlsm"
-            out_path = os.path.join(output_folder, fname)
-            wb.save(out_path)
+    if todo:
+        # Template protégé + estampillé une seule fois pour toute la classe
+        prepared = prepare_template(template_path, template_version)
+        workers = max(1, int(workers or 1))
+        if workers == 1 or total < 2:
+            for n_done, etu in enumerate(todo, start=1):
+                _done(_generate_one(etu, output_folder, prepared), n_done)
+        else:
+            with process_pool(min(workers, total), initializer=_init_worker, initargs=(prepared,)) as pool:
+                futures = {pool.submit(_generate_one, etu, output_folder): etu for etu in todo}
+                for n_done, fut in enumerate(as_completed(futures), start=1):
+                    etu = futures[fut]
+                    try:
+                        res = fut.result()
+                    except Exception as e:  # processus du pool tombé
+                        res = {"id": etu["id"], "nom": etu["nom"], "prenom": etu["prenom"],
+                               "nom_fichier": "", "ok": False, "error": str(e)}
+                    _done(res, n_done)
 
-            w.writerow([uid, nom, prenom, h, fname])
-            print(f"✅ Copie générée : {fname}")
+    generated, skipped, failed, removed = merge_hash_log(etudiants, results, output_folder, log_file, fp)
 
-    return os.path.abspath(output_folder)
+    return {
+        "output_folder": os.path.abspath(output_folder),
+        "total": len(etudiants),
+        "generated": generated,
+        "skipped": skipped,
+        "failed": failed,
+        "removed": removed,
+        "elapsed": time.monotonic() - t0,
+    }
 
 if __name__ == "__main__":
     generate_student_files_csv(
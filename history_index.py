@@ -0,0 +1,129 @@
+# history_index.py — index des snapshots d'historique (historique_reponses/*.json)
+# -------------------------------------------------------------------------------
+# Chaque <id>.json contient tous les snapshots complets d'un étudiant : les relire
+# pour afficher "nombre de snapshots / dernier enregistrement" coûte étudiants ×
+# tentatives × cellules à chaque rerun. On tient à côté un petit index
+#   .history_index.json : {id: {"count", "last_ts", "size", "mtime_ns", "authenticity"}}
+# mis à jour (écriture atomique) à chaque enregistrement d'historique.
+# entries() lit l'index et un simple stat() par fichier : seul un fichier dont la taille
+# ou le mtime ne correspond pas (ancienne version, copie à la main) est relu, une fois.
+# Verrou fcntl quand il existe : compare_excels peut tourner dans un autre processus.
+# -------------------------------------------------------------------------------
+
+import os, json, threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrou intra-processus seulement
+    fcntl = None
+
+INDEX_NAME = ".history_index.json"
+_lock = threading.Lock()
+
+
+def _index_path(history_dir: str) -> str:
+    return os.path.join(history_dir, INDEX_NAME)
+
+
+@contextmanager
+def _locked(history_dir: str):
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(history_dir, exist_ok=True)
+        with open(os.path.join(history_dir, ".history_index.lock"), "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _load(history_dir: str) -> dict:
+    try:
+        with open(_index_path(history_dir), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _save(history_dir: str, index: dict):
+    path = _index_path(history_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _meta(history: list, stt) -> dict:
+    last = history[-1] if history else {}
+    return {
+        "count": len(history),
+        "last_ts": last.get("timestamp") if history else None,
+        "authenticity": last.get("authenticity") if history else None,
+        "size": stt.st_size,
+        "mtime_ns": stt.st_mtime_ns,
+    }
+
+
+def write_history(history_dir: str, student_id: str, history: list):
+    """Écrit <id>.json (atomique) et met à jour son entrée d'index sous le même verrou."""
+    path = os.path.join(history_dir, f"{student_id}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with _locked(history_dir):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        index = _load(history_dir)
+        index[student_id] = _meta(history, os.stat(path))
+        _save(history_dir, index)
+
+
+def forget(history_dir: str, student_id: str | None = None):
+    """Retire un étudiant de l'index (None = tout l'index)."""
+    with _locked(history_dir):
+        if student_id is None:
+            try:
+                os.remove(_index_path(history_dir))
+            except OSError:
+                pass
+            return
+        index = _load(history_dir)
+        if index.pop(student_id, None) is not None:
+            _save(history_dir, index)
+
+
+def entries(history_dir: str) -> list[dict]:
+    """[{"id", "path", "count", "last_ts", "size", "authenticity"}] triés par id, depuis l'index."""
+    with _locked(history_dir):
+        index = _load(history_dir)
+        changed = False
+        seen = set()
+        for de in os.scandir(history_dir):
+            name = de.name
+            if name.startswith(".") or not name.lower().endswith(".json"):
+                continue
+            sid = os.path.splitext(name)[0]
+            seen.add(sid)
+            stt = de.stat()
+            known = index.get(sid)
+            if known and known.get("size") == stt.st_size and known.get("mtime_ns") == stt.st_mtime_ns:
+                continue
+            try:
+                with open(de.path, "r", encoding="utf-8") as f:
+                    history = json.load(f) or []
+            except Exception:
+                history = []
+            index[sid] = _meta(history, stt)
+            changed = True
+        for sid in [s for s in index if s not in seen]:
+            del index[sid]
+            changed = True
+        if changed:
+            _save(history_dir, index)
+    return [{"id": sid, "path": os.path.join(history_dir, f"{sid}.json"), "count": m.get("count", 0),
+             "last_ts": m.get("last_ts") or "-", "size": m.get("size", 0), "authenticity": m.get("authenticity")}
+            for sid, m in sorted(index.items())]
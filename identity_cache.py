@@ -0,0 +1,99 @@
+# identity_cache.py — cache TTL (par session Streamlit) de l'identité de l'utilisateur
+# ----------------------------------------------------------------------------------
+# Streamlit ré-exécute le script à chaque clic : sans cache, chaque rerun refait
+# get_user() + get_profile() (réseau Supabase) ou get_user_by_token() (SQLite).
+# Ici une valeur fraîche (< ttl) est servie telle quelle ; une valeur périmée mais
+# encore utilisable (< max_age) est servie aussitôt et rafraîchie en arrière-plan ;
+# au-delà, on refait l'appel en direct. Un changement de rôle vide le cache.
+#   IDENTITY_TTL_SECS=60, IDENTITY_MAX_AGE_SECS=600
+# ----------------------------------------------------------------------------------
+
+import os, time, threading
+
+IDENTITY_TTL_SECS     = float(os.getenv("IDENTITY_TTL_SECS", "60"))
+IDENTITY_MAX_AGE_SECS = float(os.getenv("IDENTITY_MAX_AGE_SECS", "600"))
+
+
+def _role(value):
+    return value.get("role") if isinstance(value, dict) else None
+
+
+class IdentityCache:
+    """
+    get(key, resolver) -> valeur de resolver() mise en cache (None compris).
+    resolver doit lever en cas d'erreur réseau : l'ancienne valeur est alors conservée.
+    """
+
+    def __init__(self, ttl_secs: float = IDENTITY_TTL_SECS, max_age_secs: float = IDENTITY_MAX_AGE_SECS):
+        self.ttl_secs = max(0.0, float(ttl_secs))
+        self.max_age_secs = max(self.ttl_secs, float(max_age_secs))
+        self._lock = threading.Lock()
+        self._entries = {}      # key -> (value, fetched_at)
+        self._refreshing = set()
+        self._generation = 0    # incrémenté à chaque invalidation
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0, "invalidations": 0}
+
+    def get(self, key, resolver):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl_secs:
+                    self.stats["hits"] += 1
+                    return value
+                if age < self.max_age_secs:
+                    self.stats["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, resolver, self._generation),
+                                         name="identity-refresh", daemon=True).start()
+                    return value
+            self.stats["misses"] += 1
+            generation = self._generation
+        try:
+            value = resolver()
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+            return None
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self, key=None):
+        """Oublie une clé, ou tout le cache (key=None) : déconnexion, changement de rôle."""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    # --- interne ---
+    def _store(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return  # invalidé pendant l'appel (ex. déconnexion) : ne pas ressusciter la valeur
+            old = self._entries.get(key)
+            if old is not None and _role(old[0]) != _role(value):
+                # rôle modifié : les autres entrées (dérivées de l'ancien rôle) ne valent plus rien
+                self.stats["invalidations"] += 1
+                self._generation += 1
+                self._entries.clear()
+            self._entries[key] = (value, time.monotonic())
+
+    def _refresh(self, key, resolver, generation):
+        try:
+            value = resolver()
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+        else:
+            self._store(key, value, generation)
+            with self._lock:
+                self.stats["refreshes"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
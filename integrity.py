@@ -30,8 +30,8 @@ def _cell_range(ws: Worksheet) -> List[str]:
             addrs.append(f"{get_column_letter(col)}{row}")
     return addrs
 
-def _struct_hash(wb: openpyxl.Workbook) -> str:
-    """Empreinte globale de structure : noms de feuilles, protections, validations, contenu ligne 1 (questions)."""
+def _struct_text(wb: openpyxl.Workbook) -> str:
+    """Texte brut dont _struct_hash est l'empreinte (réutilisé par le moteur de génération)."""
     parts = []
     for ws in wb.worksheets:
         parts.append(f"[SHEET]{ws.title}")
@@ -49,7 +49,20 @@ def _struct_hash(wb: openpyxl.Workbook) -> str:
         for cell in ws[1]:
             vals.append(str(cell.value) if cell.value is not None else "")
         parts.append("row1:" + "|".join(vals))
-    return _h("\n".join(parts))
+    return "\n".join(parts)
+
+def _struct_hash(wb: openpyxl.Workbook) -> str:
+    """Empreinte globale de structure : noms de feuilles, protections, validations, contenu ligne 1 (questions)."""
+    return _h(_struct_text(wb))
+
+def _header_json(*, template_version: str, struct_hash: str, student_id: str) -> str:
+    header = {
+        "template_version": template_version,
+        "struct_hash": struct_hash,
+        "student_id": student_id,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    return json.dumps(header)
 
 def _ensure_sig_sheet(wb: openpyxl.Workbook):
     ws = wb[SIG_SHEET] if SIG_SHEET in wb.sheetnames else wb.create_sheet(SIG_SHEET)
@@ -71,14 +84,10 @@ def stamp_workbook(wb: openpyxl.Workbook, *, template_version: str, student_id:
         payload = f"{template_version}|{ws_main.title}!{addr}|{type(v).__name__}|{'' if v is None else str(v)}"
         sig_map[addr] = _hmac(payload)
 
-    header = {
-        "template_version": template_version,
-        "struct_hash": _struct_hash(wb),
-        "student_id": student_id,
-        "generated_at": datetime.now().isoformat(timespec="seconds"),
-    }
+    header = _header_json(template_version=template_version,
+                          struct_hash=_struct_hash(wb), student_id=student_id)
     ws_sig["A1"] = HEADER_KEY
-    ws_sig["B1"] = json.dumps(header)
+    ws_sig["B1"] = header
 
     # dump des signatures à partir de la ligne 2 : A2=addr, B2=sig
     r = 2
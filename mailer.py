@@ -1,5 +1,6 @@
 # mailer.py — Envoi d'emails (Resend OU SMTP, avec fallback SSL/TLS)
-import os, re, smtplib, ssl, json
+import os, re, smtplib, ssl, json, time, queue, threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.utils import formataddr, parseaddr, make_msgid
 
@@ -9,6 +10,8 @@ except Exception:
     requests = None
 
 
+SUBJECT = "Vos accès à SmartEditTrack"
+
 def _valid_email(addr: str) -> bool:
     return bool(re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", (addr or "").strip(), re.I))
 
@@ -32,93 +35,252 @@ def _render_html(uid: str, pwd: str, login_url: str) -> str:
     </div>
     """
 
-def _smtp_try_send(msg: MIMEText, host: str, port: int, user: str, pwd: str, use_tls: bool, use_ssl: bool=False) -> bool:
-    try:
-        if use_ssl:
-            ctx = ssl.create_default_context()
-            with smtplib.SMTP_SSL(host, port, context=ctx, timeout=20) as s:
-                s.login(user, pwd)
-                s.send_message(msg)
-        else:
-            if use_tls:
-                ctx = ssl.create_default_context()
-                with smtplib.SMTP(host, port, timeout=20) as s:
-                    s.ehlo()
-                    s.starttls(context=ctx)
-                    s.ehlo()
-                    s.login(user, pwd)
-                    s.send_message(msg)
-            else:
-                with smtplib.SMTP(host, port, timeout=20) as s:
-                    s.ehlo()
-                    s.login(user, pwd)
-                    s.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"[MAIL] SMTP send failed on {host}:{port} tls={use_tls} ssl={use_ssl} -> {e}")
-        return False
-
+# ---------- SMTP : transport découvert une fois, connexions réutilisées ----------
+#   SMTP_CONNECT_TIMEOUT=10   délai par tentative de découverte / connexion
+#   SMTP_WORKERS=4            connexions SMTP parallèles pour les envois groupés
+#   SMTP_RATE_PER_SEC=5       débit max (messages/s, tous workers confondus ; 0 = illimité)
+SMTP_CONNECT_TIMEOUT = float(os.getenv("SMTP_CONNECT_TIMEOUT", "10"))
+SMTP_WORKERS         = int(os.getenv("SMTP_WORKERS", "4"))
+SMTP_RATE_PER_SEC    = float(os.getenv("SMTP_RATE_PER_SEC", "5"))
 
-def send_credentials_email(to_email: str, user_id: str, temp_pwd: str, login_url: str | None = None) -> bool:
-    if not _valid_email(to_email):
-        print("[MAIL] Invalid recipient email.")
-        return False
-
-    login_url = (login_url or _app_base_url()).strip()
-    subject = "Vos accès à SmartEditTrack"
-    html = _render_html(user_id, temp_pwd, login_url)
+_transport_lock = threading.Lock()
+_transport = None       # (host, port, use_tls, use_ssl) qui a fonctionné
+_tls = threading.local()
 
-    # 1) Resend (optionnel)
-    apikey = os.getenv("RESEND_API_KEY", "").strip()
-    from_resend = os.getenv("RESEND_FROM", "").strip()
-    if apikey and requests and from_resend:
-        try:
-            r = requests.post(
-                "https://api.resend.com/emails",
-                headers={"Authorization": f"Bearer {apikey}", "Content-Type": "application/json"},
-                data=json.dumps({"from": from_resend, "to": [to_email], "subject": subject, "html": html}),
-                timeout=20,
-            )
-            if r.ok:
-                return True
-            print(f"[MAIL] Resend error: {r.status_code} {r.text}")
-        except Exception as e:
-            print(f"[MAIL] Resend exception: {e}")
-
-    # 2) SMTP Mailtrap
+def _smtp_config():
     host = os.getenv("SMTP_HOST", "").strip()
     user = os.getenv("SMTP_USER", "").strip()
     pwd  = os.getenv("SMTP_PASS", "").strip()
-    from_raw = os.getenv("SMTP_FROM", "").strip()
     try:
         port_cfg = int(os.getenv("SMTP_PORT", "465").strip() or "465")
     except Exception:
         port_cfg = 465
+    return host, user, pwd, port_cfg
+
+class _DataTracking:
+    """Note le passage à la commande DATA : au-delà, le serveur a pu accepter le message."""
+    data_sent = False
 
+    def data(self, msg):
+        self.data_sent = True
+        return super().data(msg)
+
+class _SMTP(_DataTracking, smtplib.SMTP):
+    pass
+
+class _SMTP_SSL(_DataTracking, smtplib.SMTP_SSL):
+    pass
+
+def _smtp_connect(host: str, port: int, user: str, pwd: str, use_tls: bool, use_ssl: bool=False):
+    """Connexion SMTP ouverte et authentifiée (lève en cas d'échec)."""
+    if use_ssl:
+        s = _SMTP_SSL(host, port, context=ssl.create_default_context(), timeout=SMTP_CONNECT_TIMEOUT)
+    else:
+        s = _SMTP(host, port, timeout=SMTP_CONNECT_TIMEOUT)
+    try:
+        s.ehlo()
+        if use_tls:
+            s.starttls(context=ssl.create_default_context())
+            s.ehlo()
+        if user and s.has_extn("auth"):
+            s.login(user, pwd)
+        return s
+    except Exception:
+        s.close()
+        raise
+
+def _smtp_open():
+    """
+    Connexion sur le transport en cache ; au 1er appel (ou si le transport en cache
+    ne répond plus), essaie les combinaisons port/TLS dans l'ordre et mémorise la bonne.
+    """
+    global _transport
+    host, user, pwd, port_cfg = _smtp_config()
     if not host or not user or not pwd:
-        print(f"[MAIL] Missing SMTP vars. host={bool(host)} user={bool(user)} pass={bool(pwd)}")
-        return False
+        raise RuntimeError(f"Missing SMTP vars. host={bool(host)} user={bool(user)} pass={bool(pwd)}")
+    with _transport_lock:  # découverte sérialisée : les autres threads attendent et réutilisent le résultat
+        cached = _transport
+        if cached:
+            try:
+                return _smtp_connect(cached[0], cached[1], user, pwd, cached[2], use_ssl=cached[3])
+            except Exception as e:
+                print(f"[MAIL] Cached SMTP transport {cached} failed -> {e}; rediscovering")
+                _transport = None
+        # Essais (dans cet ordre) :
+        attempts = [
+            (host, 465, False, True),           # SSL direct (recommandé)
+            (host, 587, True,  False),          # STARTTLS standard
+            (host, 2525, True, False),          # STARTTLS Mailtrap
+            (host, port_cfg, False, False),     # port configuré sans TLS (secours)
+        ]
+        last = None
+        for t in attempts:
+            try:
+                s = _smtp_connect(t[0], t[1], user, pwd, t[2], use_ssl=t[3])
+            except Exception as e:
+                print(f"[MAIL] SMTP connect failed on {t[0]}:{t[1]} tls={t[2]} ssl={t[3]} -> {e}")
+                last = e
+                continue
+            _transport = t
+            return s
+    raise RuntimeError(f"No working SMTP transport ({last})")
+
+def _smtp_send(msg: MIMEText):
+    """
+    Envoie via la connexion persistante du thread courant. Connexion coupée avant DATA
+    (MAIL/RCPT, ex. fermée par le serveur après inactivité) : une reconnexion et un nouvel
+    essai. Après DATA, le message a pu être accepté : on lève sans renvoyer (pas de doublon).
+    """
+    for attempt in (1, 2):
+        s = getattr(_tls, "smtp", None)
+        if s is None:
+            s = _tls.smtp = _smtp_open()
+        s.data_sent = False
+        try:
+            s.send_message(msg)
+            return
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            raise  # refus du serveur pour CE message : la connexion reste utilisable
+        except (smtplib.SMTPServerDisconnected, OSError):
+            _smtp_close()
+            if attempt == 2 or s.data_sent:
+                raise
+
+def _smtp_close():
+    s = getattr(_tls, "smtp", None)
+    _tls.smtp = None
+    if s is not None:
+        try:
+            s.quit()
+        except Exception:
+            pass
 
-    name, addr = parseaddr(from_raw)
+class _RateLimiter:
+    """Au plus `rate` appels/s (créneaux réservés sous verrou, partagé entre threads)."""
+
+    def __init__(self, rate: float):
+        self.interval = (1.0 / rate) if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# ---------- Messages ----------
+def _build_message(to_email: str, user_id: str, temp_pwd: str, login_url: str) -> MIMEText:
+    name, addr = parseaddr(os.getenv("SMTP_FROM", "").strip())
     if not _valid_email(addr):
         addr = "no-reply@smartedittrack.test"
     name = name or "SmartEditTrack"
 
-    msg = MIMEText(html, "html", "utf-8")
+    msg = MIMEText(_render_html(user_id, temp_pwd, login_url), "html", "utf-8")
     msg["From"] = formataddr((name, addr))
     msg["To"] = to_email
-    msg["Subject"] = subject
+    msg["Subject"] = SUBJECT
     msg["Message-ID"] = make_msgid(domain=addr.split("@")[-1])
+    return msg
 
-    # Essais (dans cet ordre) :
-    attempts = [
-        (host, 465, False, True),           # SSL direct (recommandé)
-        (host, 587, True,  False),          # STARTTLS standard
-        (host, 2525, True, False),          # STARTTLS Mailtrap
-        (host, port_cfg, False, False),     # port configuré sans TLS (secours)
-    ]
-    for h, p, tls, ssl_on in attempts:
-        if _smtp_try_send(msg, h, p, user, pwd, tls, use_ssl=ssl_on):
+def _send_resend(to_email: str, html: str) -> bool | None:
+    """True/False si Resend est configuré, None sinon."""
+    apikey = os.getenv("RESEND_API_KEY", "").strip()
+    from_resend = os.getenv("RESEND_FROM", "").strip()
+    if not (apikey and requests and from_resend):
+        return None
+    try:
+        r = requests.post(
+            "https://api.resend.com/emails",
+            headers={"Authorization": f"Bearer {apikey}", "Content-Type": "application/json"},
+            data=json.dumps({"from": from_resend, "to": [to_email], "subject": SUBJECT, "html": html}),
+            timeout=20,
+        )
+        if r.ok:
             return True
-
+        print(f"[MAIL] Resend error: {r.status_code} {r.text}")
+    except Exception as e:
+        print(f"[MAIL] Resend exception: {e}")
     return False
+
+def _deliver(to_email: str, user_id: str, temp_pwd: str, login_url: str | None) -> str | None:
+    """Envoie un email d'identifiants. Retourne None si OK, sinon le message d'erreur."""
+    if not _valid_email(to_email):
+        return "Invalid recipient email."
+    login_url = (login_url or _app_base_url()).strip()
+
+    # 1) Resend (optionnel)
+    if _send_resend(to_email, _render_html(user_id, temp_pwd, login_url)):
+        return None
+
+    # 2) SMTP (Mailtrap…)
+    try:
+        _smtp_send(_build_message(to_email, user_id, temp_pwd, login_url))
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def send_credentials_email(to_email: str, user_id: str, temp_pwd: str, login_url: str | None = None) -> bool:
+    err = _deliver(to_email, user_id, temp_pwd, login_url)
+    _smtp_close()  # envoi isolé : ne pas garder la connexion ouverte
+    if err:
+        print(f"[MAIL] {err}")
+    return err is None
+
+
+def send_credentials_batch(items, workers: int = SMTP_WORKERS, rate_per_sec: float = SMTP_RATE_PER_SEC,
+                           progress_callback=None) -> list[dict]:
+    """
+    Envoi groupé. items : [{"email", "user_id", "password", "login_url"?}, ...]
+    Jusqu'à `workers` connexions SMTP persistantes (une par thread, réutilisée pour
+    tous ses messages), débit global borné par `rate_per_sec`.
+    Retourne, dans l'ordre de `items` : [{"email", "user_id", "ok": bool, "error": str|None}, ...]
+    progress_callback(done, total) est appelé après chaque message, dans le thread appelant.
+    """
+    items = list(items)
+    if not items:
+        return []
+    limiter = _RateLimiter(rate_per_sec)
+    results = [None] * len(items)
+    finished: queue.Queue = queue.Queue()
+
+    def _one(i):
+        it = items[i]
+        try:
+            limiter.wait()
+            err = _deliver(it["email"], it["user_id"], it["password"], it.get("login_url"))
+        except Exception as e:
+            err = str(e)
+        results[i] = {"email": it["email"], "user_id": it["user_id"], "ok": err is None, "error": err}
+        if err:
+            print(f"[MAIL] {it['email']}: {err}")
+        finished.put(i)
+
+    def _worker(indices):
+        try:
+            for i in indices:
+                _one(i)
+        finally:
+            _smtp_close()
+
+    n = max(1, min(int(workers or 1), len(items)))
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        # chaque worker traite une tranche : une connexion SMTP par worker pour tout le lot
+        for k in range(n):
+            ex.submit(_worker, range(k, len(items), n))
+        # progression dans le thread appelant (st.progress n'accepte que le thread du script) ;
+        # un callback en échec n'interrompt pas le lot : les résultats doivent revenir à l'outbox
+        for done in range(1, len(items) + 1):
+            finished.get()
+            if progress_callback:
+                try:
+                    progress_callback(done, len(items))
+                except Exception as e:
+                    print(f"[MAIL] progress_callback: {e}")
+                    progress_callback = None
+    return results
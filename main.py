@@ -24,9 +24,13 @@ from sb_auth import (
     verify_recovery_token, update_current_password, admin_set_password_for_user,
 )
 
+from identity_cache import IdentityCache
+
 # Helpers Supabase Storage et chemins locaux (app_prof)
-from supa import list_prefix, download_to_file
+from supa import list_prefix
 from app_prof import _class_csv, _class_copies_dir
+import restore
+import worker
 
 # ---------------------------------------------------------------------------
 # Restauration /tmp depuis Supabase (utile sur Render Free où /tmp est éphémère)
@@ -36,10 +40,22 @@ def _slugify(s: str) -> str:
     s = re.sub(r"[^a-z0-9\-]+", "-", s).strip("-")
     return s or "classe"
 
-def _restore_from_supabase():
-    conn = get_conn()
+def _local_for(remote: str) -> str | None:
+    """Chemin local (DATA_DIR) d'un objet Storage restaurable."""
+    parts = remote.split("/")
+    if len(parts) != 3:
+        return None
+    top, slug, fname = parts
+    if top == "copies" and fname.lower().endswith(".xlsm"):
+        return os.path.join(_class_copies_dir(slug), fname)
+    if top == "classes" and fname.lower().endswith(".csv"):
+        return os.path.join(os.path.dirname(_class_csv(slug)), fname)
+    return None
+
+def _listing_inventory() -> dict:
+    """Inventaire sans manifeste distant (ancien bucket) : classes connues en BD + listing des copies."""
     try:
-        rows = conn.execute("""
+        rows = get_conn().execute("""
             SELECT DISTINCT class_name
             FROM users
             WHERE class_name IS NOT NULL AND class_name <> ''
@@ -47,40 +63,43 @@ def _restore_from_supabase():
     except Exception:
         rows = []
 
+    files = {}
     for (classname,) in rows:
         if not classname:
             continue
         slug = _slugify(classname)
-
-        os.makedirs(os.path.dirname(_class_csv(slug)), exist_ok=True)
-        os.makedirs(_class_copies_dir(slug), exist_ok=True)
-
-        # CSV
-        try:
-            download_to_file(f"classes/{slug}/liste_etudiants.csv", _class_csv(slug))
-        except Exception:
-            pass
-
-        # Copies .xlsm
+        files[f"classes/{slug}/liste_etudiants.csv"] = {}
         try:
             for it in (list_prefix(f"copies/{slug}") or []):
-                if it.get("is_folder"):
-                    continue
-                remote = it.get("name") or ""
-                if remote.lower().endswith(".xlsm"):
-                    local = os.path.join(_class_copies_dir(slug), os.path.basename(remote))
-                    if not os.path.exists(local):
-                        download_to_file(remote, local)
+                if not it.get("is_folder"):
+                    files[it.get("name") or ""] = {}
         except Exception:
             pass
+    return files
 
 @st.cache_resource(show_spinner=False)
 def restore_from_supabase_once():
+    # en arrière-plan par défaut : la page de connexion s'affiche sans attendre
     try:
-        _restore_from_supabase()
+        return restore.start(_local_for, _listing_inventory)
     except Exception as e:
         # on loggue mais on ne bloque pas l'app
         print("restore_from_supabase skipped:", e)
+        return None
+
+@st.cache_resource(show_spinner=False)
+def start_worker_once():
+    # analyse automatique des dépôts (worker.py) : un sous-processus par conteneur
+    try:
+        return worker.spawn()
+    except Exception as e:
+        print("worker skipped:", e)
+        return None
+
+def _restore_caption():
+    prog = restore.progress()
+    if prog and prog["state"] == "running" and prog["total"]:
+        st.caption(f"⏳ Restauration des données : {prog['done']}/{prog['total']} fichier(s)…")
 
 # ---------------------------------------------------------------------------
 
@@ -92,6 +111,25 @@ ensure_schema(conn)
 if os.getenv("RESTORE_FROM_SUPABASE", "1") == "1":
     restore_from_supabase_once()
 
+start_worker_once()
+
+# ---------------------------------------------------------------------------
+# Identité (user + rôle) mise en cache par session : pas d'appel réseau à chaque rerun
+# ---------------------------------------------------------------------------
+def _identity() -> IdentityCache:
+    ic = st.session_state.get("identity_cache")
+    if ic is None:
+        ic = st.session_state["identity_cache"] = IdentityCache()
+    return ic
+
+def _resolve_supabase_identity():
+    su = get_user()  # lève si Supabase injoignable : le cache garde l'ancienne valeur
+    u = getattr(su, "user", None)
+    if not u:
+        return None
+    prof = get_profile(u.id) or {}
+    return {"id": u.id, "email": u.email, "role": prof.get("role", "student")}
+
 def _q(name: str):
     v = st.query_params.get(name, None)
     return (v[0] if isinstance(v, list) else v)
@@ -208,6 +246,7 @@ SVG_ILLU = """
 
 def login_view():
     st.markdown(LOGIN_CSS, unsafe_allow_html=True)
+    _restore_caption()
     st.markdown('<div class="wrap">', unsafe_allow_html=True)
     left, right = st.columns([1.2, .8])
 
@@ -275,6 +314,7 @@ def login_view():
                         except Exception:
                             pass
                         st.session_state["supabase_user"] = {"id": u.id, "email": u.email}
+                        _identity().invalidate()
                         st.success("Connexion réussie.")
                         st.rerun()
 
@@ -315,6 +355,7 @@ def login_view():
                     tok = create_session(conn, user["id"])
                     st.session_state["local_token"] = tok
                     st.session_state["local_user"] = user
+                    _identity().invalidate()
                     try:
                         record_login(conn, user["id"], ip=ip, ua="streamlit-local")
                     except Exception:
@@ -331,32 +372,33 @@ def app_view():
     st.markdown("""<style>[data-testid="stSidebarNav"]{ display:none !important; }</style>""",
                 unsafe_allow_html=True)
 
-    try:
-        su = get_user()
-        sb_user = getattr(su, "user", None)
-    except Exception:
-        sb_user = None
+    ident = _identity()
+    sb_user = ident.get("supabase", _resolve_supabase_identity)
 
     local_tok = st.session_state.get("local_token")
-    local_user = get_user_by_token(conn, local_tok) if local_tok else None
+    # get_conn() (et non conn) : le rafraîchissement peut tourner dans un autre thread
+    local_user = ident.get(("local", local_tok), lambda: get_user_by_token(get_conn(), local_tok)) if local_tok else None
+
+    if os.getenv("IDENTITY_CACHE_STATS", "0") == "1":
+        st.sidebar.caption("Cache identité : " + ", ".join(f"{k}={v}" for k, v in ident.stats.items()))
 
     if sb_user:
-        prof = get_profile(sb_user.id) or {}
-        role = prof.get("role", "student")
-        st.sidebar.success(f"{sb_user.email} — ({role})")
+        role = sb_user["role"]
+        st.sidebar.success(f"{sb_user['email']} — ({role})")
         if st.sidebar.button("Se déconnecter (Admin/Prof)", use_container_width=True, key="btn_logout_admin"):
             try: sign_out()
             except Exception: pass
             st.session_state.pop("supabase_user", None)
+            ident.invalidate()
             st.rerun()
 
         if role in ("admin", "prof"):
             from app_prof import run as prof_run
-            prof_run({"id": sb_user.id, "role": role}); return
+            prof_run({"id": sb_user["id"], "role": role}); return
         else:
             st.warning("Profil non reconnu — rôle par défaut étudiant.")
             from app_etudiant import run as etu_run
-            etu_run({"id": sb_user.id, "role": "student"}); return
+            etu_run({"id": sb_user["id"], "role": "student"}); return
 
     if local_user:
         st.sidebar.success(f"{local_user['id']} — (étudiant)")
@@ -365,6 +407,7 @@ def app_view():
             finally:
                 st.session_state.pop("local_token", None)
                 st.session_state.pop("local_user", None)
+                ident.invalidate()
                 st.rerun()
         from app_etudiant import run as etu_run
         etu_run(local_user); return
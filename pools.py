@@ -0,0 +1,18 @@
+# pools.py — pools de processus en "spawn", communs à auth, hash_generator et worker
+# ------------------------------------------------------------------------------------
+# Ces pools sont créés depuis le serveur Streamlit, qui fait déjà tourner des threads
+# (sauvegarde de la BD, restauration, worker en mode lot, boucle asyncio de
+# storage_async) : un fork hériterait de verrous éventuellement pris par ces threads
+# et pourrait se bloquer. En "spawn", chaque processus part d'un interpréteur neuf.
+# Les fonctions soumises (et l'initializer) doivent être définies au niveau module.
+# ------------------------------------------------------------------------------------
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """ProcessPoolExecutor dont les processus démarrent en "spawn" (MP_CONTEXT)."""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=MP_CONTEXT, **kwargs)
@@ -0,0 +1,84 @@
+# report_view.py — découpage des rapports HTML (compare_excels) pour un affichage à la demande
+# --------------------------------------------------------------------------------------------
+# Un rapport HTML = <head> (styles) + une suite de blocs de premier niveau dans
+# <div class="wrap"> (cartes, grilles de KPI). Les tableaux "Historique par cellule"
+# ou "Traçabilité VBA" peuvent peser plusieurs Mo : on découpe le document en
+# sections pour n'envoyer au navigateur que les petites, les grosses à la demande.
+# Chaque section est rendue seule avec le <head> d'origine (mêmes styles).
+# Pas de Streamlit ici : la mise en cache (chemin + mtime) est faite par app_prof.
+#   REPORT_SECTION_INLINE_KB=64  (au-delà, section chargée à la demande)
+#   REPORT_TXT_PREVIEW_CHARS=200000  (aperçu d'un rapport texte ; le fichier complet au téléchargement)
+# --------------------------------------------------------------------------------------------
+
+import os
+import re
+
+REPORT_SECTION_INLINE_KB = int(os.environ.get("REPORT_SECTION_INLINE_KB", "64"))
+REPORT_TXT_PREVIEW_CHARS = int(os.environ.get("REPORT_TXT_PREVIEW_CHARS", "200000"))
+
+_WRAP_OPEN = '<div class="wrap">'
+_DIV_TAG = re.compile(r"<div\b|</div\s*>", re.I)
+_TITLE = re.compile(r"<h[12][^>]*>(.*?)</h[12]>", re.I | re.S)
+_TAGS = re.compile(r"<[^>]+>")
+
+
+def _title(block: str) -> str:
+    m = _TITLE.search(block)
+    return re.sub(r"\s+", " ", _TAGS.sub("", m.group(1))).strip() if m else ""
+
+
+def _blocks(body: str) -> list[str]:
+    """Blocs <div>…</div> de premier niveau de `body` (le texte entre deux blocs est rattaché au suivant)."""
+    out, depth, start = [], 0, 0
+    for m in _DIV_TAG.finditer(body):
+        if m.group(0).lower().startswith("</"):
+            depth -= 1
+            if depth == 0:
+                out.append(body[start:m.end()].strip())
+                start = m.end()
+        else:
+            depth += 1
+    rest = body[start:].strip()
+    if rest:
+        out.append(rest)
+    return [b for b in out if b]
+
+
+def split_report(html: str) -> dict:
+    """
+    {"head": début du document jusqu'à <div class="wrap"> inclus, "tail": fin du document,
+     "sections": [{"title", "html", "size"}]} — un seul bloc si la structure est inconnue.
+    Une section par bloc (les grilles de KPI, sans titre, restent petites donc affichées d'emblée).
+    """
+    i = html.find(_WRAP_OPEN)
+    j = html.rfind("</body>")
+    if i < 0 or j < i:
+        return {"head": "", "tail": "", "sections": [{"title": "", "html": html, "size": len(html)}]}
+    head = html[:i + len(_WRAP_OPEN)]
+    body = html[i + len(_WRAP_OPEN):j].rstrip()
+    if body.endswith("</div>"):  # fermeture de .wrap
+        body = body[:-len("</div>")]
+    sections = [{"title": _title(block), "html": block, "size": len(block)} for block in _blocks(body)]
+    return {"head": head, "tail": "</div>" + html[j:], "sections": sections}
+
+
+def load_report(path: str) -> dict:
+    """split_report() du fichier, plus "size" (octets sur disque) et "lazy" : indices des grosses sections."""
+    with open(path, "r", encoding="utf-8") as f:
+        doc = split_report(f.read())
+    limit = REPORT_SECTION_INLINE_KB * 1024
+    doc["size"] = os.path.getsize(path)
+    doc["lazy"] = [k for k, s in enumerate(doc["sections"]) if s["size"] > limit] if len(doc["sections"]) > 1 else []
+    return doc
+
+
+def render(doc: dict, indices) -> str:
+    """Document HTML autonome (mêmes styles) avec les sections `indices`, dans l'ordre."""
+    return doc["head"] + "\n".join(doc["sections"][k]["html"] for k in indices) + doc["tail"]
+
+
+def read_text(path: str, max_chars: int = REPORT_TXT_PREVIEW_CHARS) -> tuple[str, bool]:
+    """Début d'un rapport texte (au plus max_chars caractères) et s'il a été tronqué."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read(max_chars + 1)
+    return text[:max_chars], len(text) > max_chars
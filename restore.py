@@ -0,0 +1,269 @@
+# restore.py — restauration de DATA_DIR depuis Supabase Storage, pilotée par manifeste
+# ------------------------------------------------------------------------------------
+# Sur un disque éphémère (Render free), DATA_DIR est vide au démarrage. Au lieu de
+# lister chaque classe et télécharger séquentiellement avant d'afficher la page :
+#   1) on lit le manifeste distant (supa.fetch_remote_manifest : chemins, tailles, sha256),
+#      à défaut un inventaire fourni par l'appelant (listing du bucket) ;
+#   2) on calcule le delta avec le disque (absent, taille ou sha256 différents) ;
+#   3) on télécharge le delta en arrière-plan, par lots, sur le client Storage asyncio
+#      (concurrence bornée, connexions keep-alive).
+# ensure(prefix) rapatrie en priorité (dans le thread appelant) ce qui manque sous un
+# préfixe : une page qui a besoin d'une classe n'attend que cette classe.
+#   RESTORE_MODE=background (défaut) | lazy (seulement via ensure) | sync (bloquant) | off
+#   RESTORE_WORKERS=8
+# ------------------------------------------------------------------------------------
+
+import os, json, hashlib, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from supa import fetch_remote_manifest, download_bytes, iter_download
+
+DATA_DIR        = os.environ.get("DATA_DIR", "/tmp")
+RESTORE_MODE    = os.environ.get("RESTORE_MODE", "background").strip().lower()
+RESTORE_WORKERS = int(os.environ.get("RESTORE_WORKERS", "8"))
+RESTORE_RETRIES = 2
+# empreintes des fichiers locaux déjà vérifiés : évite de re-hasher à chaque démarrage
+_STATE_PATH = os.path.join(DATA_DIR, ".restore_state.json")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RestoreJob:
+    """
+    local_for(remote_path) -> chemin local, ou None pour ignorer l'objet.
+    fallback() -> {remote_path: {"sha256"?, "size"?}} si aucun manifeste distant
+    (sans sha256/size, un fichier local existant est considéré à jour).
+    """
+
+    def __init__(self, local_for, fallback=None, workers: int = RESTORE_WORKERS):
+        self.local_for = local_for
+        self.fallback = fallback
+        self.workers = max(1, int(workers))
+        self._lock = threading.Lock()
+        self._planned = threading.Event()
+        self._plan_lock = threading.Lock()
+        self._items = {}        # remote -> {"local", "sha256", "size", "state", "done": Event}
+        self._thread = None
+        self._state = self._load_state()
+        self.progress = {"state": "idle", "total": 0, "done": 0, "failed": 0, "bytes": 0,
+                         "source": None, "started": None, "elapsed": 0.0}
+
+    # --- état local ---
+    def _load_state(self) -> dict:
+        try:
+            with open(_STATE_PATH, "r", encoding="utf-8") as f:
+                return json.load(f) or {}
+        except Exception:
+            return {}
+
+    def _save_state(self):
+        with self._lock:
+            data = json.dumps(self._state)
+        tmp = f"{_STATE_PATH}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, _STATE_PATH)
+        except Exception:
+            pass
+
+    def _local_sha(self, local: str, stt) -> str:
+        known = self._state.get(local)
+        if known and known.get("size") == stt.st_size and known.get("mtime_ns") == stt.st_mtime_ns:
+            return known.get("sha256")
+        digest = _sha256(local)
+        with self._lock:
+            self._state[local] = {"size": stt.st_size, "mtime_ns": stt.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def _is_stale(self, local: str, sha: str | None, size: int | None) -> bool:
+        try:
+            stt = os.stat(local)
+        except OSError:
+            return True
+        if size is not None and stt.st_size != size:
+            return True
+        if sha and self._local_sha(local, stt) != sha:
+            return True
+        return False
+
+    # --- plan ---
+    def plan(self):
+        """Lit le manifeste et calcule le delta à télécharger (idempotent)."""
+        with self._plan_lock:
+            if not self._planned.is_set():
+                self._plan()
+
+    def _plan(self):
+        files = fetch_remote_manifest()
+        source = "manifest"
+        if files is None:
+            files = self.fallback() if self.fallback else {}
+            source = "listing"
+        items = {}
+        for remote, meta in sorted((files or {}).items()):
+            local = self.local_for(remote)
+            if not local:
+                continue
+            meta = meta or {}
+            # dossiers créés d'emblée : la liste des classes est complète avant la fin du téléchargement
+            os.makedirs(os.path.dirname(local) or ".", exist_ok=True)
+            if self._is_stale(local, meta.get("sha256"), meta.get("size")):
+                items[remote] = {"local": local, "sha256": meta.get("sha256"), "size": meta.get("size"),
+                                 "state": "pending", "done": threading.Event()}
+        with self._lock:
+            self._items = items
+            self.progress.update(total=len(items), source=source)
+        self._save_state()
+        self._planned.set()
+
+    # --- téléchargement ---
+    def _claim(self, remote: str) -> bool:
+        with self._lock:
+            it = self._items.get(remote)
+            if not it or it["state"] != "pending":
+                return False
+            it["state"] = "running"
+            return True
+
+    def _write(self, remote: str, data: bytes):
+        """Vérifie (sha256) et écrit atomiquement un objet téléchargé ; lève si invalide."""
+        it = self._items[remote]
+        digest = hashlib.sha256(data).hexdigest()
+        if it["sha256"] and digest != it["sha256"]:
+            raise ValueError("sha256 différent du manifeste")
+        os.makedirs(os.path.dirname(it["local"]) or ".", exist_ok=True)
+        tmp = f"{it['local']}.restore{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, it["local"])
+        stt = os.stat(it["local"])
+        with self._lock:
+            self._state[it["local"]] = {"size": stt.st_size, "mtime_ns": stt.st_mtime_ns, "sha256": digest}
+            it["state"] = "done"
+            self.progress["done"] += 1
+            self.progress["bytes"] += len(data)
+        it["done"].set()
+
+    def _fail(self, remote: str, err):
+        it = self._items[remote]
+        print(f"[restore] {remote} : échec ({err})")
+        with self._lock:
+            it["state"] = "failed"
+            self.progress["failed"] += 1
+        it["done"].set()
+
+    def _fetch(self, remote: str):
+        """Téléchargement unitaire (client synchrone) avec retries."""
+        err = None
+        for attempt in range(RESTORE_RETRIES + 1):
+            try:
+                self._write(remote, download_bytes(remote))
+                return
+            except Exception as e:
+                err = e
+                if attempt < RESTORE_RETRIES:
+                    time.sleep(0.5 * (2 ** attempt))
+        self._fail(remote, err)
+
+    def _run_one(self, remote: str):
+        if self._claim(remote):
+            self._fetch(remote)
+
+    def run(self):
+        """
+        Plan + téléchargement de tout le delta (bloquant). Les objets sont réclamés par
+        lots et téléchargés sur le client asyncio (supa.iter_download) ; ce qui n'est pas
+        encore réclamé reste disponible pour ensure().
+        """
+        self.progress.update(state="running", started=time.time())
+        try:
+            self.plan()
+            remotes = list(self._items)
+            batch = self.workers * 4
+            for i in range(0, len(remotes), batch):
+                claimed = [r for r in remotes[i:i + batch] if self._claim(r)]
+                pending = set(claimed)
+                try:
+                    for remote, data in iter_download(claimed, concurrency=self.workers, retries=RESTORE_RETRIES):
+                        pending.discard(remote)
+                        if isinstance(data, Exception):
+                            self._fail(remote, data)
+                            continue
+                        try:
+                            self._write(remote, data)
+                        except Exception:
+                            self._fetch(remote)   # contenu invalide : nouvel essai unitaire
+                except Exception as e:
+                    print("[restore] client asyncio indisponible, repli synchrone :", e)
+                    for remote in claimed:
+                        if remote in pending:
+                            self._fetch(remote)
+        except Exception as e:
+            print("[restore] interrompu :", e)
+        finally:
+            self._save_state()
+            self.progress.update(state="done", elapsed=time.time() - (self.progress["started"] or time.time()))
+
+    def start(self):
+        """Lance run() en arrière-plan (une seule fois)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="restore", daemon=True)
+                self._thread.start()
+        return self
+
+    def ensure(self, prefix: str, timeout: float | None = 120):
+        """Garantit que les objets sous `prefix` sont sur le disque (priorité sur le fond)."""
+        self.plan()
+        with self._lock:
+            remotes = [r for r in self._items if r.startswith(prefix)]
+        if not remotes:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(remotes))) as pool:
+            list(pool.map(self._run_one, remotes))
+        deadline = None if timeout is None else time.time() + timeout
+        for r in remotes:  # ceux pris par le thread de fond
+            self._items[r]["done"].wait(None if deadline is None else max(0.0, deadline - time.time()))
+        self._save_state()
+
+    @property
+    def running(self) -> bool:
+        return self.progress["state"] == "running"
+
+
+# --- job unique du processus ---
+_JOB: RestoreJob | None = None
+
+
+def start(local_for, fallback=None, mode: str = RESTORE_MODE) -> RestoreJob | None:
+    """Crée le job de restauration du processus selon `mode` (background | lazy | sync | off)."""
+    global _JOB
+    if mode == "off":
+        return None
+    if _JOB is None:
+        _JOB = RestoreJob(local_for, fallback)
+        if mode == "sync":
+            _JOB.run()
+        elif mode != "lazy":
+            _JOB.start()
+    return _JOB
+
+
+def ensure(prefix: str, timeout: float | None = 120):
+    """Restauration à la demande d'un préfixe (no-op si aucun job)."""
+    if _JOB is not None:
+        try:
+            _JOB.ensure(prefix, timeout=timeout)
+        except Exception as e:
+            print(f"[restore] ensure({prefix}) :", e)
+
+
+def progress() -> dict | None:
+    return dict(_JOB.progress) if _JOB is not None else None
@@ -0,0 +1,475 @@
+# storage.py — stockage objet à étages : backends interchangeables + cache disque LRU
+# -----------------------------------------------------------------------------------
+# Un "bucket" expose l'interface storage3 utilisée par supa.py :
+#   upload(path, file, file_options) / download(path) / list(path, options)
+#   remove(paths) / create_signed_url(path, expires_in) / create_signed_urls(paths, expires_in)
+# Backends :
+#   - SupabaseBackend : le bucket Supabase (résolu à chaque appel, client lazy)
+#   - LocalBackend    : un dossier local (<root>/<remote_path>) — tests, hors-ligne, benchmarks
+#   - MemoryBackend   : un dict en mémoire — tests unitaires, benchmarks sans I/O
+# CachedBucket place devant le backend un cache disque :
+#   - lecture : read-through (disque d'abord, sinon backend puis copie locale) ;
+#   - écriture : write-through (backend d'abord, puis copie locale) ;
+#   - suppression : invalide la copie locale ;
+#   - budget en octets, éviction LRU (les objets les moins récemment lus partent d'abord).
+# Les CSV de classe, gabarits et copies souvent relus sont ainsi servis depuis le disque
+# sans dépasser le budget fixé (le disque Render fait 5 Go, partagé avec DATA_DIR).
+#   STORAGE_BACKEND=supabase (défaut) | local | memory
+#     (SUPABASE_LOCAL_DIR défini => local, comme avant)
+#   STORAGE_CACHE_DIR=$DATA_DIR/.storage_cache
+#   STORAGE_CACHE_MAX_MB=512      (0 = pas de cache)
+#   STORAGE_CACHE_TTL_SECS=86400  (âge max d'une copie locale, 0 = sans limite)
+#   STORAGE_CACHE_RESCAN_SECS=5   (relecture du dossier partagé au plus tous les N s, ou si budget dépassé)
+#   STORAGE_CACHE_SKIP=manifests/,backups/   (préfixes jamais mis en cache)
+# -----------------------------------------------------------------------------------
+
+from __future__ import annotations
+
+import os
+import time
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DATA_DIR = os.environ.get("DATA_DIR", "/tmp")
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "").strip().lower()
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", os.path.join(DATA_DIR, ".storage_cache"))
+STORAGE_CACHE_MAX_BYTES = int(float(os.environ.get("STORAGE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+STORAGE_CACHE_TTL_SECS = float(os.environ.get("STORAGE_CACHE_TTL_SECS", "86400"))
+STORAGE_CACHE_RESCAN_SECS = float(os.environ.get("STORAGE_CACHE_RESCAN_SECS", "5"))
+STORAGE_CACHE_SKIP = tuple(
+    p.strip() for p in os.environ.get("STORAGE_CACHE_SKIP", "manifests/,backups/").split(",") if p.strip()
+)
+
+
+def _read_upload(file) -> bytes:
+    """Contenu d'un argument `file` de upload() : bytes, chemin ou objet fichier."""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, (str, Path)):
+        return Path(file).read_bytes()
+    return file.read()
+
+
+def _listing_entry(name: str, size: int | None = None, mtime: float | None = None) -> dict:
+    """Entrée de list() au format storage3 (size=None => dossier)."""
+    if size is None:
+        return {"name": name, "id": None, "metadata": None}
+    return {
+        "name": name,
+        "id": hashlib.md5(name.encode()).hexdigest(),
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(mtime or time.time())),
+        "metadata": {"size": size,
+                     "mimetype": mimetypes.guess_type(name)[0] or "application/octet-stream"},
+    }
+
+
+# --------------------------------------------------------------------
+# Backends
+# --------------------------------------------------------------------
+class SupabaseBackend:
+    """Bucket Supabase : `factory()` retourne le bucket storage3 (appelé à chaque opération)."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def upload(self, path: str, file, file_options: dict | None = None):
+        return self._factory().upload(path, file, file_options)
+
+    def download(self, path: str) -> bytes:
+        return self._factory().download(path)
+
+    def list(self, path: str | None = None, options: dict | None = None) -> list:
+        return self._factory().list(path, options)
+
+    def remove(self, paths: list) -> list:
+        return self._factory().remove(paths)
+
+    def create_signed_url(self, path: str, expires_in: int) -> dict:
+        return self._factory().create_signed_url(path, expires_in)
+
+    def create_signed_urls(self, paths: list, expires_in: int) -> list:
+        return self._factory().create_signed_urls(paths, expires_in)
+
+
+class LocalBackend:
+    """Bucket Storage simulé sur le disque : <root>/<remote_path>."""
+
+    def __init__(self, root: str, bucket: str = "local"):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.bucket = bucket
+
+    def _p(self, remote_path: str) -> Path:
+        p = (self.root / remote_path.strip("/")).resolve()
+        if p != self.root and self.root not in p.parents:
+            raise ValueError(f"Chemin hors bucket: {remote_path}")
+        return p
+
+    def upload(self, path: str, file, file_options: dict | None = None):
+        dest = self._p(path)
+        upsert = str((file_options or {}).get("x-upsert", "false")).lower() == "true"
+        if dest.exists() and not upsert:
+            raise RuntimeError(f"The resource already exists: {path}")
+        data = _read_upload(file)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)
+        return {"Key": f"{self.bucket}/{path}"}
+
+    def download(self, path: str) -> bytes:
+        p = self._p(path)
+        if not p.is_file():
+            raise FileNotFoundError(f"Object not found: {path}")
+        return p.read_bytes()
+
+    def list(self, path: str | None = None, options: dict | None = None) -> list:
+        opts = options or {}
+        limit, offset = int(opts.get("limit", 100)), int(opts.get("offset", 0))
+        d = self._p(path or "")
+        if not d.is_dir():
+            return []
+        out = []
+        for child in sorted(d.iterdir(), key=lambda c: c.name):
+            if child.name.startswith("."):
+                continue
+            if child.is_dir():
+                out.append(_listing_entry(child.name))
+            else:
+                st_ = child.stat()
+                out.append(_listing_entry(child.name, st_.st_size, st_.st_mtime))
+        return out[offset:offset + limit]
+
+    def remove(self, paths: list) -> list:
+        removed = []
+        for rp in paths:
+            p = self._p(rp)
+            if p.is_file():
+                p.unlink()
+                removed.append({"name": rp})
+        return removed
+
+    def create_signed_url(self, path: str, expires_in: int) -> dict:
+        url = f"{self._p(path).as_uri()}?expires={int(time.time()) + int(expires_in)}"
+        return {"signedURL": url, "signed_url": url}
+
+    def create_signed_urls(self, paths: list, expires_in: int) -> list:
+        return [{"path": p, "error": None, **self.create_signed_url(p, expires_in)} for p in paths]
+
+
+class MemoryBackend:
+    """Bucket en mémoire : {remote_path: (bytes, mtime)}. Dossiers déduits des chemins."""
+
+    def __init__(self, bucket: str = "memory"):
+        self.bucket = bucket
+        self._objects: dict[str, tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        key = (path or "").strip("/")
+        if not key or ".." in key.split("/"):
+            raise ValueError(f"Chemin hors bucket: {path}")
+        return key
+
+    def upload(self, path: str, file, file_options: dict | None = None):
+        key = self._key(path)
+        upsert = str((file_options or {}).get("x-upsert", "false")).lower() == "true"
+        data = _read_upload(file)
+        with self._lock:
+            if key in self._objects and not upsert:
+                raise RuntimeError(f"The resource already exists: {path}")
+            self._objects[key] = (data, time.time())
+        return {"Key": f"{self.bucket}/{path}"}
+
+    def download(self, path: str) -> bytes:
+        with self._lock:
+            obj = self._objects.get(self._key(path))
+        if obj is None:
+            raise FileNotFoundError(f"Object not found: {path}")
+        return obj[0]
+
+    def list(self, path: str | None = None, options: dict | None = None) -> list:
+        opts = options or {}
+        limit, offset = int(opts.get("limit", 100)), int(opts.get("offset", 0))
+        prefix = (path or "").strip("/")
+        prefix = f"{prefix}/" if prefix else ""
+        files, folders = {}, set()
+        with self._lock:
+            items = list(self._objects.items())
+        for key, (data, mtime) in items:
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            head, sep, _ = rest.partition("/")
+            if sep:
+                folders.add(head)
+            else:
+                files[head] = (len(data), mtime)
+        out = [_listing_entry(n) if n in folders else _listing_entry(n, *files[n])
+               for n in sorted(folders | set(files))]
+        return out[offset:offset + limit]
+
+    def remove(self, paths: list) -> list:
+        removed = []
+        with self._lock:
+            for rp in paths:
+                if self._objects.pop(self._key(rp), None) is not None:
+                    removed.append({"name": rp})
+        return removed
+
+    def create_signed_url(self, path: str, expires_in: int) -> dict:
+        url = f"memory://{self.bucket}/{self._key(path)}?expires={int(time.time()) + int(expires_in)}"
+        return {"signedURL": url, "signed_url": url}
+
+    def create_signed_urls(self, paths: list, expires_in: int) -> list:
+        return [{"path": p, "error": None, **self.create_signed_url(p, expires_in)} for p in paths]
+
+
+# --------------------------------------------------------------------
+# Cache disque LRU (read-through / write-through)
+# --------------------------------------------------------------------
+class DiskLRUCache:
+    """
+    Copies locales d'objets distants, bornées à `max_bytes` (éviction LRU).
+    Un objet est stocké sous <root>/<sha1(remote_path)> ; l'ordre LRU suit les mtimes
+    (dernier accès connu). Le dossier est partagé par l'app et le worker : put() compte
+    les octets localement et ne relit le disque (os.scandir) que si le budget semble
+    dépassé ou toutes les `rescan_secs` secondes ; une copie écrite par l'autre
+    processus est reprise à la lecture.
+    """
+
+    def __init__(self, root: str, max_bytes: int, ttl_secs: float = STORAGE_CACHE_TTL_SECS,
+                 rescan_secs: float = STORAGE_CACHE_RESCAN_SECS):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_secs = max(0.0, float(ttl_secs))
+        self.rescan_secs = max(0.0, float(rescan_secs))
+        self._refreshed_at = 0.0
+        # un objet plus gros qu'un quart du budget viderait le cache : jamais mis en cache
+        self.max_object_bytes = self.max_bytes // 4
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, list] = OrderedDict()   # name -> [size, stored_at]
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self._scan()
+
+    def _name(self, remote_path: str) -> str:
+        return hashlib.sha1(remote_path.strip("/").encode("utf-8")).hexdigest()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _scan(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            for entry in os.scandir(self.root):
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)   # écriture interrompue
+        except OSError:
+            pass
+        with self._lock:
+            self._refresh()
+            self._evict()
+
+    def _refresh(self):
+        """À appeler sous self._lock : entrées et octets relus dans le dossier (ordre des mtimes)."""
+        found = []
+        try:
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stt = entry.stat()
+                    found.append((stt.st_mtime, entry.name, stt.st_size))
+        except OSError:
+            return
+        known = self._entries
+        self._entries = OrderedDict(
+            (name, [size, known[name][1] if name in known else mtime]) for mtime, name, size in sorted(found))
+        self.total_bytes = sum(size for _, _, size in found)
+        self._refreshed_at = time.monotonic()
+
+    def _drop(self, name: str):
+        """À appeler sous self._lock."""
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.total_bytes -= entry[0]
+            try:
+                os.remove(self._file(name))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """À appeler sous self._lock."""
+        while self.total_bytes > self.max_bytes and self._entries:
+            name = next(iter(self._entries))
+            self._drop(name)
+            self.stats["evictions"] += 1
+
+    def _adopt(self, name: str):
+        """À appeler sous self._lock : copie déposée par un autre processus, ou None."""
+        try:
+            stt = os.stat(self._file(name))
+        except OSError:
+            return None
+        entry = self._entries[name] = [stt.st_size, stt.st_mtime]
+        self.total_bytes += stt.st_size
+        return entry
+
+    def get(self, remote_path: str) -> bytes | None:
+        name = self._name(remote_path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._adopt(name)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if self.ttl_secs and time.time() - entry[1] > self.ttl_secs:
+                self._drop(name)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with open(self._file(name), "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self._drop(name)
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        try:
+            now = time.time()
+            os.utime(self._file(name), (now, now))   # ordre LRU conservé au redémarrage
+        except OSError:
+            pass
+        return data
+
+    def put(self, remote_path: str, data: bytes):
+        name = self._name(remote_path)
+        if len(data) > self.max_object_bytes:
+            self.discard(remote_path)
+            return
+        tmp = f"{self._file(name)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(name))
+        except OSError as e:
+            print(f"[storage] cache : écriture impossible ({e})")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self.total_bytes -= old[0]
+            self._entries[name] = [len(data), time.time()]
+            self.total_bytes += len(data)
+            if (self.total_bytes > self.max_bytes
+                    or time.monotonic() - self._refreshed_at >= self.rescan_secs):
+                self._refresh()   # copies des autres processus comprises
+                if name in self._entries:   # sinon déjà évincé par l'autre processus
+                    self._entries.move_to_end(name)
+            self.stats["stores"] += 1
+            self._evict()
+
+    def discard(self, remote_path: str):
+        with self._lock:
+            self._drop(self._name(remote_path))
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+
+
+class CachedBucket:
+    """Backend précédé d'un DiskLRUCache ; list() et URLs signées passent directement."""
+
+    def __init__(self, backend, cache: DiskLRUCache, skip_prefixes=STORAGE_CACHE_SKIP):
+        self.backend = backend
+        self.cache = cache
+        self.skip_prefixes = tuple(skip_prefixes)
+
+    def _cacheable(self, path: str) -> bool:
+        return not path.strip("/").startswith(self.skip_prefixes)
+
+    def upload(self, path: str, file, file_options: dict | None = None):
+        if not self._cacheable(path):
+            return self.backend.upload(path, file, file_options)
+        data = _read_upload(file)
+        try:
+            resp = self.backend.upload(path, data, file_options)
+        except Exception:
+            self.cache.discard(path)
+            raise
+        self.cache.put(path, data)
+        return resp
+
+    def download(self, path: str) -> bytes:
+        if not self._cacheable(path):
+            return self.backend.download(path)
+        data = self.cache.get(path)
+        if data is None:
+            data = self.backend.download(path)
+            self.cache.put(path, data)
+        return data
+
+    def cached(self, path: str) -> bytes | None:
+        """Copie locale seule (None si absente) : pour les chemins qui contournent download()."""
+        return self.cache.get(path) if self._cacheable(path) else None
+
+    def remember(self, path: str, data: bytes):
+        """Write-through d'un envoi fait hors de upload() (client asynchrone)."""
+        if self._cacheable(path):
+            self.cache.put(path, data)
+
+    def list(self, path: str | None = None, options: dict | None = None) -> list:
+        return self.backend.list(path, options)
+
+    def remove(self, paths: list) -> list:
+        try:
+            return self.backend.remove(paths)
+        finally:
+            for p in paths:
+                self.cache.discard(p)
+
+    def create_signed_url(self, path: str, expires_in: int) -> dict:
+        return self.backend.create_signed_url(path, expires_in)
+
+    def create_signed_urls(self, paths: list, expires_in: int) -> list:
+        return self.backend.create_signed_urls(paths, expires_in)
+
+
+# --------------------------------------------------------------------
+# Construction
+# --------------------------------------------------------------------
+def open_bucket(kind: str = "", *, remote_factory=None, local_dir: str = "", bucket: str = "smartedittrack",
+                cache_dir: str = STORAGE_CACHE_DIR, cache_max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+    """
+    Construit le bucket selon `kind` (supabase | local | memory ; vide => STORAGE_BACKEND,
+    sinon local si `local_dir`, sinon supabase), avec le cache disque si cache_max_bytes > 0.
+    Le backend local n'est pas mis en cache (il est déjà sur le disque).
+    """
+    kind = (kind or STORAGE_BACKEND or ("local" if local_dir else "supabase")).lower()
+    if kind == "local":
+        return LocalBackend(local_dir or os.path.join(DATA_DIR, ".storage_local"), bucket)
+    if kind == "memory":
+        backend = MemoryBackend(bucket)
+    elif kind == "supabase":
+        if remote_factory is None:
+            raise ValueError("remote_factory requis pour le backend supabase")
+        backend = SupabaseBackend(remote_factory)
+    else:
+        raise ValueError(f"STORAGE_BACKEND inconnu : {kind}")
+    if cache_max_bytes <= 0:
+        return backend
+    return CachedBucket(backend, DiskLRUCache(cache_dir, cache_max_bytes))
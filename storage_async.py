@@ -0,0 +1,270 @@
+# storage_async.py — client Storage asyncio (httpx) pour les opérations en masse
+# -----------------------------------------------------------------------------
+# Le client supabase synchrone fait une requête HTTP bloquante à la fois. Ici :
+#   - AsyncStorageClient : API REST Storage (upload, download, list, remove,
+#     URLs signées) sur un httpx.AsyncClient (pool de connexions, keep-alive) ;
+#   - gather_bounded() : exécute des coroutines avec une concurrence bornée ;
+#   - aretry() : retries avec backoff exponentiel (erreurs réseau, 429 et 5xx seulement) ;
+#   - run_sync() / iter_sync() : wrappers synchrones pour Streamlit. Les coroutines
+#     tournent sur une boucle asyncio dédiée (thread de fond) : le pool de connexions
+#     survit d'un appel à l'autre, et les résultats reviennent dans le thread appelant
+#     (st.progress ne peut être appelé que depuis le thread du script) ;
+#   - LocalStorageTransport : stand-in HTTP local (transport httpx) qui sert les mêmes
+#     routes à partir d'un bucket storage.py (LocalBackend, MemoryBackend) : tests hors-ligne.
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+
+import os
+import json
+import queue
+import asyncio
+import threading
+from urllib.parse import quote, unquote
+
+import httpx
+
+ASYNC_MAX_CONNECTIONS = 16
+
+
+class StorageError(Exception):
+    """Réponse d'erreur de l'API Storage (status HTTP + message)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+def _raise_for(resp: httpx.Response):
+    if resp.status_code < 400:
+        return
+    try:
+        body = resp.json()
+        message = body.get("message") or body.get("error") or resp.text
+    except Exception:
+        message = resp.text
+    raise StorageError(resp.status_code, message)
+
+
+class AsyncStorageClient:
+    """Client REST Storage d'un bucket. À utiliser depuis une seule boucle asyncio."""
+
+    def __init__(self, url: str, key: str, bucket: str, *, max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 transport: httpx.AsyncBaseTransport | None = None, timeout: float = 60.0):
+        self.bucket = bucket
+        self.base_url = f"{url.rstrip('/')}/storage/v1"
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections, keepalive_expiry=30),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            transport=transport,
+        )
+
+    def _object(self, path: str) -> str:
+        return f"/object/{self.bucket}/{quote(path.strip('/'), safe='/')}"
+
+    async def upload(self, path: str, data: bytes, content_type: str = "application/octet-stream",
+                     upsert: bool = True) -> dict:
+        name = path.rsplit("/", 1)[-1]
+        resp = await self._http.post(
+            self._object(path),
+            files={"file": (name, data, content_type)},
+            headers={"x-upsert": "true" if upsert else "false", "cache-control": "max-age=3600"},
+        )
+        _raise_for(resp)
+        return resp.json()
+
+    async def download(self, path: str) -> bytes:
+        resp = await self._http.get(self._object(path))
+        _raise_for(resp)
+        return resp.content
+
+    async def list(self, path: str | None = None, options: dict | None = None) -> list:
+        body = {"limit": 100, "offset": 0, "sortBy": {"column": "name", "order": "asc"},
+                **(options or {}), "prefix": path or ""}
+        resp = await self._http.post(f"/object/list/{self.bucket}", json=body)
+        _raise_for(resp)
+        return resp.json()
+
+    async def remove(self, paths: list) -> list:
+        resp = await self._http.request("DELETE", f"/object/{self.bucket}", json={"prefixes": list(paths)})
+        _raise_for(resp)
+        return resp.json()
+
+    async def create_signed_urls(self, paths: list, expires_in: int) -> list:
+        resp = await self._http.post(f"/object/sign/{self.bucket}",
+                                     json={"paths": list(paths), "expiresIn": str(int(expires_in))})
+        _raise_for(resp)
+        items = resp.json()
+        for item in items:
+            url = item.get("signedURL") or ""
+            if url.startswith("/"):
+                item["signedURL"] = f"{self.base_url}{url}"
+        return items
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+# --------------------------------------------------------------------
+# Concurrence bornée / retries
+# --------------------------------------------------------------------
+def _retryable(exc: Exception) -> bool:
+    """Erreur transitoire : transport (connexion, timeout), 429 ou 5xx. Un 4xx ne changera pas."""
+    if isinstance(exc, StorageError):
+        status = exc.status
+    elif isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+    else:
+        return isinstance(exc, (httpx.TransportError, OSError))
+    return status == 429 or status >= 500
+
+
+async def aretry(factory, retries: int = 2, base_delay: float = 0.5):
+    """Attend factory() (coroutine neuve à chaque essai). Retourne (résultat, nb de tentatives)."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await factory(), attempt
+        except Exception as e:
+            if attempt > retries or not _retryable(e):
+                raise
+            await asyncio.sleep(base_delay * (2 ** (attempt - 1)))
+
+
+async def gather_bounded(factories, limit: int = ASYNC_MAX_CONNECTIONS, on_done=None) -> list:
+    """
+    Exécute factories[i]() (coroutines créées à la demande) avec au plus `limit` en vol.
+    Retourne les résultats dans l'ordre ; une exception est retournée, jamais levée.
+    on_done(i, résultat) est appelé à chaque fin de tâche (sur la boucle).
+    """
+    sem = asyncio.Semaphore(max(1, int(limit)))
+
+    async def _one(i, factory):
+        async with sem:
+            try:
+                res = await factory()
+            except Exception as e:
+                res = e
+        if on_done:
+            on_done(i, res)
+        return res
+
+    return await asyncio.gather(*(_one(i, f) for i, f in enumerate(factories)))
+
+
+# --------------------------------------------------------------------
+# Wrappers synchrones (boucle dédiée dans un thread de fond)
+# --------------------------------------------------------------------
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # un enfant (ProcessPoolExecutor en fork) hérite de _loop mais pas du thread
+    # "storage-aio" qui la faisait tourner : run_sync() y attendrait indéfiniment
+    global _loop, _loop_lock
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _runner() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="storage-aio", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro, timeout: float | None = None):
+    """Exécute une coroutine sur la boucle de fond et attend son résultat."""
+    return asyncio.run_coroutine_threadsafe(coro, _runner()).result(timeout)
+
+
+def iter_sync(factories, limit: int = ASYNC_MAX_CONNECTIONS):
+    """
+    Version synchrone de gather_bounded : produit (i, résultat|exception) au fil de l'eau,
+    dans le thread appelant (équivalent de as_completed).
+    """
+    factories = list(factories)
+    if not factories:
+        return
+    done: queue.Queue = queue.Queue()
+    fut = asyncio.run_coroutine_threadsafe(
+        gather_bounded(factories, limit, on_done=lambda i, res: done.put((i, res))), _runner())
+    for _ in range(len(factories)):
+        yield done.get()
+    fut.result()
+
+
+# --------------------------------------------------------------------
+# Stand-in HTTP local
+# --------------------------------------------------------------------
+def _multipart_file(request: httpx.Request) -> bytes:
+    """Contenu du premier champ d'un corps multipart/form-data (tel qu'écrit par httpx)."""
+    ctype = request.headers.get("content-type", "")
+    if "boundary=" not in ctype:
+        return request.content
+    boundary = ctype.split("boundary=", 1)[1].split(";")[0].strip().strip('"').encode()
+    for part in request.content.split(b"--" + boundary):
+        head, sep, body = part.partition(b"\r\n\r\n")
+        if sep and b"filename=" in head:
+            return body[:-2] if body.endswith(b"\r\n") else body
+    return b""
+
+
+class LocalStorageTransport(httpx.AsyncBaseTransport):
+    """Sert les routes REST Storage utilisées par AsyncStorageClient à partir d'un bucket storage.py."""
+
+    def __init__(self, bucket, bucket_name: str):
+        self.store = bucket
+        self.bucket_name = bucket_name
+
+    @staticmethod
+    def _json(status: int, payload) -> httpx.Response:
+        return httpx.Response(status, content=json.dumps(payload).encode(),
+                              headers={"content-type": "application/json"})
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        path = unquote(request.url.path)
+        path = path.split("/storage/v1", 1)[-1]
+        obj = f"/object/{self.bucket_name}"
+        call = asyncio.to_thread
+        try:
+            if request.method == "POST" and path == f"/object/list/{self.bucket_name}":
+                body = json.loads(request.content or b"{}")
+                prefix = body.pop("prefix", "")
+                return self._json(200, await call(self.store.list, prefix, body))
+            if request.method == "POST" and path == f"/object/sign/{self.bucket_name}":
+                body = json.loads(request.content or b"{}")
+                items = await call(self.store.create_signed_urls, body.get("paths") or [], int(body.get("expiresIn", 60)))
+                return self._json(200, items)
+            if request.method == "DELETE" and path == obj:
+                body = json.loads(request.content or b"{}")
+                return self._json(200, await call(self.store.remove, body.get("prefixes") or []))
+            if path.startswith(obj + "/"):
+                remote = path[len(obj) + 1:]
+                if request.method == "GET":
+                    data = await call(self.store.download, remote)
+                    return httpx.Response(200, content=data)
+                if request.method == "POST":
+                    opts = {"content-type": request.headers.get("content-type", ""),
+                            "x-upsert": request.headers.get("x-upsert", "false")}
+                    return self._json(200, await call(self.store.upload, remote, _multipart_file(request), opts))
+        except FileNotFoundError as e:
+            return self._json(404, {"statusCode": "404", "error": "not_found", "message": str(e)})
+        except RuntimeError as e:
+            return self._json(409, {"statusCode": "409", "error": "Duplicate", "message": str(e)})
+        except ValueError as e:
+            return self._json(400, {"statusCode": "400", "error": "invalid", "message": str(e)})
+        return self._json(404, {"statusCode": "404", "error": "route", "message": f"{request.method} {path}"})
@@ -4,17 +4,43 @@
 # - get_client() : client unique (service role)
 # - upload_file() / upload_bytes() : envoi (upsert)
 # - download_to_file() : téléchargement
-# - signed_url() : URL signée
-# - delete_prefix() : suppression récursive d'un "dossier" (prefix)
+# - signed_url() / signed_urls() : URL(s) signée(s), en lot et mises en cache
+# - delete_prefix() / delete_prefix_report() : suppression récursive d'un "dossier"
+#   (listing paginé exploré en parallèle, suppression par lots avec retries)
 # - list_prefix() / exists() : utilitaires légers
+# - upload_many() : envoi en lot (client asyncio, retries, manifeste de hashs)
+# - iter_upload() / upload_batch() / iter_download() / download_many() : transferts en
+#   masse sur le client asyncio (storage_async.py : pool keep-alive, concurrence bornée),
+#   avec wrappers synchrones utilisables depuis Streamlit
+# - fetch_remote_manifest() : inventaire distant {remote_path: {"sha256", "size"}}
+#   (tenu à jour par upload_many / publish_manifest / delete_prefix, lu par restore.py)
+#
+# Le bucket vient de storage.py (backends supabase | local | memory, cache disque LRU
+# en lecture/écriture). SUPABASE_LOCAL_DIR=<dossier> remplace le bucket par le
+# backend local : utile pour tester hors-ligne sans projet Supabase.
 
 from __future__ import annotations
 
 import os
+import json
+import asyncio
+import time
+import hashlib
 import mimetypes
+import threading
+from contextlib import contextmanager
 from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from supabase import create_client, Client
 
+import storage
+from storage_async import AsyncStorageClient, LocalStorageTransport, aretry, iter_sync
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrou limité au processus
+    fcntl = None
+
 # --------------------------------------------------------------------
 # Configuration depuis les variables d'environnement
 # --------------------------------------------------------------------
@@ -25,8 +51,40 @@ _SUPABASE_KEY = (
     or os.environ.get("SUPABASE_ANON_KEY", "")
 )
 _BUCKET = os.environ.get("SUPABASE_BUCKET", "smartedittrack")
+_LOCAL_DIR = os.environ.get("SUPABASE_LOCAL_DIR", "").strip()
+
+# Manifeste local des envois en lot : {remote_path: {"sha256", "size"}}
+_MANIFEST_PATH = os.environ.get(
+    "SUPABASE_UPLOAD_MANIFEST",
+    os.path.join(os.environ.get("DATA_DIR", "."), f".supa_manifest_{_BUCKET}.json"),
+)
+# Manifeste distant (dans le bucket) : sert à la restauration de DATA_DIR
+_REMOTE_MANIFEST = os.environ.get("SUPABASE_REMOTE_MANIFEST", "manifests/data_dir.json")
+_UPLOAD_WORKERS = int(os.environ.get("SUPABASE_UPLOAD_WORKERS", "8"))
+_UPLOAD_RETRIES = int(os.environ.get("SUPABASE_UPLOAD_RETRIES", "3"))
+
+_ASYNC_CONCURRENCY = int(os.environ.get("SUPABASE_ASYNC_CONCURRENCY", "16"))
 
 _client: Client | None = None
+_store = None
+_aio = None
+_store_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # enfant d'un fork (pool de processus du worker) : le client asyncio est lié à la
+    # boucle du parent (storage_async la recrée), les clients HTTP synchrones partagent
+    # ses sockets, et un verrou pris par un autre thread au moment du fork ne serait
+    # jamais relâché : tout est reconstruit à la demande
+    global _client, _store, _aio, _store_lock, _manifest_lock, _signed_lock
+    _client = _store = _aio = None
+    _store_lock = threading.Lock()
+    _manifest_lock = threading.Lock()
+    _signed_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def get_client() -> Client:
@@ -39,6 +97,50 @@ def get_client() -> Client:
     return _client
 
 
+def _bucket():
+    """Bucket Storage courant (storage.open_bucket) : backend choisi par STORAGE_BACKEND,
+    précédé du cache disque LRU ; à défaut, SUPABASE_LOCAL_DIR sélectionne le backend local."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = storage.open_bucket(
+                    remote_factory=lambda: get_client().storage.from_(_BUCKET),
+                    local_dir=_LOCAL_DIR,
+                    bucket=_BUCKET,
+                )
+    return _store
+
+
+def cache_stats() -> dict | None:
+    """Compteurs du cache disque (hits, misses, évictions, octets), None si pas de cache."""
+    cache = getattr(_store, "cache", None)
+    if cache is None:
+        return None
+    return {**cache.stats, "bytes": cache.total_bytes, "max_bytes": cache.max_bytes}
+
+
+def async_client() -> AsyncStorageClient:
+    """Client Storage asyncio du processus (pool keep-alive). Hors Supabase, il passe par
+    le stand-in HTTP local (LocalStorageTransport) branché sur le backend courant."""
+    global _aio
+    store = _bucket()
+    if _aio is None:
+        with _store_lock:
+            if _aio is None:
+                backend = getattr(store, "backend", store)
+                if isinstance(backend, storage.SupabaseBackend):
+                    if not _SUPABASE_URL or not _SUPABASE_KEY:
+                        raise RuntimeError("Supabase credentials missing (URL / KEY).")
+                    _aio = AsyncStorageClient(_SUPABASE_URL, _SUPABASE_KEY, _BUCKET,
+                                              max_connections=_ASYNC_CONCURRENCY)
+                else:
+                    _aio = AsyncStorageClient("http://storage.local", "local", _BUCKET,
+                                              max_connections=_ASYNC_CONCURRENCY,
+                                              transport=LocalStorageTransport(backend, _BUCKET))
+    return _aio
+
+
 # --------------------------------------------------------------------
 # Upload / Download
 # --------------------------------------------------------------------
@@ -49,7 +151,7 @@ def upload_file(local_path: str, remote_path: str, content_type: str | None = No
     """
     ct = content_type or mimetypes.guess_type(local_path)[0] or "application/octet-stream"
     with open(local_path, "rb") as f:
-        get_client().storage.from_(_BUCKET).upload(
+        _bucket().upload(
             remote_path,
             f,
             {
@@ -57,12 +159,13 @@ def upload_file(local_path: str, remote_path: str, content_type: str | None = No
                 "x-upsert": "true",  # <= OBLIGATOIRE en string
             },
         )
+    _invalidate_listing(remote_path)
     return remote_path
 
 
 def upload_bytes(data: bytes, remote_path: str, content_type: str = "application/octet-stream") -> str:
     """Envoie un contenu mémoire vers Storage (upsert)."""
-    get_client().storage.from_(_BUCKET).upload(
+    _bucket().upload(
         remote_path,
         data,
         {
@@ -70,13 +173,19 @@ def upload_bytes(data: bytes, remote_path: str, content_type: str = "application
             "x-upsert": "true",
         },
     )
+    _invalidate_listing(remote_path)
     return remote_path
 
 
+def download_bytes(remote_path: str) -> bytes:
+    """Contenu d'un objet Storage (lève si absent / erreur réseau)."""
+    return _bucket().download(remote_path)
+
+
 def download_to_file(remote_path: str, local_path: str) -> bool:
     """Télécharge un objet Storage vers un chemin local."""
     try:
-        data = get_client().storage.from_(_BUCKET).download(remote_path)
+        data = _bucket().download(remote_path)
         os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
         with open(local_path, "wb") as f:
             f.write(data)
@@ -85,50 +194,461 @@ def download_to_file(remote_path: str, local_path: str) -> bool:
         return False
 
 
+# --------------------------------------------------------------------
+# Transferts en masse (client asyncio, concurrence bornée)
+# --------------------------------------------------------------------
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_upload(items, *, concurrency: int | None = None, retries: int | None = None):
+    """
+    Envoie plusieurs fichiers (upsert) via le client asyncio ; produit, au fil de l'eau et
+    dans le thread appelant, un résultat par fichier :
+      {"local", "remote", "status": "uploaded"|"error", "attempts", "error"}
+    - items : itérable de (local_path, remote_path) ou (local_path, remote_path, content_type)
+    """
+    items = [(it[0], it[1], it[2] if len(it) > 2 else None) for it in items]
+    if not items:
+        return
+    client = async_client()
+    store = _bucket()
+    retries = _UPLOAD_RETRIES if retries is None else max(0, int(retries))
+
+    def _task(local, remote, ct):
+        async def _run():
+            data = await asyncio.to_thread(_read_file, local)
+            ctype = ct or mimetypes.guess_type(local)[0] or "application/octet-stream"
+            _, attempts = await aretry(lambda: client.upload(remote, data, ctype), retries)
+            if hasattr(store, "remember"):
+                store.remember(remote, data)
+            return attempts
+        return _run
+
+    for i, res in iter_sync([_task(*it) for it in items], concurrency or _ASYNC_CONCURRENCY):
+        local, remote, _ = items[i]
+        _invalidate_listing(remote)
+        if isinstance(res, Exception):
+            # OSError : lecture locale impossible, aucun envoi tenté
+            yield {"local": local, "remote": remote, "status": "error",
+                   "attempts": 0 if isinstance(res, OSError) else retries + 1, "error": str(res)}
+        else:
+            yield {"local": local, "remote": remote, "status": "uploaded", "attempts": res, "error": ""}
+
+
+def upload_batch(items, *, concurrency: int | None = None, retries: int | None = None,
+                 progress_callback=None) -> list[dict]:
+    """iter_upload() sans manifeste : liste des résultats, progress_callback(done, total, result)."""
+    items = list(items)
+    results = []
+    for res in iter_upload(items, concurrency=concurrency, retries=retries):
+        results.append(res)
+        if progress_callback:
+            progress_callback(len(results), len(items), res)
+    return results
+
+
+def iter_download(remote_paths, *, concurrency: int | None = None, retries: int | None = None):
+    """
+    Télécharge plusieurs objets via le client asyncio ; produit (remote_path, bytes | Exception)
+    au fil de l'eau. Les copies du cache disque sont servies sans appel réseau.
+    """
+    store = _bucket()
+    retries = _UPLOAD_RETRIES if retries is None else max(0, int(retries))
+    missing = []
+    for rp in dict.fromkeys(remote_paths):
+        data = store.cached(rp) if hasattr(store, "cached") else None
+        if data is None:
+            missing.append(rp)
+        else:
+            yield rp, data
+    if not missing:
+        return
+    client = async_client()
+
+    def _task(rp):
+        async def _run():
+            data, _ = await aretry(lambda: client.download(rp), retries)
+            if hasattr(store, "remember"):
+                store.remember(rp, data)
+            return data
+        return _run
+
+    for i, res in iter_sync([_task(rp) for rp in missing], concurrency or _ASYNC_CONCURRENCY):
+        yield missing[i], res
+
+
+def download_many(remote_paths, **kw) -> dict:
+    """{remote_path: bytes | Exception} pour plusieurs objets (voir iter_download)."""
+    return dict(iter_download(remote_paths, **kw))
+
+
+# --------------------------------------------------------------------
+# URLs signées : en lot (1 appel) + cache (path, expiration)
+# --------------------------------------------------------------------
+# Une URL en cache est réutilisée tant qu'il lui reste au moins la moitié de sa durée.
+_signed_cache: dict = {}    # (remote_path, expires_in) -> (url, valid_until)
+_signed_lock = threading.Lock()
+
+
+def _signed_key(resp: dict) -> str:
+    # suivant la version, la clé peut s'appeler signed_url, signedURL ou signedUrl
+    return resp.get("signed_url") or resp.get("signedURL") or resp.get("signedUrl") or ""
+
+
+def signed_urls(remote_paths: List[str], expires_in: int = 7 * 24 * 3600) -> dict:
+    """URLs signées de plusieurs objets : {remote_path: url} ("" si erreur), un seul appel pour les manquantes."""
+    now = time.time()
+    out, missing = {}, []
+    with _signed_lock:
+        for rp in dict.fromkeys(remote_paths):
+            hit = _signed_cache.get((rp, expires_in))
+            if hit and hit[1] - now >= expires_in / 2:
+                out[rp] = hit[0]
+            else:
+                missing.append(rp)
+    if missing:
+        resp = _bucket().create_signed_urls(missing, expires_in) or []
+        with _signed_lock:
+            for item in resp:
+                rp, url = item.get("path"), _signed_key(item)
+                if rp and url and not item.get("error"):
+                    _signed_cache[(rp, expires_in)] = (url, now + expires_in)
+                    out[rp] = url
+        for rp in missing:
+            out.setdefault(rp, "")
+    return out
+
+
 def signed_url(remote_path: str, expires_in: int = 7 * 24 * 3600) -> str:
-    """Génère une URL signée (par défaut 7 jours)."""
-    resp = get_client().storage.from_(_BUCKET).create_signed_url(remote_path, expires_in)
-    # suivant la version, la clé peut s'appeler signed_url ou signedURL
-    return resp.get("signed_url") or resp.get("signedURL") or ""
+    """Génère une URL signée (par défaut 7 jours), réutilisée depuis le cache si possible."""
+    return signed_urls([remote_path], expires_in)[remote_path]
+
+
+def _forget_signed(remote_paths: List[str]) -> None:
+    gone = set(remote_paths)
+    with _signed_lock:
+        for key in [k for k in _signed_cache if k[0] in gone]:
+            del _signed_cache[key]
 
 
 # --------------------------------------------------------------------
-# Suppression récursive d'un "dossier" (prefix)
+# Envoi en lot (client asyncio + retries + manifeste de hashs)
 # --------------------------------------------------------------------
-def _list_recursive(prefix: str) -> List[str]:
+_manifest_lock = threading.Lock()
+
+
+@contextmanager
+def _manifest_guard(path: str):
+    """
+    Lecture-modification-écriture d'un manifeste : verrou de thread + verrou fichier
+    (<path>.lock), partagé par l'app et le worker qui écrivent dans le même DATA_DIR.
+    """
+    with _manifest_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.lock", "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_manifest(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+
+def _save_manifest(path: str, manifest: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _manifest_forget(remote_paths: List[str], manifest_path: str | None = None) -> None:
+    """Retire des entrées du manifeste (objets supprimés côté Storage)."""
+    path = manifest_path or _MANIFEST_PATH
+    with _manifest_guard(path):
+        manifest = _load_manifest(path)
+        dropped = [rp for rp in remote_paths if manifest.pop(rp, None) is not None]
+        if dropped:
+            _save_manifest(path, manifest)
+
+
+def fetch_remote_manifest() -> dict | None:
+    """Manifeste distant {remote_path: {"sha256", "size"}}, ou None s'il n'existe pas (encore)."""
+    try:
+        data = json.loads(_bucket().download(_REMOTE_MANIFEST))
+    except Exception:
+        return None
+    return data.get("files") if isinstance(data, dict) else None
+
+
+def _publish_remote_manifest(updates: dict, removed: List[str] = ()) -> None:
+    """
+    Fusionne `updates` / retire `removed` dans le manifeste distant (lecture + upsert),
+    sous verrou fichier (<manifeste local>.remote.lock) ; pas d'envoi si rien ne change.
+    """
+    if not updates and not removed:
+        return
+    with _manifest_guard(f"{_MANIFEST_PATH}.remote"):
+        files = fetch_remote_manifest() or {}
+        if (all(files.get(rp) == meta for rp, meta in updates.items())
+                and not any(rp in files for rp in removed)):
+            return
+        files.update(updates)
+        for rp in removed:
+            files.pop(rp, None)
+        payload = {"version": 1, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "files": files}
+        try:
+            upload_bytes(json.dumps(payload, sort_keys=True).encode("utf-8"), _REMOTE_MANIFEST,
+                         content_type="application/json")
+        except Exception as e:
+            print("[WARN] Manifeste distant non publié:", e)
+
+
+def publish_manifest(remote_paths, manifest_path: str | None = None) -> None:
+    """
+    Publie dans le manifeste distant les entrées du manifeste local pour `remote_paths`
+    (envoyés ou inchangés) : appelé une fois en fin de lot d'envoi (upload_many(publish=False)).
+    """
+    path = manifest_path or _MANIFEST_PATH
+    with _manifest_guard(path):
+        manifest = _load_manifest(path)
+    _publish_remote_manifest({rp: manifest[rp] for rp in dict.fromkeys(remote_paths) if rp in manifest})
+
+
+def upload_many(items, *, workers: int | None = None, retries: int | None = None,
+                skip_unchanged: bool = True, manifest_path: str | None = None,
+                progress_callback=None, publish: bool = True) -> list[dict]:
+    """
+    Envoie plusieurs fichiers en parallèle (iter_upload : client asyncio, concurrence bornée, upsert).
+    - items : itérable de (local_path, remote_path) ou (local_path, remote_path, content_type)
+    - skip_unchanged : saute les fichiers dont le sha256 est celui déjà envoyé
+      pour ce remote_path (manifeste local, mis à jour après chaque succès)
+    - progress_callback(done, total, result) : appelé après chaque fichier
+    - publish : met à jour le manifeste distant avec les fichiers envoyés ; False pour un
+      paquet d'un lot (publish_manifest() une seule fois, à la clôture du lot)
+    Retourne un résultat par fichier :
+      {"local", "remote", "status": "uploaded"|"skipped"|"error", "attempts", "error"}
+    """
+    workers = max(1, int(workers or _UPLOAD_WORKERS))
+    retries = _UPLOAD_RETRIES if retries is None else max(0, int(retries))
+    manifest_path = manifest_path or _MANIFEST_PATH
+
+    with _manifest_guard(manifest_path):
+        manifest = _load_manifest(manifest_path)
+
+    todo, results = [], []
+    published = {}  # entrées envoyées -> manifeste distant
+    for it in items:
+        local, remote = it[0], it[1]
+        ct = it[2] if len(it) > 2 else None
+        try:
+            digest, size = _file_sha256(local), os.path.getsize(local)
+        except OSError as e:
+            results.append({"local": local, "remote": remote, "status": "error", "attempts": 0, "error": str(e)})
+            continue
+        known = manifest.get(remote) or {}
+        if skip_unchanged and known.get("sha256") == digest:
+            results.append({"local": local, "remote": remote, "status": "skipped", "attempts": 0, "error": ""})
+        else:
+            todo.append((local, remote, ct, digest, size))
+
+    total = len(results) + len(todo)
+    if progress_callback:
+        for n, r in enumerate(results, start=1):
+            progress_callback(n, total, r)
+
+    if todo:
+        meta = {remote: {"sha256": digest, "size": size} for _, remote, _, digest, size in todo}
+        for res in iter_upload([(local, remote, ct) for local, remote, ct, _, _ in todo],
+                               concurrency=workers, retries=retries):
+            remote = res["remote"]
+            if res["status"] == "uploaded":
+                manifest[remote] = meta[remote]
+                published[remote] = manifest[remote]
+            else:
+                manifest.pop(remote, None)
+            results.append(res)
+            if progress_callback:
+                progress_callback(len(results), total, res)
+
+        # relire/fusionner pour ne pas écraser un envoi concurrent
+        with _manifest_guard(manifest_path):
+            current = _load_manifest(manifest_path)
+            for local, remote, ct, digest, size in todo:
+                if remote in manifest:
+                    current[remote] = manifest[remote]
+                else:
+                    current.pop(remote, None)
+            _save_manifest(manifest_path, current)
+
+    if publish:
+        _publish_remote_manifest(published)
+    return results
+
+
+# --------------------------------------------------------------------
+# Listing paginé / récursif et suppression par lots
+# --------------------------------------------------------------------
+_LIST_PAGE      = int(os.environ.get("SUPABASE_LIST_PAGE", "1000"))
+_LIST_WORKERS   = int(os.environ.get("SUPABASE_LIST_WORKERS", "8"))
+_DELETE_CHUNK   = int(os.environ.get("SUPABASE_DELETE_CHUNK", "100"))
+_DELETE_WORKERS = int(os.environ.get("SUPABASE_DELETE_WORKERS", "4"))
+
+
+def _retry(fn, retries: int = _UPLOAD_RETRIES):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return fn(), attempt
+        except Exception:
+            if attempt > retries:
+                raise
+            time.sleep(0.5 * (2 ** (attempt - 1)))
+
+
+# Cache des listings par "dossier" : {path: (expire_at, entries)}.
+# Invalidé par nos propres upload_* / suppressions ; TTL pour les changements faits ailleurs.
+_LIST_CACHE_TTL = float(os.environ.get("SUPABASE_LIST_CACHE_TTL", "60"))
+_list_cache: dict = {}
+_list_lock = threading.Lock()
+
+
+def _invalidate_listing(remote_path: str) -> None:
+    """Oublie le listing des dossiers parents de `remote_path` (un nouvel objet peut y créer des sous-dossiers)."""
+    parts = remote_path.strip("/").split("/")[:-1]
+    with _list_lock:
+        for i in range(len(parts) + 1):
+            _list_cache.pop("/".join(parts[:i]), None)
+
+
+def _is_folder(it: dict) -> bool:
+    # Heuristique : si 'id' est None et pas de 'metadata', c'est un "dossier"
+    return (it.get("id") is None) and (not it.get("metadata"))
+
+
+def _list_dir(path: str, use_cache: bool = True) -> list:
+    """
+    Toutes les entrées (fichiers + "dossiers") d'un niveau, page par page (limit/offset).
+    use_cache : listing réutilisé pendant SUPABASE_LIST_CACHE_TTL secondes.
+    """
+    path = path.strip("/")
+    if use_cache and _LIST_CACHE_TTL > 0:
+        with _list_lock:
+            hit = _list_cache.get(path)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+    entries = _list_dir_uncached(path)
+    if _LIST_CACHE_TTL > 0:
+        with _list_lock:
+            _list_cache[path] = (time.monotonic() + _LIST_CACHE_TTL, entries)
+    return entries
+
+
+def _list_dir_uncached(path: str) -> list:
+    store = _bucket()
+    out, offset = [], 0
+    while True:
+        opts = {"limit": _LIST_PAGE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+        page, _ = _retry(lambda: store.list(path, opts) or [])
+        out.extend(page)
+        if len(page) < _LIST_PAGE:
+            return out
+        offset += len(page)
+
+
+def _list_recursive(prefix: str, workers: int | None = None) -> List[str]:
     """
     Liste *récursivement* tous les objets (fichiers) sous `prefix/`.
+    Les "dossiers" sont explorés en parallèle (pool borné), chaque niveau est paginé.
     Retourne des chemins relatifs au bucket.
     """
-    store = get_client().storage.from_(_BUCKET)
-
     # normaliser le préfixe
     p = prefix.lstrip("/")
     if p and not p.endswith("/"):
         p += "/"
 
     files: List[str] = []
-    stack: List[str] = [p]  # chemins "dossiers" à parcourir
-
-    while stack:
-        path = stack.pop()
-        # list() retourne à la fois fichiers et "dossiers"
-        items = store.list(path=path, limit=1000) or []
-        for it in items:
-            name = it.get("name") or ""
-            full = f"{path}{name}" if path.endswith("/") else f"{path}/{name}"
-
-            # Heuristique : si 'id' est None et pas de 'metadata', c'est un "dossier"
-            is_folder = (it.get("id") is None) and (not it.get("metadata"))
-            if is_folder:
-                if not full.endswith("/"):
-                    full += "/"
-                stack.append(full)
-            else:
-                # C'est un fichier
-                files.append(full)
+    with ThreadPoolExecutor(max_workers=max(1, int(workers or _LIST_WORKERS))) as pool:
+        # sans cache : une suppression doit voir l'état réel du bucket
+        pending = {pool.submit(_list_dir, p.rstrip("/"), False): p}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                path = pending.pop(fut)
+                for it in fut.result():
+                    name = it.get("name") or ""
+                    full = f"{path}{name}"
+                    if _is_folder(it):
+                        pending[pool.submit(_list_dir, full, False)] = full + "/"
+                    else:
+                        files.append(full)
+    return sorted(files)
+
+
+def delete_many(paths: List[str], *, chunk_size: int | None = None, workers: int | None = None,
+                retries: int | None = None) -> list[dict]:
+    """
+    Supprime `paths` par lots de `chunk_size` (en parallèle, avec retries).
+    Retourne un résultat par lot : {"paths": [...], "status": "ok"|"error", "attempts", "error"}.
+    """
+    paths = list(paths)
+    if not paths:
+        return []
+    size = max(1, int(chunk_size or _DELETE_CHUNK))
+    retries = _UPLOAD_RETRIES if retries is None else max(0, int(retries))
+    chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+    store = _bucket()
+
+    def _one(chunk):
+        try:
+            _, attempts = _retry(lambda: store.remove(chunk), retries)
+            return {"paths": chunk, "status": "ok", "attempts": attempts, "error": ""}
+        except Exception as e:
+            return {"paths": chunk, "status": "error", "attempts": retries + 1, "error": str(e)}
 
-    return files
+    with ThreadPoolExecutor(max_workers=max(1, min(int(workers or _DELETE_WORKERS), len(chunks)))) as pool:
+        results = list(pool.map(_one, chunks))
+
+    removed = [rp for r in results if r["status"] == "ok" for rp in r["paths"]]
+    for rp in paths:
+        _invalidate_listing(rp)
+    _forget_signed(removed)
+    _manifest_forget(removed)
+    _publish_remote_manifest({}, removed)
+    return results
+
+
+def delete_prefix_report(prefix: str) -> dict:
+    """delete_prefix détaillé : {"found", "removed", "chunks": [...], "errors": [...]}."""
+    to_remove = _list_recursive(prefix)
+    chunks = delete_many(to_remove)
+    errors = [c for c in chunks if c["status"] != "ok"]
+    return {
+        "found": len(to_remove),
+        "removed": sum(len(c["paths"]) for c in chunks if c["status"] == "ok"),
+        "chunks": chunks,
+        "errors": errors,
+    }
 
 
 def delete_prefix(prefix: str) -> bool:
@@ -136,13 +656,7 @@ def delete_prefix(prefix: str) -> bool:
     Supprime récursivement tous les objets dont le chemin commence par `prefix`.
     Exemple : delete_prefix("copies/3a61/") -> True si au moins un objet supprimé.
     """
-    store = get_client().storage.from_(_BUCKET)
-    to_remove = _list_recursive(prefix)
-    if not to_remove:
-        return False
-    # L'API accepte la suppression en lot
-    store.remove(to_remove)
-    return True
+    return delete_prefix_report(prefix)["removed"] > 0
 
 
 # --- Listing simple d’un "dossier" et test d’existence ------------------------
@@ -151,17 +665,14 @@ def list_prefix(prefix: str):
     Liste 1 niveau sous `prefix` (ex: 'copies/3a61').
     Retourne des dicts {"name": "copies/3a61/ETUD001.xlsm", "is_folder": False}.
     """
-    store = get_client().storage.from_(_BUCKET)
     p = prefix.lstrip("/")
     if p.endswith("/"):
         p = p[:-1]
-    items = store.list(path=p) or []
     out = []
-    for it in items:
+    for it in _list_dir(p):
         name = it.get("name") or ""
-        is_folder = (it.get("id") is None) and (not it.get("metadata"))
         full = f"{p}/{name}" if name else p
-        out.append({"name": full, "is_folder": is_folder})
+        out.append({"name": full, "is_folder": _is_folder(it)})
     return out
 
 
@@ -169,8 +680,7 @@ def exists(remote_path: str) -> bool:
     """Renvoie True si l’objet Storage existe (sans le télécharger)."""
     parent = os.path.dirname(remote_path).lstrip("/")
     base = os.path.basename(remote_path)
-    store = get_client().storage.from_(_BUCKET)
-    for it in store.list(path=parent) or []:
+    for it in _list_dir(parent):
         if (it.get("name") or "") == base:
             return True
     return False
@@ -0,0 +1,19 @@
+# conftest.py — environnement de test : DATA_DIR temporaire, Storage en mémoire, pas de Supabase
+# Les modules lisent leur configuration à l'import : l'environnement est posé ici, avant eux.
+import os
+import sys
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="smartedittrack-tests-")
+os.environ.update({
+    "DATA_DIR": _DATA_DIR,
+    "STORAGE_BACKEND": "memory",
+    "STORAGE_CACHE_DIR": os.path.join(_DATA_DIR, ".storage_cache"),
+    "SUPABASE_UPLOAD_MANIFEST": os.path.join(_DATA_DIR, ".supa_manifest.json"),
+    "WORKER_MODE": "off",
+    "RESTORE_MODE": "off",
+})
+for _k in ("SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY", "SUPABASE_ANON_KEY", "SUPABASE_LOCAL_DIR"):
+    os.environ.pop(_k, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+# Pool de connexions SQLite (auth.get_conn) : réutilisation entre threads successifs
+# (reruns Streamlit), borne sur les connexions gardées, transaction abandonnée annulée.
+import threading
+
+import auth
+
+
+def _in_thread(fn):
+    out = []
+    t = threading.Thread(target=lambda: out.append(fn()))
+    t.start()
+    t.join(10)
+    return out[0]
+
+
+def test_successive_threads_reuse_connections():
+    auth.get_conn()  # schéma créé
+    seen = {_in_thread(lambda: id(auth.get_conn())) for _ in range(20)}
+    assert len(seen) == 1
+
+
+def test_concurrent_threads_bounded_pool():
+    auth.get_conn()
+    start, hold = threading.Barrier(auth._DB_POOL_SIZE + 3), threading.Event()
+    conns = []
+
+    def _hold():
+        conns.append(auth.get_conn())
+        start.wait()
+        hold.wait(10)
+
+    threads = [threading.Thread(target=_hold) for _ in range(auth._DB_POOL_SIZE + 2)]
+    for t in threads:
+        t.start()
+    start.wait(10)
+    assert len({id(c) for c in conns}) == len(threads)  # pas de connexion partagée entre threads vivants
+    hold.set()
+    for t in threads:
+        t.join(10)
+    assert auth._pool.qsize() <= auth._DB_POOL_SIZE
+
+
+def test_abandoned_transaction_rolled_back():
+    def _write():
+        conn = auth.get_conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS pool_probe(x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO pool_probe VALUES (1)")  # jamais validé
+        return conn.in_transaction
+
+    assert _in_thread(_write)
+    assert _in_thread(lambda: auth.get_conn().execute("SELECT COUNT(*) FROM pool_probe").fetchone()[0]) == 0
@@ -0,0 +1,37 @@
+# Téléchargements différés (bundles.lazy_file / lazy_zip) tels que st.download_button les consomme.
+import io
+
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+import bundles
+
+
+def _consume(callable_data):
+    data = callable_data()
+    out, _ = convert_data_to_bytes_and_infer_mime(data, unsupported_error=TypeError("type"))
+    return data, out
+
+
+def test_lazy_file_hands_open_file(tmp_path):
+    p = tmp_path / "copie.xlsm"
+    p.write_bytes(b"x" * 100_000)
+    handle, out = _consume(bundles.lazy_file(str(p)))
+    assert isinstance(handle, io.BufferedReader)
+    assert out == b"x" * 100_000
+    assert handle.closed
+
+
+def test_lazy_zip_builds_on_click(tmp_path):
+    src = tmp_path / "a.txt"
+    src.write_text("rapport")
+    calls = []
+
+    def _builder(paths):
+        calls.append(1)
+        return bundles.build_zip(paths, "test")
+
+    data = bundles.lazy_zip(_builder, [str(src)])
+    assert calls == []
+    handle, out = _consume(data)
+    assert calls == [1] and out[:2] == b"PK" and handle.closed
+    assert bundles.lazy_zip(lambda: None)() == b""
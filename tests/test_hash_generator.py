@@ -0,0 +1,116 @@
+# Génération des copies (hash_generator) : pool de processus, log des hashs, étudiants retirés du CSV,
+# parité du template préparé (prepare_template/render_student_copy) avec l'ancien chemin openpyxl.
+import csv
+import io
+import json
+import os
+import zipfile
+
+import openpyxl
+import pytest
+from openpyxl.styles import Protection
+
+import hash_generator
+from integrity import SIG_SHEET, stamp_workbook, verify_workbook
+
+
+def _log(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(hash_generator._LOG_HEADER)
+        for r in rows:
+            w.writerow([r.get(k, "") for k in hash_generator._LOG_HEADER])
+
+
+def test_removed_students_pruned(tmp_path):
+    out, log = tmp_path / "copies", tmp_path / "hash_records.csv"
+    out.mkdir()
+    rows = [{"id_etudiant": sid, "nom": sid, "prenom": "p", "hash": "h", "nom_fichier": f"{sid}.xlsm",
+             "template_fp": "fp"} for sid in ("E1", "E2", "E3")]
+    for r in rows:
+        (out / r["nom_fichier"]).write_bytes(b"x")
+    _log(log, rows)
+
+    etudiants = [{"id": "E1", "nom": "E1", "prenom": "p"}, {"id": "E3", "nom": "E3", "prenom": "p"}]
+    generated, skipped, failed, removed = hash_generator.merge_hash_log(etudiants, {}, str(out), str(log), "fp")
+
+    assert removed == ["E2.xlsm"]
+    assert [r["id_etudiant"] for r in skipped] == ["E1", "E3"]
+    assert sorted(p.name for p in out.iterdir()) == ["E1.xlsm", "E3.xlsm"]
+    assert list(hash_generator._read_hash_log(str(log))) == ["E1", "E3"]
+    # relancée, la fusion n'a plus rien à retirer
+    assert hash_generator.merge_hash_log(etudiants, {}, str(out), str(log), "fp")[3] == []
+
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "Fichier_Excel_Professeur_Template.xlsm")
+
+
+def test_generation_pool(tmp_path):
+    students = tmp_path / "liste.csv"
+    students.write_text("id,nom,prenom\nE1,Un,A\nE2,Deux,B\nE3,Trois,C\n", encoding="utf-8")
+    res = hash_generator.generate_student_files_csv(
+        input_csv=str(students), template_path=TEMPLATE, output_folder=str(tmp_path / "copies"),
+        log_file=str(tmp_path / "hash_records.csv"), workers=2)
+    assert not res["failed"]
+    assert sorted(r["id"] for r in res["generated"]) == ["E1", "E2", "E3"]
+    assert len(list((tmp_path / "copies").glob("*.xlsm"))) == 3
+
+
+def _openpyxl_copy(template_path, uid, template_version="v1.0.0"):
+    """Référence : une copie chargée, protégée et estampillée par openpyxl (ancien chemin)."""
+    wb = openpyxl.load_workbook(template_path, keep_vba=True, data_only=False)
+    ws = wb.active
+    ws["Z1"] = uid
+    h = hash_generator._hash_contenu(ws, uid)
+    ws["Z2"] = h
+    ws.column_dimensions["Z"].hidden = True
+    for row_cells in ws.iter_rows(min_row=2, max_row=ws.max_row or 2, min_col=3, max_col=25):
+        for cell in row_cells:
+            cell.protection = Protection(locked=False)
+    ws.protection.sheet = True
+    ws.protection.enable()
+    ws.protection.selectLockedCells = False
+    ws.protection.selectUnlockedCells = True
+    stamp_workbook(wb, template_version=template_version, student_id=uid, main_sheet_name=ws.title)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue(), h
+
+
+def _cells(data):
+    wb = openpyxl.load_workbook(io.BytesIO(data), keep_vba=True)
+    out = {}
+    for ws in wb.worksheets:
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is not None:
+                    out[(ws.title, cell.coordinate)] = cell.value
+    header = json.loads(out.pop((SIG_SHEET, "B1")))
+    header.pop("generated_at")
+    states = {ws.title: (ws.sheet_state, bool(ws.protection.sheet)) for ws in wb.worksheets}
+    return out, header, states, wb.active.column_dimensions["Z"].hidden
+
+
+@pytest.mark.parametrize("uid", ["E42", "E&<1>"])
+def test_prepared_template_matches_openpyxl(tmp_path, uid):
+    expected, expected_hash = _openpyxl_copy(TEMPLATE, uid)
+    data, h = hash_generator.render_student_copy(hash_generator.prepare_template(TEMPLATE), uid)
+
+    assert h == expected_hash
+    assert _cells(data) == _cells(expected)  # cellule par cellule, Z2 et feuille _sig comprises
+
+    with zipfile.ZipFile(TEMPLATE) as z:
+        vba = z.read("xl/vbaProject.bin")
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.read("xl/vbaProject.bin") == vba  # macros conservées
+
+    # même verdict de verify_workbook que la copie de référence
+    verdicts = []
+    for name, content in (("rapide.xlsm", data), ("reference.xlsm", expected)):
+        path = tmp_path / name
+        path.write_bytes(content)
+        main = openpyxl.load_workbook(path).active.title
+        header, changed, issues = verify_workbook(str(path), main_sheet_name=main)
+        verdicts.append((header["student_id"], changed, issues))
+    assert verdicts[0] == verdicts[1] and verdicts[0][:2] == (uid, [])
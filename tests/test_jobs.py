@@ -0,0 +1,53 @@
+# File de travaux (auth.jobs) : réservation immédiate depuis l'app (claim_job) face au worker (claim_jobs).
+import threading
+
+import auth
+
+
+def test_claim_job_excludes_worker():
+    conn = auth.get_conn()
+    auth.enqueue_job(conn, "analyze", "claim-a.xlsm", user_id="stu-a")
+    job = auth.claim_job(conn, "analyze", "claim-a.xlsm", "stu-a")
+    assert job and job["status"] == "running"
+    assert all(j["key"] != "claim-a.xlsm" for j in auth.claim_jobs(conn, ["analyze"], 10))
+    assert auth.claim_job(conn, "analyze", "claim-a.xlsm", "stu-a") is None
+    auth.finish_job(conn, job["id"], "ok")
+    again = auth.claim_job(conn, "analyze", "claim-a.xlsm", "stu-a")  # relancer une analyse terminée
+    assert again and again["attempts"] == 1
+    auth.finish_job(conn, again["id"], "ok")
+
+
+def test_claim_job_creates_missing_and_serializes_per_user():
+    conn = auth.get_conn()
+    first = auth.claim_job(conn, "analyze", "claim-b1.xlsm", "stu-b")
+    assert first and first["attempts"] == 1
+    assert auth.claim_job(conn, "analyze", "claim-b2.xlsm", "stu-b") is None  # même étudiant en cours
+    auth.finish_job(conn, first["id"], "ok")
+    second = auth.claim_job(conn, "analyze", "claim-b2.xlsm", "stu-b")
+    assert second is not None
+    auth.finish_job(conn, second["id"], "ok")
+
+
+def test_claim_race_single_winner():
+    conn = auth.get_conn()
+    for i in range(20):
+        key = f"race-{i}.xlsm"
+        auth.enqueue_job(conn, "race", key)
+        got, start = [], threading.Barrier(2)
+
+        def _worker():
+            start.wait()
+            got.extend(j["key"] for j in auth.claim_jobs(auth.get_conn(), ["race"], 1))
+
+        def _app():
+            start.wait()
+            if auth.claim_job(auth.get_conn(), "race", key):
+                got.append(key)
+
+        threads = [threading.Thread(target=_worker), threading.Thread(target=_app)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        assert got == [key]
+        auth.finish_job(conn, auth.job_statuses(conn, "race", [key])[key]["id"])
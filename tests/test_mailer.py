@@ -0,0 +1,179 @@
+# Envoi SMTP (mailer.py) et file d'envoi (auth.dispatch_outbox) contre un serveur SMTP
+# minimal local (socketserver) : réutilisation des connexions, débit, pas de renvoi
+# après DATA, nouvel essai avec backoff dans l'outbox, progression dans le thread appelant.
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import auth
+import mailer
+
+
+class _SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []            # (instant, destinataires)
+        self.max_per_conn = 0         # >0 : connexion fermée après N messages (inactivité côté serveur)
+        self.drop_after_data = False  # message reçu puis connexion coupée sans réponse
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        srv = self.server
+        with srv.lock:
+            srv.connections += 1
+        self._reply("220 stand-in ESMTP")
+        rcpts, sent = [], 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors="replace").strip()
+            verb = cmd.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self._reply("250-stand-in")
+                self._reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                self._reply("235 ok")
+            elif verb == "MAIL":
+                rcpts = []
+                self._reply("250 ok")
+            elif verb == "RCPT":
+                if "reject" in cmd.lower():
+                    self._reply("550 no such user")
+                else:
+                    rcpts.append(cmd)
+                    self._reply("250 ok")
+            elif verb == "DATA":
+                self._reply("354 go")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with srv.lock:
+                    srv.messages.append((time.monotonic(), rcpts))
+                if srv.drop_after_data:
+                    return
+                self._reply("250 queued")
+                sent += 1
+                if srv.max_per_conn and sent >= srv.max_per_conn:
+                    return
+            elif verb == "QUIT":
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("250 ok")
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    srv = _SMTPStandIn()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    port = srv.server_address[1]
+    monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(port))
+    monkeypatch.setenv("SMTP_USER", "user")
+    monkeypatch.setenv("SMTP_PASS", "pass")
+    monkeypatch.setenv("SMTP_FROM", "SmartEditTrack <no-reply@example.test>")
+    monkeypatch.delenv("RESEND_API_KEY", raising=False)
+    monkeypatch.setattr(mailer, "_transport", ("127.0.0.1", port, False, False))
+    yield srv
+    mailer._smtp_close()
+    srv.shutdown()
+    srv.server_close()
+
+
+def _items(n, prefix="eleve"):
+    return [{"email": f"{prefix}{i}@example.test", "user_id": f"{prefix}{i}", "password": "pw"} for i in range(n)]
+
+
+def test_batch_reuses_one_connection_per_worker(smtp):
+    res = mailer.send_credentials_batch(_items(6), workers=2, rate_per_sec=0)
+    assert all(r["ok"] for r in res)
+    assert len(smtp.messages) == 6
+    assert smtp.connections == 2
+
+
+def test_batch_rate_limit(smtp):
+    t0 = time.monotonic()
+    res = mailer.send_credentials_batch(_items(6), workers=3, rate_per_sec=10)
+    assert all(r["ok"] for r in res)
+    assert time.monotonic() - t0 >= 0.45  # créneaux à 0, 0.1, ..., 0.5 s
+    stamps = sorted(t for t, _ in smtp.messages)
+    assert stamps[-1] - stamps[0] >= 0.45
+
+
+def test_reconnect_when_closed_before_data(smtp):
+    smtp.max_per_conn = 1  # la connexion réutilisée est morte au message suivant
+    res = mailer.send_credentials_batch(_items(3), workers=1, rate_per_sec=0)
+    assert all(r["ok"] for r in res)
+    assert len(smtp.messages) == 3
+    assert smtp.connections == 3
+
+
+def test_no_resend_after_data(smtp):
+    smtp.drop_after_data = True
+    res = mailer.send_credentials_batch(_items(1), workers=1, rate_per_sec=0)
+    assert not res[0]["ok"]
+    assert len(smtp.messages) == 1  # reçu une fois, pas renvoyé
+
+
+def _outbox_row(conn, oid):
+    return conn.execute("SELECT status, attempts, next_attempt_at, temp_pwd FROM outbox WHERE id=?",
+                        (oid,)).fetchone()
+
+
+def test_outbox_retry_backoff(smtp):
+    conn = auth.get_conn()
+    ok_id, bad_id = auth.enqueue_credentials(conn, [
+        ("ok@example.test", "ok", "pw", None),
+        ("reject@example.test", "rej", "pw", None),
+    ])
+    res = auth.dispatch_outbox(conn, ids=[ok_id, bad_id])
+    assert res == {"sent": 1, "failed": 0, "pending": 1}
+    assert _outbox_row(conn, ok_id)[0] == "sent"
+
+    status, attempts, nxt, pwd = _outbox_row(conn, bad_id)
+    assert (status, attempts, pwd) == ("pending", 1, "pw")
+    delay = (datetime.fromisoformat(str(nxt)) - auth._now_utc().replace(tzinfo=None)).total_seconds()
+    assert auth.OUTBOX_RETRY_SECS - 5 <= delay <= auth.OUTBOX_RETRY_SECS
+
+    # échéance non atteinte : rien n'est renvoyé
+    assert auth.dispatch_outbox(conn) == {"sent": 0, "failed": 0, "pending": 0}
+    assert len(smtp.messages) == 1
+
+    for n in range(2, auth.OUTBOX_MAX_ATTEMPTS):
+        auth.dispatch_outbox(conn, ids=[bad_id])
+        status, attempts, nxt, _ = _outbox_row(conn, bad_id)
+        delay = (datetime.fromisoformat(str(nxt)) - auth._now_utc().replace(tzinfo=None)).total_seconds()
+        assert (status, attempts) == ("pending", n)
+        assert auth.OUTBOX_RETRY_SECS * 2 ** (n - 1) - 5 <= delay <= auth.OUTBOX_RETRY_SECS * 2 ** (n - 1)
+    assert auth.dispatch_outbox(conn, ids=[bad_id])["failed"] == 1
+    status, attempts, _, pwd = _outbox_row(conn, bad_id)
+    assert (status, attempts, pwd) == ("failed", auth.OUTBOX_MAX_ATTEMPTS, None)
+
+
+def test_progress_callback_in_calling_thread(smtp):
+    # comme st.progress : refuse d'être appelé hors du thread du script
+    caller, calls = threading.current_thread(), []
+
+    def _progress(done, total):
+        if threading.current_thread() is not caller:
+            raise RuntimeError("NoSessionContext")
+        calls.append((done, total))
+
+    conn = auth.get_conn()
+    ids = auth.enqueue_credentials(conn, [(f"p{i}@example.test", f"p{i}", "pw", None) for i in range(10)])
+    res = auth.dispatch_outbox(conn, ids=ids, progress_callback=_progress)
+    assert res == {"sent": 10, "failed": 0, "pending": 0}
+    assert calls == [(n, 10) for n in range(1, 11)]
+    assert len(smtp.messages) == 10
@@ -0,0 +1,31 @@
+# Migrations numérotées (auth._MIGRATIONS) : schéma à jour, reprise de l'ancien notif_depot.json.
+import json
+import os
+
+import auth
+
+
+def test_schema_up_to_date():
+    conn = auth.get_conn()
+    assert auth.schema_version(conn) == auth.SCHEMA_VERSION
+    assert auth.migrate(conn) == 0
+
+
+def test_notif_json_moved_to_deposits():
+    conn = auth.get_conn()
+    deposits = os.path.join(auth.DATA_DIR, "copies_etudiants")
+    os.makedirs(deposits, exist_ok=True)
+    fn = "Classe__E123_Dupont.xlsm"
+    with open(os.path.join(deposits, fn), "wb") as f:
+        f.write(b"copie")
+    notif = os.path.join(auth.DATA_DIR, "notif_depot.json")
+    with open(notif, "w", encoding="utf-8") as f:
+        json.dump([fn, "sans-identifiant.xlsm", "Classe__E999_absent.xlsm"], f)
+
+    auth._m007_notif_json(conn)
+    conn.commit()
+
+    rows = conn.execute("SELECT user_id, path, size, sha256 FROM deposits WHERE path LIKE 'Classe__E%'").fetchall()
+    assert [tuple(r[:3]) for r in rows] == [("E123", fn, 5)]
+    assert len(rows[0][3]) == 64
+    assert not os.path.exists(notif) and os.path.exists(notif + ".migrated")
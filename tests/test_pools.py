@@ -0,0 +1,21 @@
+# Pools de processus (pools.py) : "spawn", utilisés pour le hachage bcrypt de l'import CSV.
+import pytest
+
+import auth
+import pools
+
+
+def test_pools_spawn():
+    assert pools.MP_CONTEXT.get_start_method() == "spawn"
+
+
+def test_hash_many_in_spawned_pool(monkeypatch):
+    try:
+        auth._hash("x")
+    except ValueError as e:  # passlib 1.7 et bcrypt >= 4.1 : backend inutilisable
+        pytest.skip(f"bcrypt indisponible : {e}")
+    monkeypatch.setattr(auth, "HASH_WORKERS", 2)
+    pwds = [f"mdp-{i}" for i in range(auth._HASH_POOL_MIN)]
+    hashes = auth._hash_many(pwds)
+    assert len(hashes) == len(pwds)
+    assert all(auth._verify(h, p) for h, p in zip(hashes, pwds))
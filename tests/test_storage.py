@@ -0,0 +1,168 @@
+# storage.py : contrat commun des backends (mémoire, disque), cache disque LRU et CachedBucket.
+import os
+import time
+
+import pytest
+
+import storage
+
+
+@pytest.fixture(params=["memory", "local"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return storage.MemoryBackend("test")
+    return storage.LocalBackend(str(tmp_path / "bucket"), "test")
+
+
+def test_backend_upload_download_upsert(backend):
+    backend.upload("a/b/one.txt", b"1")
+    assert backend.download("a/b/one.txt") == b"1"
+    with pytest.raises(RuntimeError):
+        backend.upload("a/b/one.txt", b"2")
+    backend.upload("a/b/one.txt", b"2", {"x-upsert": "true"})
+    assert backend.download("/a/b/one.txt") == b"2"
+    with pytest.raises(FileNotFoundError):
+        backend.download("a/b/missing.txt")
+
+
+def test_backend_list_and_remove(backend):
+    for name in ("c.txt", "a.txt", "b.txt"):
+        backend.upload(f"dir/{name}", name.encode())
+    backend.upload("dir/sub/d.txt", b"d")
+    listing = backend.list("dir")
+    assert [e["name"] for e in listing] == ["a.txt", "b.txt", "c.txt", "sub"]
+    assert listing[0]["metadata"]["size"] == 5 and listing[-1]["metadata"] is None  # dossier
+    assert [e["name"] for e in backend.list("dir", {"limit": 2, "offset": 1})] == ["b.txt", "c.txt"]
+    assert backend.list("nowhere") == []
+
+    assert backend.remove(["dir/a.txt", "dir/absent.txt"]) == [{"name": "dir/a.txt"}]
+    assert [e["name"] for e in backend.list("dir")] == ["b.txt", "c.txt", "sub"]
+
+
+def test_backend_rejects_paths_outside_bucket(backend):
+    with pytest.raises(ValueError):
+        backend.upload("../evil.txt", b"x")
+
+
+def test_backend_signed_urls(backend):
+    backend.upload("s/one.txt", b"1")
+    urls = backend.create_signed_urls(["s/one.txt"], 60)
+    assert urls[0]["path"] == "s/one.txt" and "expires=" in urls[0]["signedURL"]
+
+
+def test_local_backend_accepts_paths_and_file_objects(tmp_path):
+    b = storage.LocalBackend(str(tmp_path / "bucket"))
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"payload")
+    b.upload("from-path.bin", str(src))
+    with open(src, "rb") as f:
+        b.upload("from-file.bin", f)
+    assert b.download("from-path.bin") == b.download("from-file.bin") == b"payload"
+
+
+def _cache(tmp_path, max_bytes=100, ttl=0, rescan=5):
+    return storage.DiskLRUCache(str(tmp_path / "cache"), max_bytes, ttl_secs=ttl, rescan_secs=rescan)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    c = _cache(tmp_path)
+    for name in ("a", "b", "c", "d"):
+        c.put(name, b"x" * 25)
+    assert c.get("a") == b"x" * 25  # "a" redevient le plus récent
+    c.put("e", b"y" * 25)
+    assert c.get("b") is None and c.get("a") is not None
+    assert c.total_bytes <= c.max_bytes
+    assert c.stats["evictions"] == 1
+
+
+def test_cache_skips_big_objects_and_expires(tmp_path):
+    c = _cache(tmp_path, ttl=0.2)
+    c.put("big", b"x" * 26)  # > max_bytes // 4
+    assert c.get("big") is None
+    c.put("small", b"s")
+    assert c.get("small") == b"s"
+    time.sleep(0.3)
+    assert c.get("small") is None
+    assert c.stats["expired"] == 1
+
+
+def test_cache_survives_restart(tmp_path):
+    c = _cache(tmp_path)
+    c.put("kept", b"k" * 10)
+    again = _cache(tmp_path)
+    assert again.total_bytes == 10
+    assert again.get("kept") == b"k" * 10
+
+
+def test_cache_budget_shared_between_processes(tmp_path):
+    # deux instances sur le même dossier = l'app et le worker
+    app, worker = _cache(tmp_path, rescan=0), _cache(tmp_path, rescan=0)
+    for i in range(4):
+        app.put(f"app-{i}", b"a" * 25)
+        worker.put(f"worker-{i}", b"w" * 25)
+    on_disk = sum(e.stat().st_size for e in os.scandir(tmp_path / "cache"))
+    assert on_disk <= 100
+    assert worker.get("worker-3") == b"w" * 25
+    assert app.get("worker-3") == b"w" * 25  # copie de l'autre processus reprise
+    assert app.get("app-0") is None
+
+
+def test_cache_put_rescans_only_when_needed(tmp_path, monkeypatch):
+    c = _cache(tmp_path, max_bytes=100_000, rescan=3600)
+    scans, real = [], os.scandir
+    monkeypatch.setattr(storage.os, "scandir", lambda p: scans.append(p) or real(p))
+    for i in range(500):
+        c.put(f"obj-{i}", b"x" * 100)
+    assert scans == []   # comptage incrémental, pas de scandir par put
+    assert c.total_bytes == 50_000 and len(c._entries) == 500
+    c.put("obj-0", b"y" * 50)   # remplacement : ancienne taille retirée
+    assert c.total_bytes == 49_950
+
+    for i in range(500, 1100):
+        c.put(f"obj-{i}", b"x" * 100)
+    assert len(scans) >= 1   # budget dépassé : relecture du dossier avant éviction
+    assert c.total_bytes <= c.max_bytes
+    assert c.get("obj-1") is None and c.get("obj-1099") is not None
+
+
+def test_cached_bucket_read_and_write_through(tmp_path):
+    backend = storage.MemoryBackend()
+    bucket = storage.CachedBucket(backend, _cache(tmp_path, max_bytes=1000), skip_prefixes=("manifests/",))
+    bucket.upload("classes/x.csv", b"csv")
+    backend._objects.clear()  # servi par le cache, plus par le backend
+    assert bucket.download("classes/x.csv") == b"csv"
+
+    backend.upload("classes/y.csv", b"y")
+    assert bucket.cached("classes/y.csv") is None
+    assert bucket.download("classes/y.csv") == b"y"  # read-through
+    assert bucket.cached("classes/y.csv") == b"y"
+
+    bucket.remove(["classes/y.csv"])
+    assert bucket.cached("classes/y.csv") is None
+
+    bucket.upload("manifests/m.json", b"{}")
+    assert bucket.cached("manifests/m.json") is None  # préfixe jamais mis en cache
+    bucket.remember("classes/z.csv", b"z")
+    assert bucket.cached("classes/z.csv") == b"z"
+
+
+def test_cached_bucket_failed_upload_discards_copy(tmp_path):
+    class Failing(storage.MemoryBackend):
+        def upload(self, path, file, file_options=None):
+            raise RuntimeError("down")
+
+    bucket = storage.CachedBucket(Failing(), _cache(tmp_path, max_bytes=1000))
+    bucket.remember("f.txt", b"old")
+    with pytest.raises(RuntimeError):
+        bucket.upload("f.txt", b"new")
+    assert bucket.cached("f.txt") is None
+
+
+def test_open_bucket_kinds(tmp_path):
+    assert isinstance(storage.open_bucket("local", local_dir=str(tmp_path / "l")), storage.LocalBackend)
+    cached = storage.open_bucket("memory", cache_dir=str(tmp_path / "c"), cache_max_bytes=1024)
+    assert isinstance(cached, storage.CachedBucket) and isinstance(cached.backend, storage.MemoryBackend)
+    assert isinstance(storage.open_bucket("memory", cache_max_bytes=0), storage.MemoryBackend)
+    with pytest.raises(ValueError):
+        storage.open_bucket("ftp")
+    assert os.path.isdir(tmp_path / "c")
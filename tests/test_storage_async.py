@@ -0,0 +1,134 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import storage
+import supa
+import storage_async
+from storage_async import AsyncStorageClient, LocalStorageTransport, StorageError
+
+
+def _in_forked_child(fn, *args, timeout: float = 20):
+    """Exécute fn(*args) dans un enfant forké ; un enfant bloqué est tué (échec, pas de blocage du test)."""
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork"))
+    try:
+        return pool.submit(fn, *args).result(timeout=timeout)
+    finally:
+        for proc in list(pool._processes.values()):
+            proc.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _child_upload(path: str) -> list[str]:
+    return [r["status"] for r in supa.upload_batch([(path, "fork/child.txt")], retries=0)]
+
+
+def test_upload_batch_in_forked_child_after_parent_use(tmp_path):
+    src = tmp_path / "a.txt"
+    src.write_text("parent")
+    # le parent démarre la boucle de fond et le client asyncio
+    assert [r["status"] for r in supa.upload_batch([(str(src), "fork/parent.txt")])] == ["uploaded"]
+    assert storage_async._loop is not None
+
+    assert _in_forked_child(_child_upload, str(src)) == ["uploaded"]
+
+
+def test_run_sync_in_forked_child():
+    async def _answer():
+        return 42
+
+    assert storage_async.run_sync(_answer()) == 42
+    assert _in_forked_child(_run_sync_child) == 42
+
+
+def _run_sync_child() -> int:
+    async def _answer():
+        return 42
+    return storage_async.run_sync(_answer(), timeout=10)
+
+
+@pytest.fixture
+def client():
+    store = storage.MemoryBackend("b")
+    c = AsyncStorageClient("http://storage.local", "k", "b", transport=LocalStorageTransport(store, "b"))
+    yield c, store
+    storage_async.run_sync(c.aclose())
+
+
+def test_local_transport_routes(client):
+    c, store = client
+    run = storage_async.run_sync
+    run(c.upload("dir/é a.txt", b"data", "text/plain"))
+    assert store.download("dir/é a.txt") == b"data"  # multipart décodé, chemin échappé
+    assert run(c.download("dir/é a.txt")) == b"data"
+    assert [e["name"] for e in run(c.list("dir"))] == ["é a.txt"]
+    signed = run(c.create_signed_urls(["dir/é a.txt"], 60))
+    assert signed[0]["signedURL"]
+    assert run(c.remove(["dir/é a.txt"])) == [{"name": "dir/é a.txt"}]
+    with pytest.raises(StorageError) as err:
+        run(c.download("dir/é a.txt"))
+    assert err.value.status == 404
+    run(c.upload("dup.txt", b"1", upsert=False))
+    with pytest.raises(StorageError) as err:
+        run(c.upload("dup.txt", b"2", upsert=False))
+    assert err.value.status == 409
+
+
+def test_aretry_counts_attempts_and_gives_up():
+    calls = []
+
+    async def _flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError("transient")
+        return "ok"
+
+    assert storage_async.run_sync(storage_async.aretry(_flaky, retries=2, base_delay=0.01)) == ("ok", 3)
+    calls.clear()
+    with pytest.raises(OSError):
+        storage_async.run_sync(storage_async.aretry(_flaky, retries=1, base_delay=0.01))
+    assert len(calls) == 2
+
+
+def test_aretry_only_transient_errors(client):
+    c, _ = client
+    calls = []
+
+    def _missing():
+        calls.append(1)
+        return c.download("absent.txt")
+
+    with pytest.raises(StorageError) as err:
+        storage_async.run_sync(storage_async.aretry(_missing, retries=3, base_delay=0.01))
+    assert err.value.status == 404 and len(calls) == 1  # 4xx : pas de nouvel essai
+
+    async def _busy():
+        calls.append(1)
+        if len(calls) < 3:
+            raise StorageError(503, "busy")
+        return "ok"
+
+    calls.clear()
+    assert storage_async.run_sync(storage_async.aretry(_busy, retries=3, base_delay=0.01)) == ("ok", 3)
+
+
+def test_gather_bounded_limit_and_errors():
+    state = {"live": 0, "peak": 0}
+
+    def _task(i):
+        async def _run():
+            state["live"] += 1
+            state["peak"] = max(state["peak"], state["live"])
+            await asyncio.sleep(0.01)
+            state["live"] -= 1
+            if i == 3:
+                raise ValueError(i)
+            return i
+        return _run
+
+    got = dict(storage_async.iter_sync([_task(i) for i in range(10)], limit=3))
+    assert state["peak"] == 3
+    assert isinstance(got.pop(3), ValueError)
+    assert got == {i: i for i in range(10) if i != 3}
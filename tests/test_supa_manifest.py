@@ -0,0 +1,71 @@
+# Manifestes d'envoi (supa.upload_many / publish_manifest) : publication distante unique par
+# lot, pas d'aller-retour quand rien n'a changé, pas d'entrée perdue entre processus.
+import json
+import multiprocessing
+import os
+
+import supa
+
+
+def _files(tmp_path, n, prefix="m"):
+    out = []
+    for i in range(n):
+        p = tmp_path / f"{prefix}{i}.txt"
+        p.write_text(f"{prefix}-{i}")
+        out.append((str(p), f"manifest-test/{prefix}{i}.txt"))
+    return out
+
+
+def _count_fetches(monkeypatch):
+    calls = []
+    real = supa.fetch_remote_manifest
+    monkeypatch.setattr(supa, "fetch_remote_manifest", lambda: calls.append(1) or real())
+    return calls
+
+
+def test_unchanged_upload_skips_remote_publish(tmp_path, monkeypatch):
+    items = _files(tmp_path, 3)
+    assert {r["status"] for r in supa.upload_many(items)} == {"uploaded"}
+    files = supa.fetch_remote_manifest()
+    assert all(rp in files for _, rp in items)
+
+    calls = _count_fetches(monkeypatch)
+    assert {r["status"] for r in supa.upload_many(items)} == {"skipped"}
+    assert calls == []
+
+
+def test_batch_chunks_publish_once(tmp_path, monkeypatch):
+    items = _files(tmp_path, 4, prefix="chunk")
+    calls = _count_fetches(monkeypatch)
+    for i in range(0, len(items), 2):
+        supa.upload_many(items[i:i + 2], publish=False)
+    assert calls == []
+    assert not any(rp in (supa.fetch_remote_manifest() or {}) for _, rp in items)
+
+    supa.publish_manifest([rp for _, rp in items])
+    files = supa.fetch_remote_manifest()
+    assert all(rp in files for _, rp in items)
+
+
+def _publish_in_child(worker, n):
+    for i in range(n):
+        supa._publish_remote_manifest({f"w{worker}/{i}": {"sha256": str(i), "size": i}})
+
+
+def test_remote_manifest_concurrent_processes(tmp_path, monkeypatch):
+    # environnement hérité par les processus "spawn" : bucket local commun sur disque
+    bucket_dir = str(tmp_path / "bucket")
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("SUPABASE_LOCAL_DIR", bucket_dir)
+    monkeypatch.setenv("SUPABASE_UPLOAD_MANIFEST", str(tmp_path / "manifest.json"))
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_publish_in_child, args=(w, 15)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    with open(os.path.join(bucket_dir, "manifests", "data_dir.json"), encoding="utf-8") as f:
+        files = json.load(f)["files"]
+    assert len(files) == 4 * 15
@@ -0,0 +1,76 @@
+# Transferts en masse de supa.py (client asyncio sur le stand-in local, bucket en mémoire) :
+# upload_many (manifeste, erreurs, retries), iter_download (cache disque), delete_prefix.
+import supa
+
+
+def _write(tmp_path, name, text):
+    p = tmp_path / name
+    p.write_text(text)
+    return str(p)
+
+
+def test_upload_many_statuses(tmp_path):
+    a, b = _write(tmp_path, "a.txt", "a1"), _write(tmp_path, "b.txt", "b1")
+    items = [(a, "xfer/a.txt"), (b, "xfer/b.txt", "text/plain"), (str(tmp_path / "none.txt"), "xfer/none.txt")]
+    seen = []
+    res = {r["remote"]: r["status"] for r in supa.upload_many(items, progress_callback=lambda d, t, r: seen.append((d, t)))}
+    assert res == {"xfer/a.txt": "uploaded", "xfer/b.txt": "uploaded", "xfer/none.txt": "error"}
+    assert seen[-1] == (3, 3)
+
+    _write(tmp_path, "b.txt", "b2")  # contenu modifié : renvoyé
+    res = {r["remote"]: r["status"] for r in supa.upload_many(items[:2])}
+    assert res == {"xfer/a.txt": "skipped", "xfer/b.txt": "uploaded"}
+    assert supa.download_bytes("xfer/b.txt") == b"b2"
+    assert supa.fetch_remote_manifest()["xfer/b.txt"]["size"] == 2
+
+
+def test_upload_retries_transient_errors(tmp_path, monkeypatch):
+    client = supa.async_client()
+    real, calls = client.upload, []
+
+    async def _flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("connexion réinitialisée")
+        return await real(*args, **kwargs)
+
+    monkeypatch.setattr(client, "upload", _flaky)
+    path = _write(tmp_path, "r.txt", "retry")
+    res = supa.upload_batch([(path, "xfer/retry.txt")], retries=2)
+    assert (res[0]["status"], res[0]["attempts"]) == ("uploaded", 2)
+
+    calls.clear()
+    monkeypatch.setattr(client, "upload", lambda *a, **k: _always_fail())
+    res = supa.upload_batch([(path, "xfer/never.txt")], retries=0)
+    assert res[0]["status"] == "error" and "toujours" in res[0]["error"]
+
+
+async def _always_fail():
+    raise OSError("toujours en panne")
+
+
+def test_iter_download_cache_and_missing(tmp_path):
+    supa.upload_bytes(b"cached", "xfer/dl/one.bin")
+    supa.upload_bytes(b"remote", "xfer/dl/two.bin")
+    store = supa._bucket()
+    store.cache.discard("xfer/dl/two.bin")  # seul "two" passe par le client asyncio
+    hits = store.cache.stats["hits"]
+
+    got = supa.download_many(["xfer/dl/one.bin", "xfer/dl/two.bin", "xfer/dl/missing.bin", "xfer/dl/one.bin"],
+                             retries=0)
+    assert got["xfer/dl/one.bin"] == b"cached" and got["xfer/dl/two.bin"] == b"remote"
+    assert isinstance(got["xfer/dl/missing.bin"], Exception)
+    assert store.cache.stats["hits"] == hits + 1
+    assert store.cached("xfer/dl/two.bin") == b"remote"  # copie locale gardée
+
+
+def test_delete_prefix_updates_manifests(tmp_path):
+    items = [(_write(tmp_path, f"d{i}.txt", str(i)), f"xfer/del/d{i}.txt") for i in range(3)]
+    supa.upload_many(items)
+    assert supa.delete_prefix("xfer/del")
+    assert not supa.list_prefix("xfer/del")
+    remote = supa.fetch_remote_manifest()
+    assert not any(rp in remote for _, rp in items)
+    assert not any(rp in supa._load_manifest(supa._MANIFEST_PATH) for _, rp in items)
+    # supprimés : un nouvel envoi n'est plus sauté
+    assert {r["status"] for r in supa.upload_many(items)} == {"uploaded"}
@@ -0,0 +1,40 @@
+import json
+import threading
+
+import auth
+import supa
+import worker
+
+
+def _run_batch(batch_id: int, concurrency: int = 1, timeout: float = 90):
+    """worker.run(batch_id=…) comme dans l'app ; échoue (au lieu de bloquer) s'il ne rend pas la main."""
+    stop = threading.Event()
+    t = threading.Thread(target=worker.run, args=(concurrency,),
+                         kwargs={"stop": stop, "batch_id": batch_id}, daemon=True)
+    t.start()
+    t.join(timeout)
+    stop.set()
+    assert not t.is_alive(), "lot bloqué"
+
+
+def test_upload_batch_in_app_after_prior_upload(tmp_path):
+    files = []
+    for i in range(3):
+        p = tmp_path / f"f{i}.txt"
+        p.write_text(f"contenu {i}")
+        files.append((str(p), f"tests/upload/f{i}.txt", "text/plain"))
+    # envoi préalable dans ce processus : boucle asyncio de fond + client démarrés
+    assert {r["status"] for r in supa.upload_batch(files[:1])} == {"uploaded"}
+
+    conn = auth.get_conn()
+    bid = auth.create_batch(conn, worker.UPLOAD, worker.upload_items(files), label="test", serial=True)
+    _run_batch(bid)
+
+    prog = auth.batch_progress(conn, bid)
+    assert prog["batch"]["status"] == "done"
+    assert prog["done"] == prog["total"] == 1
+    res = json.loads(auth.batch_items(conn, bid)[0]["result"])
+    assert res["uploaded"] + res["skipped"] == 3
+    # clôture du lot : manifeste distant publié une fois pour tous les paquets
+    remote = supa.fetch_remote_manifest() or {}
+    assert all(f[1] in remote for f in files)
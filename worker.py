@@ -0,0 +1,330 @@
+# worker.py — travaux en arrière-plan (file de travaux SQLite) : analyses, lots
+# ----------------------------------------------------------------------------------
+# app_etudiant met chaque dépôt en file (auth.enqueue_job("analyze", <fichier>)) ;
+# ce processus vide la file avec comparer_etudiant, sur un pool de processus borné :
+# quand le prof ouvre "Dépôts & Rapports", les rapports existent déjà.
+#   - un travail est réservé avec un bail (auth.JOB_LEASE_SECS), renouvelé tant qu'il
+#     tourne : si le worker meurt, le bail expire et le travail est repris ;
+#   - échec (exception) : nouvel essai avec backoff, abandon après JOB_MAX_ATTEMPTS ;
+#     rapport d'erreur de comparer_etudiant ("❌ …") : échec définitif, sans nouvel essai ;
+#   - jamais deux analyses du même étudiant en parallèle (historique JSON par étudiant).
+# Lots (auth.create_batch) : "Analyser tous", génération des copies, envoi Supabase,
+# contrôle d'intégrité des dépôts. Un job par élément : l'état est dans la BD, un lot
+# interrompu (redémarrage Render) reprend au premier élément non terminé. Quand un lot
+# est clos, FINALIZERS[kind] s'exécute (génération : fusion du log des hashs puis lot
+# d'envoi des copies ; envoi : une seule publication du manifeste distant). Sans worker
+# actif, l'app exécute elle-même le lot : run(batch_id=…).
+# Lancement : main.py démarre `python worker.py --parent <pid>` (WORKER_MODE=subprocess,
+# défaut) ; un verrou fichier garantit un seul worker par DATA_DIR. WORKER_MODE=off pour
+# le lancer à part (service "worker" Render, terminal).
+#   ANALYSIS_WORKERS=2, WORKER_POLL_SECS=2, UPLOAD_CHUNK=25 (fichiers par élément d'un lot d'envoi)
+# ----------------------------------------------------------------------------------
+
+import os, sys, json, time, signal, threading, subprocess
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from pools import process_pool  # processus en "spawn" : run() tourne aussi dans l'app Streamlit
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+DATA_DIR         = os.environ.get("DATA_DIR", "/tmp")
+DEPOSITS_DIR     = os.path.join(DATA_DIR, "copies_etudiants")
+WORKER_MODE      = os.environ.get("WORKER_MODE", "subprocess").strip().lower()
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+WORKER_POLL_SECS = float(os.environ.get("WORKER_POLL_SECS", "2"))
+UPLOAD_CHUNK     = int(os.environ.get("UPLOAD_CHUNK", "25"))
+_LOCK_PATH       = os.path.join(DATA_DIR, ".worker.lock")
+
+ANALYZE   = "analyze"
+GENERATE  = "generate"
+UPLOAD    = "upload"
+INTEGRITY = "integrity"
+
+
+class JobRejected(Exception):
+    """Échec définitif : inutile de réessayer."""
+
+
+# Handlers : handler(key, item, params) dans un processus du pool ; item = payload JSON
+# de l'élément, params = paramètres du lot (None hors lot). Le résultat (str) est stocké.
+def _analyze(key: str, item=None, params=None) -> str:
+    """Analyse d'un dépôt."""
+    from compare_excels import comparer_etudiant
+    path = os.path.join(DEPOSITS_DIR, key)
+    if not os.path.exists(path):
+        raise JobRejected(f"Fichier déposé introuvable : {key}")
+    res = comparer_etudiant(path)
+    if isinstance(res, str) and res.startswith("❌"):
+        raise JobRejected(res)
+    return res
+
+
+_PREPARED = {}  # par processus : (template, mtime_ns, version) -> (template préparé, empreinte)
+
+def _prepared(template_path: str, version: str):
+    from hash_generator import prepare_template, template_fingerprint
+    k = (template_path, os.stat(template_path).st_mtime_ns, version)
+    if k not in _PREPARED:
+        _PREPARED.clear()
+        _PREPARED[k] = (prepare_template(template_path, version), template_fingerprint(template_path, version))
+    return _PREPARED[k]
+
+
+def _generate(key: str, item: dict, params: dict) -> str:
+    """Copie d'un étudiant (item = {"id", "nom", "prenom"}) ; le template n'est préparé qu'une fois par processus."""
+    from hash_generator import _generate_one
+    if not os.path.exists(params["template"]):
+        raise JobRejected(f"Template introuvable : {params['template']}")
+    prepared, fp = _prepared(params["template"], params.get("template_version", "v1.0.0"))
+    os.makedirs(params["output_folder"], exist_ok=True)
+    res = _generate_one(item, params["output_folder"], prepared)
+    if not res["ok"]:
+        raise RuntimeError(res["error"])
+    return json.dumps({**res, "template_fp": fp}, ensure_ascii=False)
+
+
+def _upload(key: str, item: dict, params=None) -> str:
+    """Envoi d'un paquet de fichiers (item = {"files": [[local, remote, content_type], ...]})."""
+    try:
+        from supa import upload_many
+    except Exception as e:
+        raise JobRejected(f"Supabase indisponible : {e}")
+    results = upload_many([tuple(f) for f in item["files"]], publish=False)
+    errors = [r for r in results if r["status"] == "error"]
+    if errors:
+        raise RuntimeError("; ".join(f"{r['remote']} : {r['error']}" for r in errors[:3]))
+    return json.dumps({s: sum(r["status"] == s for r in results) for s in ("uploaded", "skipped")})
+
+
+def _integrity(key: str, item=None, params=None) -> str:
+    """Contrôle d'intégrité d'un dépôt (signatures _sig), sans analyse complète."""
+    import openpyxl
+    from integrity import verify_workbook
+    path = os.path.join(DEPOSITS_DIR, key)
+    if not os.path.exists(path):
+        raise JobRejected(f"Fichier déposé introuvable : {key}")
+    wb = openpyxl.load_workbook(path, read_only=True)
+    sheet = wb.active.title
+    wb.close()
+    header, changed, issues = verify_workbook(path, main_sheet_name=sheet)
+    return json.dumps({"student_id": header.get("student_id"), "n_changed": len(changed),
+                       "changed": changed[:50], "issues": issues}, ensure_ascii=False)
+
+
+HANDLERS = {ANALYZE: _analyze, GENERATE: _generate, UPLOAD: _upload, INTEGRITY: _integrity}
+
+
+def upload_items(files: list) -> list:
+    """Éléments d'un lot d'envoi (create_batch(..., serial=True)) : UPLOAD_CHUNK fichiers chacun."""
+    size = max(1, UPLOAD_CHUNK)
+    return [(str(n), None, {"files": [list(f) for f in files[i:i + size]]})
+            for n, i in enumerate(range(0, len(files), size), start=1)]
+
+
+def copies_upload_files(params: dict) -> list:
+    """Fichiers d'une classe à envoyer après génération : copies, CSV élèves, log des hashs."""
+    ct = "application/vnd.ms-excel.sheet.macroEnabled.12"
+    out_dir, slug = params["output_folder"], params["slug"]
+    files = [(os.path.join(out_dir, fname), f"copies/{slug}/{fname}", ct)
+             for fname in sorted(os.listdir(out_dir)) if fname.lower().endswith(".xlsm")]
+    files.append((params["csv"], f"classes/{slug}/liste_etudiants.csv", "text/csv"))
+    files.append((params["log_file"], f"classes/{slug}/{os.path.basename(params['log_file'])}", "text/csv"))
+    return files
+
+
+def _finalize_generate(conn, batch: dict):
+    """Lot de génération clos : fusion du log des hashs (copies des étudiants retirés supprimées),
+    puis (lot complet) lot d'envoi."""
+    from auth import batch_items, create_batch
+    from hash_generator import load_students, merge_hash_log
+    p = batch["params"]
+    results = {}
+    for it in batch_items(conn, batch["id"], ("done", "failed")):
+        if it["status"] == "done":
+            res = json.loads(it["result"])
+        else:
+            res = {**it["payload"], "nom_fichier": "", "ok": False, "error": it["last_error"]}
+        results[res["id"]] = res
+    *_, removed = merge_hash_log(load_students(p["csv"]), results, p["output_folder"], p["log_file"], p.get("fp"))
+    if removed and p.get("upload"):  # copies des étudiants retirés du CSV : retirées du bucket aussi
+        from supa import delete_many
+        delete_many([f"copies/{p['slug']}/{name}" for name in removed])
+    if batch["status"] == "done" and p.get("upload"):
+        create_batch(conn, UPLOAD, upload_items(copies_upload_files(p)), label=f"Envoi copies/{p['slug']}/",
+                     params={"slug": p["slug"]}, created_by=batch["created_by"], serial=True)
+
+
+def _finalize_upload(conn, batch: dict):
+    """Lot d'envoi clos : une seule mise à jour du manifeste distant pour tous ses paquets."""
+    from auth import batch_items
+    from supa import publish_manifest
+    publish_manifest([f[1] for it in batch_items(conn, batch["id"]) for f in it["payload"]["files"]])
+
+
+FINALIZERS = {GENERATE: _finalize_generate, UPLOAD: _finalize_upload}
+
+
+def _close_batches(conn):
+    from auth import close_batches, fail_batch
+    for batch in close_batches(conn):
+        fin = FINALIZERS.get(batch["kind"])
+        if fin is None:
+            continue
+        try:
+            fin(conn, batch)
+        except Exception as e:
+            fail_batch(conn, batch["id"], e)
+            print(f"[worker] lot {batch['id']} ({batch['kind']}) : finalisation en échec ({e})")
+
+
+def _on_done(conn, job: dict, fut) -> bool:
+    """Enregistre l'issue d'un travail. Retourne False si le pool est cassé (à recréer)."""
+    from auth import finish_job, fail_job, set_deposit_status
+    try:
+        res = fut.result()
+    except BrokenProcessPool as e:
+        fail_job(conn, job["id"], f"processus d'analyse interrompu ({e})")
+        return False
+    except JobRejected as e:
+        fail_job(conn, job["id"], e, retry=False)
+    except Exception as e:
+        status = fail_job(conn, job["id"], e)
+        print(f"[worker] {job['kind']} {job['key']} : échec ({e}) -> {status}")
+    else:
+        finish_job(conn, job["id"], res)
+        if job["kind"] == ANALYZE:
+            set_deposit_status(conn, job["key"], "analyzed", analyzed=True)
+    return True
+
+
+def run(concurrency: int = ANALYSIS_WORKERS, stop: threading.Event | None = None, parent_pid: int | None = None,
+        batch_id: int | None = None, on_progress=None):
+    """
+    Boucle principale : réserve, exécute, enregistre, jusqu'à `stop` (ou la mort du parent).
+    batch_id : ne traite que ce lot et rend la main quand il est clos (exécution dans l'app,
+    quand aucun worker ne tourne) ; on_progress(batch_progress) à chaque tour.
+    """
+    from auth import get_conn, claim_jobs, renew_jobs, release_jobs, get_batch, batch_progress, JOB_LEASE_SECS
+    stop = stop or threading.Event()
+    concurrency = max(1, int(concurrency))
+    conn = get_conn()
+    pool = process_pool(concurrency)
+    running = {}    # future -> job
+    params = {}     # batch_id -> paramètres du lot
+    last_renew = time.monotonic()
+
+    def _submit(job):
+        bid = job.get("batch_id")
+        if bid is not None and bid not in params:
+            params[bid] = (get_batch(conn, bid) or {}).get("params") or {}
+        item = json.loads(job["payload"]) if job.get("payload") else None
+        running[pool.submit(HANDLERS[job["kind"]], job["key"], item, params.get(bid))] = job
+
+    try:
+        while not stop.is_set():
+            if parent_pid and os.getppid() != parent_pid:
+                break   # l'app Streamlit s'est arrêtée
+            free = concurrency - len(running)
+            if free > 0:
+                for job in claim_jobs(conn, list(HANDLERS), free, batch_id=batch_id):
+                    _submit(job)
+            if not running:
+                _close_batches(conn)
+                if batch_id is not None:
+                    if on_progress:
+                        on_progress(batch_progress(conn, batch_id))
+                    if (get_batch(conn, batch_id) or {}).get("finished_at", True):
+                        break
+                stop.wait(WORKER_POLL_SECS)
+                continue
+            done, _ = wait(running, timeout=WORKER_POLL_SECS, return_when=FIRST_COMPLETED)
+            healthy = True
+            for fut in done:
+                healthy = _on_done(conn, running.pop(fut), fut) and healthy
+            if not healthy:
+                from auth import fail_job
+                for job in running.values():
+                    fail_job(conn, job["id"], "processus d'analyse interrompu")
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = process_pool(concurrency)
+            if done:
+                _close_batches(conn)
+            if running and time.monotonic() - last_renew > JOB_LEASE_SECS / 3:
+                renew_jobs(conn, [j["id"] for j in running.values()])
+                last_renew = time.monotonic()
+            if on_progress and batch_id is not None:
+                on_progress(batch_progress(conn, batch_id))
+    finally:
+        # arrêt : les travaux réservés repartent en file (sans attendre la fin de leur bail)
+        pool.shutdown(wait=False, cancel_futures=True)
+        if running:
+            release_jobs(conn, [j["id"] for j in running.values()])
+
+
+def is_active() -> bool:
+    """Un worker tient-il le verrou de DATA_DIR ? (sans fcntl : supposé actif si WORKER_MODE=subprocess)"""
+    if fcntl is None:
+        return WORKER_MODE == "subprocess"
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(_LOCK_PATH, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return False
+
+
+def _acquire_lock():
+    """Verrou exclusif non bloquant : None si un autre worker tient déjà DATA_DIR."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    f = open(_LOCK_PATH, "a")
+    if fcntl is not None:
+        for attempt in range(5):  # is_active() de l'app peut le tenir un instant
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if attempt == 4:
+                    f.close()
+                    return None
+                time.sleep(0.2)
+    return f
+
+
+def spawn():
+    """Démarre le worker en sous-processus (WORKER_MODE=subprocess). Retourne le Popen ou None."""
+    if WORKER_MODE != "subprocess":
+        return None
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, os.path.join(here, "worker.py"), "--parent", str(os.getpid())],
+                            cwd=here)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    parent_pid = int(argv[argv.index("--parent") + 1]) if "--parent" in argv else None
+    lock = _acquire_lock()
+    if lock is None:
+        print("[worker] déjà actif pour ce DATA_DIR.")
+        return 0
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    from auth import get_conn, release_jobs
+    n = release_jobs(get_conn())  # seul worker (verrou) : ce qui était en cours a été interrompu
+    print(f"[worker] démarré ({ANALYSIS_WORKERS} travaux en parallèle, {n} repris).")
+    try:
+        run(stop=stop, parent_pid=parent_pid)
+    finally:
+        lock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())